@@ -6,6 +6,7 @@ from django.utils.translation import gettext as _
 from cmnsd.admin import ReadOnlyAdmin
 
 from .models import *
+from .services import derivatives
 ''' Admin Actions - Used by more than one Model '''
 @admin.action(description=_('Softdelete'))
 def softdelete(modeladmin, request, queryset):
@@ -139,15 +140,13 @@ class ImageAdmin(admin.ModelAdmin):
 
   @admin.action(description='Reset thumbnails')
   def reset_thumbnail(modeladmin, request, queryset):
-    for object in queryset:
-      object.thumbnail = None
-      object.save()
+    queued = derivatives.enqueue(queryset.values_list('pk', flat=True))
+    messages.add_message(request, messages.SUCCESS, f"{ _('Queued thumbnails and derivatives of') } { queued } { _('images') }")
   
   @admin.action(description='Reset File Size')
   def resetSize(modeladmin, request, queryset):
-    for object in queryset:
-      object.storeSize()
-      messages.add_message(request, messages.SUCCESS, f"{ _('Succesfully reset size for') }: { object.title }")
+    queued = derivatives.enqueue(queryset.values_list('pk', flat=True), derivatives.METADATA)
+    messages.add_message(request, messages.SUCCESS, f"{ _('Queued reading size, dimensions and metadata of') } { queued } { _('images') }")
 
   list_display = ['id', 'slug', 'category', 'getSize', 'visibility_frontpage', 'year']
   list_display_links =['slug',]
@@ -220,6 +219,18 @@ class EventAdmin(admin.ModelAdmin):
   search_fields = ['title', 'description']
   sortable_by = ['id', 'type', 'year']
 
+class MediaJobAdmin(admin.ModelAdmin):
+  @admin.action(description=_('Queue again'))
+  def requeue(modeladmin, request, queryset):
+    for task in derivatives.TASKS:
+      derivatives.enqueue(queryset.filter(task=task).values_list('image', flat=True), task)
+
+  list_display = ['id', 'image', 'task', 'status', 'attempts', 'date_started', 'date_finished']
+  list_filter = ['task', 'status']
+  readonly_fields = ['date_created', 'date_started', 'date_finished']
+  raw_id_fields = ['image']
+  actions = [requeue]
+
 ''' Register Admin Models '''
 admin.site.register(Attachment, AttachmentAdmin)
 admin.site.register(Comment, CommentAdmin)
@@ -232,4 +243,5 @@ admin.site.register(Preference)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Location, LocationAdmin)
-admin.site.register(Event, EventAdmin)
\ No newline at end of file
+admin.site.register(Event, EventAdmin)
+admin.site.register(MediaJob, MediaJobAdmin)
\ No newline at end of file
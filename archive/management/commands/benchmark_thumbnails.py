@@ -0,0 +1,85 @@
+""" benchmark_thumbnails
+    Compares time and peak memory per thumbnail of a full decode (how
+    thumbnails were made before) with the reduced decode of
+    archive/services/imaging.py, on synthetic scans or on given files.
+    Scans are generated and every thumbnail is made in a fresh process, so
+    the peak memory (resident set) reported is that of one thumbnail plus
+    the interpreter. No database access is needed.
+
+    Usage: manage.py benchmark_thumbnails [--megapixels 25 100] [--formats jpeg png tiff]
+                                          [--files scan.tif ...]
+"""
+
+import multiprocessing
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from PIL import Image as PIL
+
+from archive.services import imaging
+
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'tiff': 'tif'}
+
+
+def measure(method, path):
+  """ (seconds, peak memory in MB) of one thumbnail of path; run in a fresh process """
+  PIL.MAX_IMAGE_PIXELS = imaging.MAX_IMAGE_PIXELS
+  start = time.perf_counter()
+  if method == 'full':
+    with PIL.open(path) as image:
+      image.load()
+      image = image.convert('RGB').resize(
+        (imaging.THUMBNAIL_SIZE[0], max(1, round(image.height * imaging.THUMBNAIL_SIZE[0] / image.width))), PIL.Resampling.LANCZOS,
+      )
+  else:
+    image = imaging.open_scaled(path, imaging.THUMBNAIL_SIZE[0])
+    image.thumbnail(imaging.THUMBNAIL_SIZE, PIL.Resampling.LANCZOS)
+  elapsed = time.perf_counter() - start
+  return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_scan(directory, megapixels, format):
+  """ Noisy grey-brown scan of about megapixels, 3:2 """
+  width = int((megapixels * 1000000 * 1.5) ** 0.5)
+  height = int(width / 1.5)
+  grain = PIL.effect_noise((width // 16, height // 16), 40).resize((width, height), PIL.Resampling.BILINEAR)
+  image = PIL.merge('RGB', [grain.point(lambda value: value * factor) for factor in (0.9, 0.8, 0.65)])
+  path = Path(directory).joinpath(f"scan-{ megapixels }mp.{ EXTENSIONS[format] }")
+  image.save(path, quality=90) if format == 'jpeg' else image.save(path)
+  return path
+
+
+class Command(BaseCommand):
+  help = 'Benchmark time and memory per thumbnail of large scans'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--megapixels', nargs='+', type=int, default=[25, 100], help='Sizes of the synthetic scans')
+    parser.add_argument('--formats', nargs='+', choices=list(EXTENSIONS), default=list(EXTENSIONS), help='Formats of the synthetic scans')
+    parser.add_argument('--files', nargs='+', default=[], help='Benchmark these files instead of synthetic scans')
+
+  def handle(self, *args, **options):
+    with tempfile.TemporaryDirectory() as directory:
+      files = [Path(file) for file in options['files']]
+      if not files:
+        for megapixels in options['megapixels']:
+          for format in options['formats']:
+            self.stdout.write(f"Generating { megapixels } MP { format }...")
+            files.append(self.run(synthetic_scan, directory, megapixels, format))
+      self.stdout.write(f"{ 'file':<24} { 'MP':>6} { 'full':>9} { 'peak':>9} { 'reduced':>9} { 'peak':>9}")
+      for path in files:
+        with PIL.open(path) as image:
+          megapixels = image.width * image.height / 1000000
+        full, full_memory = self.run(measure, 'full', str(path))
+        reduced, reduced_memory = self.run(measure, 'reduced', str(path))
+        self.stdout.write(
+          f"{ path.name[:24]:<24} { megapixels:>6.0f} { full:>8.2f}s { full_memory:>7.0f}MB { reduced:>8.2f}s { reduced_memory:>7.0f}MB"
+        )
+
+  def run(self, function, *args):
+    """ function(*args) in a new interpreter, which does not inherit the peak memory of this one """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+      return pool.submit(function, *args).result()
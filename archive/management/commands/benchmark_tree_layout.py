@@ -0,0 +1,116 @@
+""" benchmark_tree_layout
+    Compares the built-in tree layout with graphviz on synthetic family
+    trees. Trees are generated in memory, no database access is needed.
+
+    Usage: manage.py benchmark_tree_layout [--sizes 100 1000 10000] [--repeat 3] [--no-graphviz]
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from archive.services.tree_cache import render_graphviz
+from archive.services.tree_layout import TreeLayout
+from archive.views.tree import Tree
+
+
+class SyntheticPerson:
+  """ Minimal stand-in for Person with the methods Tree and TreeLayout use """
+  avatar_key = ''
+
+  def __init__(self, id, gender, birth):
+    self.id = id
+    self.gender = gender
+    self.birth_year = birth
+
+  def full_name(self):
+    return f"Person { self.id }"
+
+  def get_gender_display(self):
+    return {'m': 'Male', 'f': 'Female'}.get(self.gender, 'Unknown')
+
+  def get_lifespan(self):
+    return f"{ self.birth_year } - { self.birth_year + 75 }"
+
+
+class SyntheticTree(Tree):
+  """ Tree built from generated relations instead of the family graph """
+  def __init__(self, size, seed=0):
+    self.size = size
+    self.seed = seed
+    super().__init__(SyntheticPerson(1, 'm', 1700), backend='builtin')
+
+  def load(self, ancestor):
+    generator = random.Random(self.seed)
+    self.persons = {ancestor.id: ancestor}
+    self.partner_ids = {ancestor.id: []}
+    self.children_ids = {ancestor.id: []}
+    self.parent_ids = {ancestor.id: []}
+    self.collapsed = set()
+
+    def add(gender, birth):
+      id = len(self.persons) + 1
+      self.persons[id] = SyntheticPerson(id, gender, birth)
+      self.partner_ids[id] = []
+      self.children_ids[id] = []
+      self.parent_ids[id] = []
+      return id
+
+    queue = [ancestor.id]
+    while queue and len(self.persons) < self.size:
+      id = queue.pop(0)
+      person = self.persons[id]
+      ''' Up to two partners, each with up to four children '''
+      for relation in range(generator.choice([1, 1, 1, 2])):
+        if len(self.persons) >= self.size:
+          break
+        partner = add('f' if person.gender == 'm' else 'm', person.birth_year + generator.randint(-5, 5))
+        self.partner_ids[id].append(partner)
+        self.partner_ids[partner].append(id)
+        for child in range(generator.randint(1, 4)):
+          if len(self.persons) >= self.size:
+            break
+          child = add(generator.choice(['m', 'f']), person.birth_year + generator.randint(20, 40))
+          for parent in (id, partner):
+            self.children_ids[parent].append(child)
+            self.parent_ids[child].append(parent)
+          queue.append(child)
+
+  def get_tree_source(self, ancestor):
+    ''' Rendering is timed by the benchmark itself '''
+    self.source = '\n'.join(self.tree)
+
+
+class Command(BaseCommand):
+  help = 'Benchmark the built-in tree layout against graphviz on synthetic trees'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000], help='Number of people per tree')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per backend, the best run is reported')
+    parser.add_argument('--no-graphviz', action='store_true', help='Only time the built-in layout')
+
+  def handle(self, *args, **options):
+    self.stdout.write(f"{ 'people':>8} { 'build':>10} { 'builtin':>10} { 'graphviz':>10} { 'crossings':>10}")
+    for size in options['sizes']:
+      start = time.perf_counter()
+      tree = SyntheticTree(size)
+      build = time.perf_counter() - start
+      builtin = self.best(options['repeat'], lambda: TreeLayout(tree).as_svg())
+      crossings = TreeLayout(tree).crossing_count
+      graphviz = '-'
+      if not options['no_graphviz']:
+        try:
+          graphviz = f"{ self.best(options['repeat'], lambda: render_graphviz(tree.source)):.3f}s"
+        except (ImportError, RuntimeError) as e:
+          graphviz = 'n/a'
+          self.stderr.write(f"graphviz not available: { e }")
+      self.stdout.write(f"{ len(tree.persons):>8} { build:>9.3f}s { builtin:>9.3f}s { graphviz:>10} { crossings:>10}")
+
+  def best(self, repeat, function):
+    timings = []
+    for run in range(max(1, repeat)):
+      start = time.perf_counter()
+      function()
+      timings.append(time.perf_counter() - start)
+    return min(timings)
@@ -0,0 +1,70 @@
+""" duplicate_clusters
+    Reports groups of images that look alike: rescans, crops and
+    re-uploads of the same photo, found by the Hamming distance of their
+    perceptual hashes (archive/services/near_duplicates.py). Images are
+    grouped when a chain of pairs within the distance links them.
+
+    Usage: manage.py duplicate_clusters [--distance 6] [--backfill [--workers N]]
+      --distance  largest Hamming distance (of 64 bits), default
+                  settings.NEAR_DUPLICATE_DISTANCE
+      --backfill  first hash images without a hash, from their thumbnail
+                  or else the original; resumable
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from archive.models import Image
+from archive.services import imaging, near_duplicates
+
+
+def file_dhash(path):
+  try:
+    return near_duplicates.to_signed(imaging.file_dhash(path))
+  except Exception:
+    return None
+
+
+class Command(BaseCommand):
+  help = 'Report clusters of near-duplicate images'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--distance', type=int, default=None, help='Largest Hamming distance between hashes')
+    parser.add_argument('--backfill', action='store_true', help='Hash images without a hash first')
+    parser.add_argument('--workers', type=int, default=0, help='Hashing processes, default one per CPU')
+
+  def handle(self, *args, **options):
+    if options['backfill']:
+      self.backfill(max(1, options['workers'] or os.cpu_count() or 1))
+    started = time.monotonic()
+    clusters = near_duplicates.clusters(options['distance'])
+    titles = dict(Image.objects.filter(pk__in=[id for cluster in clusters for id in cluster]).values_list('id', 'title'))
+    for cluster in clusters:
+      self.stdout.write(f"{ len(cluster) } images: " + ', '.join(f"{ titles.get(id) } ({ id })" for id in cluster))
+    self.stdout.write(f"{ len(clusters) } clusters of { sum(len(cluster) for cluster in clusters) } images in { time.monotonic() - started:.2f}s.")
+
+  def backfill(self, workers):
+    images = list(Image.objects.filter(dhash=None).exclude(source='').values_list('id', 'thumbnail', 'source'))
+    paths = []
+    for id, thumbnail, source in images:
+      path = Path(settings.MEDIA_ROOT).joinpath(thumbnail) if thumbnail else None
+      paths.append(str(path if path and path.is_file() else Path(settings.MEDIA_ROOT).joinpath(source)))
+    hashed = 0
+    ''' Hashing processes never use the database; close connections so they are not shared with forked workers '''
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      for (id, _, source), dhash in zip(images, pool.map(file_dhash, paths, chunksize=16)):
+        if dhash is None:
+          self.stderr.write(f"Could not hash image { id }: { source }")
+          continue
+        Image.objects.filter(pk=id).update(dhash=dhash)
+        hashed += 1
+    if hashed:
+      near_duplicates.index.invalidate()
+    self.stdout.write(f"Hashed { hashed } of { len(images) } images.")
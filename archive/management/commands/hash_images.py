@@ -0,0 +1,50 @@
+""" hash_images
+    Computes Image.sha256 of images stored before uploads were hashed, so
+    new uploads of the same file are recognised as duplicates. Images that
+    have a hash are skipped; the command can be interrupted and run again.
+    Existing files are not moved to content-addressed paths.
+
+    Usage: manage.py hash_images [--workers 4] [--duplicates]
+      --duplicates  list files that are stored as more than one image
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from archive.models import Image
+from archive.services import content_store
+
+
+def digest(source):
+  try:
+    return content_store.file_digest(source.path)
+  except (FileNotFoundError, ValueError):
+    return None
+
+
+class Command(BaseCommand):
+  help = 'Compute the SHA-256 of stored images'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=4, help='Files read in parallel')
+    parser.add_argument('--duplicates', action='store_true', help='List files stored as more than one image')
+
+  def handle(self, *args, **options):
+    images = Image.objects.filter(sha256='').exclude(source='').only('id', 'source')
+    hashed, missing = 0, 0
+    ''' hashlib releases the GIL on large buffers, so threads keep several disks or cores busy '''
+    with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+      for image, sha256 in zip(images, pool.map(lambda image: digest(image.source), images)):
+        if sha256 is None:
+          missing += 1
+          self.stderr.write(f"Missing file of image { image.id }: { image.source }")
+          continue
+        Image.objects.filter(pk=image.pk).update(sha256=sha256)
+        hashed += 1
+    self.stdout.write(f"Hashed { hashed } images, { missing } files missing.")
+    if options['duplicates']:
+      for duplicate in Image.objects.exclude(sha256='').values('sha256').annotate(count=Count('id')).filter(count__gt=1):
+        titles = Image.objects.filter(sha256=duplicate['sha256']).values_list('id', 'title')
+        self.stdout.write(f"{ duplicate['sha256'][:12] }: " + ', '.join(f"{ title } ({ id })" for id, title in titles))
@@ -0,0 +1,82 @@
+""" media_rebuild
+    Rebuilds thumbnails and derivatives, re-reads file size, dimensions
+    and EXIF details, and renders portrait avatars and deep zoom tiles, of a
+    selection of images in a local process pool; replaces the serial admin
+    actions for bulk work.
+
+    Selected images are queued as media jobs (MediaJob) first, so progress
+    is stored in the database: after an interruption, run it again with
+    --resume to process the jobs that are left. Throughput is reported
+    while it runs.
+
+    Usage: manage.py media_rebuild [--tasks derivatives metadata avatars tiles] [--only-missing]
+                                   [--since 2026-01-01] [--workers N] [--resume]
+      --tasks         derivatives (thumbnail, responsive sizes and perceptual
+                      hash), metadata (size, dimensions, EXIF), avatars
+                      (square crops of portraits) and/or tiles (deep zoom
+                      pyramids of images of DEEP_ZOOM_PIXELS), default all
+      --only-missing  only images of which the task has not completed
+      --since         only images changed since this date
+      --resume        do not queue, process the jobs left by an earlier run
+"""
+
+from datetime import datetime, time
+
+from django.core.management.base import CommandError
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from archive.models import Image, MediaJob
+from archive.services import avatars, deep_zoom, derivatives
+
+from .process_media_jobs import Command as ProcessMediaJobsCommand
+
+
+class Command(ProcessMediaJobsCommand):
+  help = 'Rebuild thumbnails, derivatives and metadata of images in a local worker pool'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--tasks', nargs='+', choices=derivatives.TASKS, default=derivatives.TASKS, help='Tasks to run')
+    parser.add_argument('--only-missing', action='store_true', help='Only images of which the task has not completed')
+    parser.add_argument('--since', help='Only images changed since this date (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=0, help='Processes, default settings.MEDIA_WORKERS or one per CPU')
+    parser.add_argument('--resume', action='store_true', help='Process the jobs left by an earlier run without queueing')
+
+  def handle(self, *args, **options):
+    self.verbosity = options['verbosity']
+    tasks = options['tasks']
+    if not options['resume']:
+      since = self.get_since(options['since'])
+      for task in tasks:
+        queued = derivatives.enqueue(self.select(task, options['only_missing'], since).values_list('pk', flat=True), task)
+        self.stdout.write(f"{ task }: queued { queued } images.")
+    total = MediaJob.objects.filter(task__in=tasks, status__in=[MediaJob.QUEUED, MediaJob.RUNNING]).count()
+    self.process(self.get_workers(options['workers']), tasks=tasks, once=True, total=total)
+
+  def get_since(self, value):
+    if not value:
+      return None
+    since = parse_datetime(value) or parse_date(value)
+    if since is None:
+      raise CommandError(f"--since: not a date: { value }")
+    if not isinstance(since, datetime):
+      since = datetime.combine(since, time.min)
+    return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+  def select(self, task, only_missing, since):
+    """ Images to queue for a task """
+    images = Image.objects.exclude(source='')
+    if since:
+      images = images.filter(date_modified__gte=since)
+    if only_missing and task == derivatives.TASK:
+      images = images.filter(Q(thumbnail=None) | Q(thumbnail='') | Q(color='') | ~Q(derivative_status='ready'))
+    if only_missing and task == derivatives.METADATA:
+      images = images.filter(Q(metadata_read=None) | Q(width=0) | Q(size=0))
+    if task == derivatives.AVATARS:
+      images = images.filter(pk__in=avatars.outdated()) if only_missing else images.filter(portrait_of__isnull=False).distinct()
+    if task == derivatives.TILES:
+      images = images.annotate(pixels=F('width') * F('height')).filter(pixels__gte=deep_zoom.min_pixels())
+      if only_missing:
+        images = images.filter(pk__in=[image.pk for image in images.only('pk', 'source', 'sha256', 'width', 'height', 'tiles_key') if deep_zoom.outdated(image)])
+    return images
@@ -0,0 +1,109 @@
+""" process_media_jobs
+    Worker for the media job queue (MediaJob): renders the responsive
+    derivatives and thumbnails of uploaded images, and reads their
+    metadata, in a local process pool. Run it next to the web server, e.g.
+    as a systemd service; several workers can share one queue.
+
+    Usage: manage.py process_media_jobs [--workers N] [--once] [--poll 5]
+                                        [--enqueue-missing [--retry-failed]]
+      --workers          processes rendering in parallel, default
+                         settings.MEDIA_WORKERS or one per CPU
+      --once             exit when the queue is empty instead of polling
+      --enqueue-missing  first queue every image without derivatives, e.g.
+                         after an upgrade or a change of DERIVATIVE_WIDTHS
+      --retry-failed     with --enqueue-missing, also queue failed images
+"""
+
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from archive.services import derivatives
+
+PROGRESS_INTERVAL = 10
+
+
+class Command(BaseCommand):
+  help = 'Render queued image derivatives in a local worker pool'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=0, help='Rendering processes, default one per CPU')
+    parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+    parser.add_argument('--poll', type=float, default=5, help='Seconds between checks of an empty queue')
+    parser.add_argument('--enqueue-missing', action='store_true', help='Queue every image without derivatives first')
+    parser.add_argument('--retry-failed', action='store_true', help='With --enqueue-missing, also queue failed images')
+
+  def handle(self, *args, **options):
+    self.verbosity = options['verbosity']
+    if options['enqueue_missing']:
+      queued = derivatives.enqueue_missing(retry_failed=options['retry_failed'])
+      self.stdout.write(f"Queued { queued } images.")
+    self.process(self.get_workers(options['workers']), once=options['once'], poll=options['poll'])
+
+  def get_workers(self, workers):
+    return max(1, workers or getattr(settings, 'MEDIA_WORKERS', 0) or os.cpu_count() or 1)
+
+  ''' Process Queue
+      Claims jobs of tasks as workers become free, until the queue is empty
+      (once) or the command is stopped. Jobs running when it is interrupted
+      are queued again. With total, progress and throughput are reported
+      every PROGRESS_INTERVAL seconds.
+  '''
+  def process(self, workers, tasks=derivatives.TASKS, once=False, poll=5, total=None):
+    self.done, self.failed = Counter(), Counter()
+    started = reported = time.monotonic()
+    ''' Rendering processes never use the database; close connections so they are not shared with forked workers '''
+    connections.close_all()
+    running = {}
+    try:
+      with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+          for job in derivatives.claim(workers * 2 - len(running), tasks):
+            function, arguments = derivatives.get_work(job)
+            running[pool.submit(function, *arguments)] = job
+          if not running:
+            if once:
+              break
+            derivatives.requeue_stale(tasks)
+            time.sleep(poll)
+            continue
+          finished, pending = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+          for future in finished:
+            self.finish(running.pop(future), future)
+          if total and time.monotonic() - reported >= PROGRESS_INTERVAL:
+            reported = time.monotonic()
+            self.report_progress(total, reported - started)
+    except KeyboardInterrupt:
+      derivatives.release(running.values())
+      self.stdout.write(f"Interrupted, { len(running) } jobs queued again.")
+    elapsed = time.monotonic() - started
+    for task in tasks:
+      if self.done[task] or self.failed[task]:
+        self.stdout.write(f"{ task }: { self.done[task] } images, { self.failed[task] } failed.")
+    processed = sum(self.done.values()) + sum(self.failed.values())
+    self.stdout.write(self.style.SUCCESS(
+      f"Processed { processed } jobs in { elapsed:.1f}s ({ processed / elapsed if elapsed else 0:.2f} jobs/s)."
+    ))
+
+  def report_progress(self, total, elapsed):
+    processed = sum(self.done.values()) + sum(self.failed.values())
+    rate = processed / elapsed if elapsed else 0
+    remaining = f", { int((total - processed) / rate // 60) }:{ int((total - processed) / rate % 60):02d} remaining" if rate else ''
+    self.stdout.write(f"{ processed }/{ total } jobs, { rate:.1f} jobs/s{ remaining }")
+
+  def finish(self, job, future):
+    try:
+      result = future.result()
+    except Exception as e:
+      self.failed[job.task] += derivatives.fail(job, e)
+      self.stderr.write(f"{ job.task } of image { job.image_id }, attempt { job.attempts }: { e }")
+      return
+    derivatives.complete(job, result)
+    self.done[job.task] += 1
+    if self.verbosity > 1:
+      self.stdout.write(f"{ job.task } of image { job.image_id }: done")
@@ -0,0 +1,76 @@
+""" read_image_metadata
+    Reads dimensions, file size and EXIF details (date taken, orientation,
+    camera, GPS position) of images stored before uploads were read
+    (archive/services/image_metadata.py). Only file headers are read, in a
+    process pool. Progress is stored per batch: an interrupted run continues
+    where it stopped.
+
+    Usage: manage.py read_image_metadata [--workers N] [--all] [--fill-dates]
+      --workers     processes reading files, default one per CPU
+      --all         read every image again, not only those never read
+      --fill-dates  date images without year, month and day by their date taken
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from archive.models import Image
+from archive.models.Event import get_date_key
+from archive.services import image_metadata, imaging
+
+BATCH_SIZE = 500
+
+
+def read_metadata(path):
+  """ imaging.read_metadata(), or the error as string; runs in a worker process """
+  try:
+    return imaging.read_metadata(path)
+  except Exception as e:
+    return f"{ type(e).__name__ }: { e }"
+
+
+class Command(BaseCommand):
+  help = 'Read dimensions, size and EXIF details of stored images'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=0, help='Reading processes, default one per CPU')
+    parser.add_argument('--all', action='store_true', help='Read every image again')
+    parser.add_argument('--fill-dates', action='store_true', help='Date images without a date by their date taken')
+
+  def handle(self, *args, **options):
+    workers = max(1, options['workers'] or os.cpu_count() or 1)
+    images = Image.objects.exclude(source='')
+    if not options['all']:
+      images = images.filter(metadata_read=None)
+    ids = list(images.order_by('pk').values_list('pk', flat=True))
+    self.stdout.write(f"Reading { len(ids) } images with { workers } workers.")
+    read, failed, dated, started = 0, 0, 0, time.monotonic()
+    ''' Reading processes never use the database; close connections so they are not shared with forked workers '''
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      for start in range(0, len(ids), BATCH_SIZE):
+        rows = list(Image.objects.filter(pk__in=ids[start:start + BATCH_SIZE]).values_list('pk', 'source', 'year', 'month', 'day'))
+        paths = [str(Path(settings.MEDIA_ROOT).joinpath(source)) for pk, source, *date in rows]
+        ''' One transaction per batch: a batch is stored completely or read again by the next run '''
+        with transaction.atomic():
+          for (pk, source, year, month, day), metadata in zip(rows, pool.map(read_metadata, paths, chunksize=16)):
+            if isinstance(metadata, str):
+              failed += 1
+              self.stderr.write(f"Could not read image { pk } ({ source }): { metadata }")
+              continue
+            fields = image_metadata.get_fields(metadata)
+            if options['fill_dates'] and fields['date_taken'] and not (year or month or day):
+              fields['year'], fields['month'], fields['day'] = image_metadata.get_date(fields['date_taken'])
+              fields['date_key'], fields['date_precision'], fields['decade'] = get_date_key(fields['year'], fields['month'], fields['day'])
+              dated += 1
+            Image.objects.filter(pk=pk).update(**fields)
+            read += 1
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{ read + failed }/{ len(ids) } images, { (read + failed) / elapsed if elapsed else 0:.0f}/s")
+    self.stdout.write(f"Read { read } images, { failed } failed, { dated } dated, in { time.monotonic() - started:.1f}s.")
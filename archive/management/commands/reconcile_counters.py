@@ -0,0 +1,50 @@
+""" reconcile_counters
+    Verify or repair the counters stored on Image (people, tags, groups,
+    published comments, attachments) and Category (images).
+
+    Usage: manage.py reconcile_counters [--verify]
+      --verify  only report counters that differ; exits with status 1 when
+                any are found
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from archive.services.image_counters import (
+  IMAGE_COUNTERS, expected_image_counts, expected_category_counts, refresh_images, refresh_categories,
+)
+
+
+class Command(BaseCommand):
+  help = 'Verify or repair the related-object counters stored on Image and Category'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--verify', action='store_true', help='Only report differences, do not update')
+
+  def handle(self, *args, **options):
+    differs = Q()
+    for name in IMAGE_COUNTERS:
+      differs |= ~Q(**{name: F(f"expected_{ name }")})
+    images = expected_image_counts().filter(differs)
+    categories = expected_category_counts().exclude(image_count=F('expected_image_count'))
+    if not options['verify']:
+      image_ids = list(images.values_list('pk', flat=True))
+      refresh_images(image_ids)
+      category_ids = list(categories.values_list('pk', flat=True))
+      refresh_categories(category_ids)
+      self.stdout.write(self.style.SUCCESS(f"Updated { len(image_ids) } images and { len(category_ids) } categories."))
+      return
+    mismatches = 0
+    for image in images:
+      mismatches += 1
+      counters = ', '.join(
+        f"{ name } { getattr(image, name) } != { getattr(image, 'expected_' + name) }"
+        for name in IMAGE_COUNTERS if getattr(image, name) != getattr(image, 'expected_' + name)
+      )
+      self.stdout.write(f"image { image.pk }: { counters }")
+    for category in categories:
+      mismatches += 1
+      self.stdout.write(f"category { category.pk }: image_count { category.image_count } != { category.expected_image_count }")
+    if mismatches:
+      raise CommandError(f"{ mismatches } objects have counters that differ. Run without --verify to fix.")
+    self.stdout.write(self.style.SUCCESS('All counters match.'))
@@ -0,0 +1,43 @@
+""" sync_family_collections
+    Rebuild or verify the stored family collections (ImageFamily) of all
+    images, e.g. after changing settings.FAMILIES.
+
+    Usage: manage.py sync_family_collections [--verify] [--batch-size 500]
+      --verify  only report images whose stored collections differ; exits
+                with status 1 when any are found
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from archive.models import Image
+from archive.services import image_facets
+from archive.services.family_collections import compute_families, stored_families, sync_families
+
+
+class Command(BaseCommand):
+  help = 'Rebuild or verify the family collections stored for every image'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--verify', action='store_true', help='Only report differences, do not update')
+    parser.add_argument('--batch-size', type=int, default=500, help='Images per query')
+
+  def handle(self, *args, **options):
+    ids = list(Image.objects.order_by('pk').values_list('pk', flat=True))
+    batch_size = max(1, options['batch_size'])
+    if not options['verify']:
+      changed = sync_families(ids, batch_size=batch_size)
+      if changed:
+        image_facets.invalidate()
+      self.stdout.write(self.style.SUCCESS(f"Checked { len(ids) } images, updated { changed }."))
+      return
+    mismatches = 0
+    for start in range(0, len(ids), batch_size):
+      batch = ids[start:start + batch_size]
+      expected, stored = compute_families(batch), stored_families(batch)
+      for id in batch:
+        if expected[id] != stored[id]:
+          mismatches += 1
+          self.stdout.write(f"image { id }: stored { stored[id] }, expected { expected[id] }")
+    if mismatches:
+      raise CommandError(f"{ mismatches } of { len(ids) } images have stored family collections that differ. Run without --verify to fix.")
+    self.stdout.write(self.style.SUCCESS(f"All { len(ids) } images match."))
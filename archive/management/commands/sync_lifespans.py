@@ -0,0 +1,56 @@
+""" sync_lifespans
+    Backfill or verify the birth and death dates stored on Person against
+    the birth and death Events, and the PersonDecade rows against those dates.
+
+    Usage: manage.py sync_lifespans [--verify] [--batch-size 500]
+      --verify  only report people whose stored dates differ; exits with
+                status 1 when any are found
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from archive.models import Person
+from archive.services.lifespan import (
+  compute_lifespans, stored_lifespan, sync_lifespans, expected_decades, stored_decades, sync_decades,
+)
+
+
+class Command(BaseCommand):
+  help = 'Backfill or verify the birth and death dates stored on Person'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--verify', action='store_true', help='Only report differences, do not update')
+    parser.add_argument('--batch-size', type=int, default=500, help='People per query')
+
+  def handle(self, *args, **options):
+    ids = list(Person.objects.order_by('pk').values_list('pk', flat=True))
+    batch_size = max(1, options['batch_size'])
+    if not options['verify']:
+      updated = sync_lifespans(ids, batch_size=batch_size)
+      decades = 0
+      for start in range(0, len(ids), batch_size):
+        people = list(Person.objects.filter(pk__in=ids[start:start + batch_size]))
+        stored, expected = stored_decades([person.pk for person in people]), expected_decades(people)
+        changed = [person for person in people if stored[person.pk] != expected[person.pk]]
+        if changed:
+          sync_decades(changed)
+          decades += len(changed)
+      self.stdout.write(self.style.SUCCESS(f"Checked { len(ids) } people, updated { updated } dates and { decades } decade lists."))
+      return
+    mismatches = 0
+    for start in range(0, len(ids), batch_size):
+      batch = ids[start:start + batch_size]
+      expected = compute_lifespans(batch)
+      people = list(Person.objects.filter(pk__in=batch))
+      decades = expected_decades(people)
+      stored = stored_decades(batch)
+      for person in people:
+        if stored_lifespan(person) != expected[person.pk]:
+          mismatches += 1
+          self.stdout.write(f"{ person.pk } { person.full_name() }: stored { stored_lifespan(person) }, events { expected[person.pk] }")
+        elif stored[person.pk] != decades[person.pk]:
+          mismatches += 1
+          self.stdout.write(f"{ person.pk } { person.full_name() }: stored decades { sorted(stored[person.pk]) }, expected { sorted(decades[person.pk]) }")
+    if mismatches:
+      raise CommandError(f"{ mismatches } of { len(ids) } people have stored dates or decades that differ from their events. Run without --verify to fix.")
+    self.stdout.write(self.style.SUCCESS(f"All { len(ids) } people match their events."))
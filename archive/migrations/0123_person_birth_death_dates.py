@@ -0,0 +1,79 @@
+# Generated by Django 6.0.3 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def backfill_dates(apps, schema_editor):
+    """ Copy the earliest dated birth and death event of every person """
+    Person = apps.get_model('archive', 'Person')
+    Event = apps.get_model('archive', 'Event')
+    dates = {}
+    rows = Event.objects.filter(type__in=['birth', 'death']).order_by().values_list('people', 'type', 'year', 'month', 'day')
+    for person_id, type, year, month, day in rows:
+        if person_id is None:
+            continue
+        key = (year is None, year or 0, month or 0, day or 0)
+        current = dates.setdefault(person_id, {})
+        if type not in current or key < current[type][0]:
+            current[type] = (key, (year, month, day))
+    people = []
+    for person in Person.objects.filter(pk__in=dates).only('pk'):
+        birth = dates[person.pk].get('birth', (None, (None, None, None)))[1]
+        death = dates[person.pk].get('death', (None, (None, None, None)))[1]
+        person.birth_year, person.birth_month, person.birth_day = birth
+        person.death_year, person.death_month, person.death_day = death
+        people.append(person)
+    Person.objects.bulk_update(
+        people,
+        ['birth_year', 'birth_month', 'birth_day', 'death_year', 'death_month', 'death_day'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0122_alter_image_is_portrait_of'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='birth_year',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='birth_month',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='birth_day',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_year',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_month',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_day',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['birth_year', 'birth_month', 'birth_day'], name='archive_per_birth_y_ac8f28_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['death_year'], name='archive_per_death_y_4a30dc_idx'),
+        ),
+        migrations.RunPython(backfill_dates, migrations.RunPython.noop),
+    ]
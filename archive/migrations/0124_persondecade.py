@@ -0,0 +1,44 @@
+# Generated by Django 6.0.3 on 2026-10-18 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+MAX_DECADES = 10
+
+
+def backfill_decades(apps, schema_editor):
+    """ One row for each decade every person with a known birth year was alive in """
+    Person = apps.get_model('archive', 'Person')
+    PersonDecade = apps.get_model('archive', 'PersonDecade')
+    rows = []
+    for person_id, birth_year, death_year in Person.objects.exclude(birth_year__isnull=True).values_list('pk', 'birth_year', 'death_year'):
+        start = birth_year // 10 * 10
+        end = start
+        if death_year and death_year > birth_year:
+            end = min(death_year // 10 * 10, start + (MAX_DECADES - 1) * 10)
+        rows.extend(PersonDecade(person_id=person_id, decade=decade) for decade in range(start, end + 10, 10))
+    PersonDecade.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0123_person_birth_death_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonDecade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('decade', models.PositiveIntegerField()),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decades', to='archive.person')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['decade', 'person'], name='archive_per_decade_756592_idx')],
+                'unique_together': {('person', 'decade')},
+            },
+        ),
+        migrations.RunPython(backfill_decades, migrations.RunPython.noop),
+    ]
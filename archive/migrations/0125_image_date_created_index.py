@@ -0,0 +1,17 @@
+# Generated by Django 6.0.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0124_persondecade'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['date_created', 'id'], name='archive_ima_date_cr_6d1beb_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0.3 on 2026-10-18 13:00
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field, **filters):
+    rows = model.objects.filter(**{field: OuterRef('pk')}, **filters).order_by().values(field)
+    return Coalesce(Subquery(rows.annotate(total=Count('*')).values('total')[:1], output_field=IntegerField()), Value(0))
+
+
+def backfill_counters(apps, schema_editor):
+    Image = apps.get_model('archive', 'Image')
+    Category = apps.get_model('archive', 'Category')
+    Comment = apps.get_model('archive', 'Comment')
+    Image.objects.update(
+        people_count=count_of(Image.people.through, 'image'),
+        tag_count=count_of(Image.tag.through, 'image'),
+        group_count=count_of(Image.in_group.through, 'image'),
+        comment_count=count_of(Comment, 'image', status='p'),
+        attachment_count=count_of(Image.attachments.through, 'image'),
+    )
+    Category.objects.update(image_count=count_of(Image, 'category'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0125_image_date_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Published comments'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='group_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='people_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tag_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
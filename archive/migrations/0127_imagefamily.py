@@ -0,0 +1,57 @@
+# Generated by Django 6.0.3 on 2026-10-18 14:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_families(apps, schema_editor):
+    """ Store the family collections Image.family_collection() used to compute per request """
+    Image = apps.get_model('archive', 'Image')
+    ImageFamily = apps.get_model('archive', 'ImageFamily')
+    families = getattr(settings, 'FAMILIES', [])
+    if not families:
+        return
+    collections = {}
+    rows = Image.people.through.objects.filter(
+        Q(person__last_name__in=families) | Q(person__married_name__in=families)
+    ).order_by('image', 'person__first_names', 'person__last_name').values_list('image', 'person__last_name', 'person__married_name')
+    for image_id, last_name, married_name in rows:
+        family = last_name if last_name in families else married_name
+        current = collections.setdefault(image_id, [])
+        if family not in [name for name, automated in current]:
+            current.append((family, True))
+    for image_id, family in Image.objects.filter(family__in=families).values_list('pk', 'family'):
+        current = collections.setdefault(image_id, [])
+        if family not in [name for name, automated in current]:
+            current.append((family, False))
+    ImageFamily.objects.bulk_create(
+        [ImageFamily(image_id=image_id, family=family, automated=automated) for image_id, current in sorted(collections.items()) for family, automated in current],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0126_image_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageFamily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('family', models.CharField(max_length=64)),
+                ('automated', models.BooleanField(default=True, help_text='Derived from a tagged person rather than Image.family')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='family_collections', to='archive.image')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'indexes': [models.Index(fields=['family', 'image'], name='archive_ima_family_333c6a_idx')],
+                'unique_together': {('image', 'family')},
+            },
+        ),
+        migrations.RunPython(backfill_families, migrations.RunPython.noop),
+    ]
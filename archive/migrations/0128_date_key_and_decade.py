@@ -0,0 +1,81 @@
+# Generated by Django 6.0.3 on 2026-10-18 15:00
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce
+
+
+def backfill_date_keys(apps, schema_editor):
+    """ date_key = YYYYMMDD (00 for an unknown month or day), decade = year rounded down to 10 """
+    for name in ['Image', 'Event']:
+        Model = apps.get_model('archive', name)
+        Model.objects.filter(year__isnull=False).update(
+            date_key=F('year') * 10000 + Coalesce(F('month'), 0) * 100 + Case(When(month__isnull=False, then=Coalesce(F('day'), 0)), default=Value(0)),
+            date_precision=Case(
+                When(month__isnull=False, day__isnull=False, then=Value(3)),
+                When(month__isnull=False, then=Value(2)),
+                default=Value(1),
+            ),
+            decade=F('year') / 10 * 10,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0127_imagefamily'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='event',
+            options={'ordering': ['-date_key', 'title', 'type']},
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='date_key',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='date_precision',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'unknown'), (1, 'year'), (2, 'month'), (3, 'day')], default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='decade',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='date_key',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='YYYYMMDD, derived on save', null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='date_precision',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'unknown'), (1, 'year'), (2, 'month'), (3, 'day')], default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='decade',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['date_key'], name='archive_eve_date_ke_17ed2d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['decade', 'date_key'], name='archive_eve_decade_e66cbc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['decade', 'date_key'], name='archive_ima_decade_5f11b0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['date_key'], name='archive_ima_date_ke_ae2e87_idx'),
+        ),
+        migrations.RunPython(backfill_date_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.3 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0128_date_key_and_decade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='derivative_status',
+            field=models.CharField(choices=[('pending', 'pending'), ('ready', 'ready'), ('failed', 'failed')], default='pending', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='derivative_widths',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='Widths rendered in every format of settings.DERIVATIVE_FORMATS'),
+        ),
+        migrations.CreateModel(
+            name='MediaJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(choices=[('derivatives', 'derivatives')], default='derivatives', max_length=32)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_jobs', to='archive.image')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'indexes': [models.Index(fields=['status', 'task', 'id'], name='archive_med_status_cc3e9f_idx')],
+                'unique_together': {('image', 'task')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.3 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0129_mediajob_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Of the stored file, see archive/services/content_store.py', max_length=64),
+        ),
+    ]
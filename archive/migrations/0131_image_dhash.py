@@ -0,0 +1,18 @@
+# Generated by Django 6.0.3 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0130_image_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='Perceptual hash, see archive/services/near_duplicates.py', null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.3 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0131_image_dhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='camera',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='date_taken',
+            field=models.DateTimeField(blank=True, editable=False, help_text='EXIF date taken', null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='metadata_read',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='orientation',
+            field=models.PositiveSmallIntegerField(default=1, editable=False, help_text='EXIF orientation; width and height are upright'),
+        ),
+    ]
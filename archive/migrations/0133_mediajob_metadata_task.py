@@ -0,0 +1,18 @@
+# Generated by Django 6.0.3 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0132_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediajob',
+            name='task',
+            field=models.CharField(choices=[('derivatives', 'derivatives'), ('metadata', 'metadata')], default='derivatives', max_length=32),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.3 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0133_mediajob_metadata_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='color',
+            field=models.CharField(blank=True, editable=False, help_text='Dominant colour, #rrggbb', max_length=7),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='placeholder',
+            field=models.CharField(blank=True, editable=False, help_text='Tiny blurred version as data URI, shown while the image loads', max_length=1000),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.3 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0134_image_placeholder_color'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='avatar_key',
+            field=models.CharField(blank=True, editable=False, help_text='Version of the rendered avatars, empty without avatar', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='task',
+            field=models.CharField(choices=[('derivatives', 'derivatives'), ('metadata', 'metadata'), ('avatars', 'avatars')], default='derivatives', max_length=32),
+        ),
+    ]
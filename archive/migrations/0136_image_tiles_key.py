@@ -0,0 +1,23 @@
+# Generated by Django 6.0.3 on 2026-10-18 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0135_person_avatar_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='tiles_key',
+            field=models.CharField(blank=True, editable=False, help_text='Version of the deep zoom tile pyramid, empty without', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='mediajob',
+            name='task',
+            field=models.CharField(choices=[('derivatives', 'derivatives'), ('metadata', 'metadata'), ('avatars', 'avatars'), ('tiles', 'tiles')], default='derivatives', max_length=32),
+        ),
+    ]
@@ -7,4 +7,4 @@ from .BaseIcon import BaseIcon
 class Category(Category, BaseIcon):
   """ Extends CMNSD.models:Category with archive-specific fields
   """
-  pass
\ No newline at end of file
+  image_count = models.PositiveIntegerField(default=0, editable=False)  # Maintained by archive/services/image_counters.py
\ No newline at end of file
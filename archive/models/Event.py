@@ -21,6 +21,44 @@ MONTHS = [
   (11, _('november')),
   (12, _('december')),]
 
+''' Date keys
+    Partial dates (year, optional month and day) are stored as a sortable
+    integer YYYYMMDD, with 00 for an unknown month or day, plus the precision
+    of the date and its decade. Chronological sorting, decade browsing and
+    date ranges then use a single indexed column.
+'''
+PRECISION_CHOICES = [
+  (0, _('unknown')),
+  (1, _('year')),
+  (2, _('month')),
+  (3, _('day')),
+]
+DATE_KEY_FIELDS = ['date_key', 'date_precision', 'decade']
+
+def get_date_key(year, month=None, day=None):
+  """ Returns (date_key, date_precision, decade) of a partial date """
+  year, month, day = [int(value) if value not in (None, '') else None for value in (year, month, day)]
+  if not year:
+    return None, 0, None
+  precision = 3 if month and day else 2 if month else 1
+  return year * 10000 + (month or 0) * 100 + ((day or 0) if month else 0), precision, year // 10 * 10
+
+def get_date_key_range(year, month=None, day=None):
+  """ Lowest and highest date_key that fall within a partial date """
+  key = get_date_key(year, month, day)[0]
+  if key is None:
+    return None, None
+  year, month, day = [int(value) if value not in (None, '') else None for value in (year, month, day)]
+  return key, year * 10000 + (month or 12) * 100 + ((day or 31) if month else 31)
+
+def set_date_key(instance, update_fields=None):
+  """ Derive the date key fields of instance; returns update_fields including them when needed """
+  instance.date_key, instance.date_precision, instance.decade = get_date_key(instance.year, instance.month, instance.day)
+  if update_fields is not None and {'year', 'month', 'day'} & set(update_fields):
+    update_fields = list(set(update_fields) | set(DATE_KEY_FIELDS))
+  return update_fields
+
+
 TYPE_CHOICES = [
   ('birth', _('birth')),
   ('death', _('death')),
@@ -74,6 +112,11 @@ class Event(BaseModel):
     verbose_name=_('day'),
   )
 
+  # Derived from year, month and day on save
+  date_key = models.PositiveIntegerField(blank=True, null=True, editable=False)
+  date_precision = models.PositiveSmallIntegerField(choices=PRECISION_CHOICES, default=0, editable=False)
+  decade = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+
   people = models.ManyToManyField('Person', blank=True, related_name='events', verbose_name=_('people'))
   locations = models.ManyToManyField('Location', blank=True, related_name='events', verbose_name=_('locations'))
   images = models.ManyToManyField('Image', blank=True, related_name='events', verbose_name=_('images'))
@@ -83,11 +126,17 @@ class Event(BaseModel):
   objects = EventManager()
 
   class Meta:
-    ordering = ['-year', '-month', '-day', 'title', 'type']
+    ordering = ['-date_key', 'title', 'type']
     indexes = [
-      models.Index(fields=["type", "year"])
+      models.Index(fields=["type", "year"]),
+      models.Index(fields=["date_key"]),
+      models.Index(fields=["decade", "date_key"]),
     ]
 
+  def save(self, *args, **kwargs):
+    kwargs['update_fields'] = set_date_key(self, kwargs.get('update_fields'))
+    return super().save(*args, **kwargs)
+
   def __str__(self):
     try:
       return self.get_title()
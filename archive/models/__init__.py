@@ -8,4 +8,6 @@ from .note import *
 from .preference import *
 from .Category import *
 from .Location import *
-from .Event import *
\ No newline at end of file
+from .Event import *
+from .media_job import *
+from .cache_version import *
\ No newline at end of file
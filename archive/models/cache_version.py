@@ -0,0 +1,13 @@
+from django.db import models
+
+''' Cache Versions
+    Named counters that are part of the keys of cached results and of the
+    in-process indexes (archive/services/cache_version.py). They live in the
+    database so every process sees a bump, whatever cache backend it has.
+'''
+class CacheVersion(models.Model):
+  name                = models.CharField(max_length=64, unique=True)
+  version             = models.PositiveBigIntegerField(default=1)
+
+  def __str__(self):
+    return f"{ self.name }: { self.version }"
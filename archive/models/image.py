@@ -4,7 +4,6 @@ from django.db.models import Prefetch
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.conf import settings
-from PIL import Image as PIL
 from pathlib import Path
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.template.defaultfilters import slugify
@@ -12,10 +11,11 @@ from django.utils.translation import gettext_lazy as _
 
 from .tag import Tag
 from .person import Person
-from .Event import Event
+from .Event import Event, PRECISION_CHOICES, set_date_key
 from .Category import Category
 from .group import Group
 from .attachment import Attachment
+from archive.services.imaging import TILE_OVERLAP, TILE_SIZE, derivative_name, render_thumbnail, tiles_name
 
 from cmnsd.models import BaseModel
 from cmnsd.models.BaseMethods import ajax_function, searchable_function
@@ -30,25 +30,11 @@ def get_thumbnail(image):
     # There is an image ready that reads Format Not Supported. This is a
     # friendly way to inform the user of the error.
     return 'documents/format_not_supported.jpg'
-  #from PIL import Image
-  import PIL
-  PIL.Image.MAX_IMAGE_PIXELS = 933120000
   ''' Store Target Information '''
-  tgt_width = 300
-  tgt_path = settings.MEDIA_ROOT.joinpath('thumbnails/')
-  tgt_file = str(image.name)
-  ''' Check if thumbnails_dir exists '''
-  if not tgt_path.exists():
-    tgt_path.mkdir(parents=True, exist_ok=True)
-  ''' Set destination '''
+  tgt_file = Path('thumbnails').joinpath(Path(image.name).name)
   try:
-    with PIL.Image.open(image.path) as img:
-      width, height = img.size
-      ratio = width / height
-      tgt_height = int(tgt_width / ratio)
-      img = img.resize((tgt_width, tgt_height), PIL.Image.Resampling.LANCZOS)
-      img.save(settings.MEDIA_ROOT.joinpath(tgt_file))
-      return tgt_file
+    render_thumbnail(image.path, settings.MEDIA_ROOT.joinpath(tgt_file))
+    return str(tgt_file)
   except Exception as e:
     return None
 
@@ -67,12 +53,11 @@ class ImageQuerySet(models.QuerySet):
       'category__parent',
       'is_portrait_of',
     ).prefetch_related(
-      Prefetch('people', queryset=Person.objects.prefetch_related(
-        Prefetch('events', queryset=Event.objects.filter(type__in=['birth', 'death']))
-      )),
+      'people',
       Prefetch('tag', queryset=Tag.objects.with_counts()),
       'in_group',
       'loved_by',
+      'family_collections',
     )
   
   def with_detail(self):
@@ -86,16 +71,9 @@ class ImageQuerySet(models.QuerySet):
       'portrait_of',
     )
   def with_counts(self):
-    """Annotate related counts to avoid per-row COUNT queries."""
-    return self.annotate(
-      category_image_count=Count('category__images', distinct=True),
-      category_parent_image_count=Count('category__parent__images', distinct=True),
-      people_count=Count('people', distinct=True),
-      tag_count=Count('tag', distinct=True),
-      group_count=Count('in_group', distinct=True),
-      comment_count=Count('comments', filter=Q(comments__status='p'), distinct=True),
-      attachment_count=Count('attachments', distinct=True),
-    )
+    """Related counts are stored on Image and Category (see archive/services/image_counters.py);
+    only the categories need to be joined."""
+    return self.select_related('category', 'category__parent')
 
   def optimized(self):
     return self.with_relations()
@@ -139,13 +117,37 @@ class Image(BaseModel, RequestMixin, FilterMixin):
   year                = models.PositiveSmallIntegerField(blank=True, null=True, help_text='')
   month               = models.PositiveSmallIntegerField(blank=True, null=True, help_text='', choices=MONTHS)
   day                 = models.PositiveSmallIntegerField(blank=True, null=True, help_text='', validators=[MaxValueValidator(31), MinValueValidator(1)])
-  # Meta
+  date_key            = models.PositiveIntegerField(blank=True, null=True, editable=False, help_text='YYYYMMDD, derived on save')
+  date_precision      = models.PositiveSmallIntegerField(choices=PRECISION_CHOICES, default=0, editable=False)
+  decade              = models.PositiveSmallIntegerField(blank=True, null=True, editable=False)
+  # Meta, read from the file by archive/services/image_metadata.py
   size                = models.IntegerField(default=0)
   width               = models.IntegerField(default=0)
   height              = models.IntegerField(default=0)
+  orientation         = models.PositiveSmallIntegerField(default=1, editable=False, help_text='EXIF orientation; width and height are upright')
+  date_taken          = models.DateTimeField(blank=True, null=True, editable=False, help_text='EXIF date taken')
+  camera              = models.CharField(max_length=255, blank=True, editable=False)
+  latitude            = models.FloatField(blank=True, null=True, editable=False)
+  longitude           = models.FloatField(blank=True, null=True, editable=False)
+  metadata_read       = models.DateTimeField(blank=True, null=True, editable=False)
+  sha256              = models.CharField(max_length=64, blank=True, db_index=True, editable=False, help_text='Of the stored file, see archive/services/content_store.py')
+  dhash               = models.BigIntegerField(blank=True, null=True, editable=False, help_text='Perceptual hash, see archive/services/near_duplicates.py')
   
   visibility_frontpage     = models.BooleanField(default=True)
   visibility_person_page   = models.BooleanField(default=True)
+  # Stored counters, maintained by archive/services/image_counters.py
+  people_count        = models.PositiveIntegerField(default=0, editable=False)
+  tag_count           = models.PositiveIntegerField(default=0, editable=False)
+  group_count         = models.PositiveIntegerField(default=0, editable=False)
+  comment_count       = models.PositiveIntegerField(default=0, editable=False, help_text='Published comments')
+  attachment_count    = models.PositiveIntegerField(default=0, editable=False)
+  # Responsive derivatives, rendered by archive/services/derivatives.py
+  DERIVATIVE_STATUS = [('pending', _('pending')), ('ready', _('ready')), ('failed', _('failed'))]
+  derivative_status   = models.CharField(max_length=16, choices=DERIVATIVE_STATUS, default='pending', editable=False)
+  derivative_widths   = models.JSONField(default=list, blank=True, editable=False, help_text='Widths rendered in every format of settings.DERIVATIVE_FORMATS')
+  placeholder         = models.CharField(max_length=1000, blank=True, editable=False, help_text='Tiny blurred version as data URI, shown while the image loads')
+  color               = models.CharField(max_length=7, blank=True, editable=False, help_text='Dominant colour, #rrggbb')
+  tiles_key           = models.CharField(max_length=16, blank=True, editable=False, help_text='Version of the deep zoom tile pyramid, empty without')
   
   def date(self):
     """ Returns the date of the image by combining the year, month and day fields """
@@ -153,6 +155,13 @@ class Image(BaseModel, RequestMixin, FilterMixin):
   
   objects = ImageManager()  # Provides access to optimised querysets
 
+  class Meta:
+    indexes = [
+      models.Index(fields=["date_created", "id"]),  # Keyset pagination of image lists
+      models.Index(fields=["date_key"]),
+      models.Index(fields=["decade", "date_key"]),
+    ]
+
   def __str__(self):
     return self.get_indexed_name()
 
@@ -176,6 +185,9 @@ class Image(BaseModel, RequestMixin, FilterMixin):
         'width': self.width,
         'height': self.height,
       },
+      'date_taken': self.date_taken,
+      'camera': self.camera,
+      'location': (self.latitude, self.longitude) if self.latitude is not None and self.longitude is not None else None,
       'extension': self.extension(),
       'user': self.user,
       'users': User.objects.all(),
@@ -197,17 +209,6 @@ class Image(BaseModel, RequestMixin, FilterMixin):
   def actionlist(self):
     return True
   
-  @searchable_function
-  def familycollection(self):
-    return self.family_collection()
-  
-  @searchable_function
-  def decade(self):
-    if self.year:
-      decade = floor(self.year / 10) * 10
-      return decade
-    return None
-  
   ''' Get Save Slug
       Loop through existing slugs and append slug with counter if Unique contraint would fail
   '''
@@ -234,15 +235,11 @@ class Image(BaseModel, RequestMixin, FilterMixin):
   
   ''' Related Object Methods'''
   def count_comments(self):
-    if hasattr(self, 'comment_count'):
-      return self.comment_count
-    return self.get_comments().count()
+    return self.comment_count
   def get_comments(self):
     return self.filter(self.comments)
   def count_attachments(self):
-    if hasattr(self, 'attachment_count'):
-      return self.attachment_count
-    return self.get_attachments().count()
+    return self.attachment_count
   def get_attachments(self):
     return self.filter(self.attachments)
   
@@ -264,13 +261,79 @@ class Image(BaseModel, RequestMixin, FilterMixin):
     return User.objects.filter(is_active=True)
 
   def count_tags(self):
-    return self.tag.count()
+    return self.tag_count
   def count_people(self):
     return self.filter(self.people).count()
+  @property
+  def category_image_count(self):
+    return self.category.image_count if self.category_id else 0
+  @property
+  def category_parent_image_count(self):
+    return self.category.parent.image_count if self.category_id and self.category.parent_id else 0
   def has_thumbnail(self):
     return True if self.thumbnail else False
+  ''' Responsive Derivatives
+      Until the derivatives are rendered, templates fall back to the
+      thumbnail or a placeholder.
+  '''
+  def derivatives_ready(self):
+    return self.derivative_status == 'ready' and len(self.derivative_widths) > 0
+  def srcset(self):
+    """ {format: srcset attribute value} for every derivative format """
+    return {
+      format: ', '.join(f"{ settings.MEDIA_URL }{ derivative_name(self.pk, width, format) } { width }w" for width in self.derivative_widths)
+      for format in getattr(settings, 'DERIVATIVE_FORMATS', ['webp', 'jpeg'])
+    }
+  def placeholder_style(self):
+    """ Inline style that reserves the space of the image and shows its colour and placeholder until it is loaded """
+    style = []
+    if self.has_dimensions():
+      style.append(f"aspect-ratio: { self.width } / { self.height }")
+    if self.color:
+      style.append(f"background: { self.color }" + (f" url({ self.placeholder }) center / cover no-repeat" if self.placeholder else ''))
+    return '; '.join(style)
+  def derivative_src(self, width=640):
+    """ JPEG derivative closest to width, for the src of browsers without srcset """
+    widths = sorted(self.derivative_widths, key=lambda available: (available < width, abs(available - width)))
+    return derivative_name(self.pk, widths[0], 'jpeg') if widths else self.thumbnail
+  def deep_zoom(self):
+    """ Tile pyramid for the tiled viewer, None when there is none for the current file """
+    from archive.services import deep_zoom
+    if not self.tiles_key or self.tiles_key != deep_zoom.get_key(self):
+      return None
+    name = f"{ settings.MEDIA_URL }{ tiles_name(self.pk, self.tiles_key) }"
+    return {
+      'dzi': f"{ name }.dzi", 'tiles': f"{ name }_files/", 'width': self.width, 'height': self.height,
+      'tile_size': TILE_SIZE, 'overlap': TILE_OVERLAP,
+    }
   def extension(self):
     return Path(str(self.source)).suffix[1:].lower()
+
+  ''' Dimensions
+      Upright width and height are read from the file once, by the upload
+      view or a metadata media job; templates never open the file. When
+      they are missing, a metadata job is queued instead.
+  '''
+  def request_metadata(self):
+    if self.pk and not hasattr(self, '_metadata_requested'):
+      from archive.services import derivatives
+      self._metadata_requested = derivatives.request(self.pk, derivatives.METADATA)
+  def has_dimensions(self):
+    if self.width and self.height:
+      return True
+    self.request_metadata()
+    return False
+  def dimensions(self):
+    return f"{ self.width }x{ self.height }" if self.has_dimensions() else None
+  def aspect_ratio(self):
+    return self.width / self.height if self.has_dimensions() else None
+  def shape(self):
+    """ square, landscape or portrait """
+    if not self.has_dimensions():
+      return None
+    if self.width == self.height:
+      return 'square'
+    return 'landscape' if self.width > self.height else 'portrait'
   
   ''' Family Collection '''
   @ajax_function
@@ -286,27 +349,14 @@ class Image(BaseModel, RequestMixin, FilterMixin):
     
   @ajax_function
   def family_collection(self):
+    """ Families whose collection this image belongs to, stored in ImageFamily """
     if not hasattr(self, '_family_collection'):
-      result = []
-      for person in self.people.all():
-        if person.last_name in getattr(settings, 'FAMILIES', []) or person.married_name in getattr(settings, 'FAMILIES', []):
-          family = person.last_name if person.last_name in getattr(settings, 'FAMILIES', []) else person.married_name
-          if family not in result:
-            result.append(family)
-      if self.family in getattr(settings, 'FAMILIES', []) and self.family not in result:
-        result.append(self.family)
-      self._family_collection = result
+      self._family_collection = [row.family for row in self.family_collections.all()]
     return self._family_collection
   
   def automated_family(self):
     if not hasattr(self, '_automated_family'):
-      families = []
-      for person in self.people.all():
-        if person.last_name in getattr(settings, 'FAMILIES', []) or person.married_name in getattr(settings, 'FAMILIES', []):
-          family = person.last_name if person.last_name in getattr(settings, 'FAMILIES', []) else person.married_name
-          if family not in families:
-            families.append(family)
-      self._automated_family = families
+      self._automated_family = [row.family for row in self.family_collections.all() if row.automated]
     return self._automated_family
     
   
@@ -316,22 +366,14 @@ class Image(BaseModel, RequestMixin, FilterMixin):
   ''' Cache Metadata 
       Image Metadata is sometimes displayed as nice-to-have. To minimize file system calls, this information is cached in the database.
   '''
-  ''' Store Image File Size '''
-  def storeSize(self):
-    from os import stat
-    file_stats = stat(settings.MEDIA_ROOT.joinpath(str(self.source)))
-    self.size = file_stats.st_size
-    self.save()
-
-  ''' Display Image File size. Calculate if not stored yet '''
+  ''' Display Image File size. Queue reading it if not stored yet '''
   def getSize(self):
     if not hasattr(self, '_size'):
       ''' https://stackoverflow.com/questions/5194057/better-way-to-convert-file-sizes-in-python '''
       from math import floor, pow, log
       if self.size == 0:
-        self.storeSize()
-      if self.size == 0:
-        return "0B"
+        self.request_metadata()
+        return None
       size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
       i = int(floor(log(self.size, 1024)))
       p = pow(1024, i)
@@ -339,18 +381,6 @@ class Image(BaseModel, RequestMixin, FilterMixin):
       self._size = "%s %s" % (s, size_name[i])
     return self._size
 
-  def get_image_dimensions(self):
-    if not hasattr(self, '_dimensions'):
-      height = 0
-      width = 0
-      try:
-        with PIL.open(self.source) as img:
-          width, height = img.size
-      except Exception as e:
-        return None
-      self._dimensions = (height, width)
-    return self._dimensions
-  
   def save(self, *args, **kwargs):
     ''' If no title is given, use source file name as title '''
     if not self.title:
@@ -360,5 +390,30 @@ class Image(BaseModel, RequestMixin, FilterMixin):
     # ''' Generate thumbnail '''
     # if self.source and not self.thumbnail:
     #   self.thumbnail = get_thumbnail(self.source)
+    ''' Derive date key and decade from year, month and day '''
+    kwargs['update_fields'] = set_date_key(self, kwargs.get('update_fields'))
     ''' Save '''
-    return super(Image, self).save(*args, **kwargs)
\ No newline at end of file
+    return super(Image, self).save(*args, **kwargs)
+
+
+''' Image Family Collections
+    One row for each family (settings.FAMILIES) whose collection an image
+    belongs to: a tagged person has the family as last or married name
+    (automated), or the family is assigned in Image.family. Stored so family
+    filters and facets run in the database; kept in sync by
+    archive.services.family_collections.
+'''
+class ImageFamily(models.Model):
+  image               = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='family_collections')
+  family              = models.CharField(max_length=64)
+  automated           = models.BooleanField(default=True, help_text='Derived from a tagged person rather than Image.family')
+
+  class Meta:
+    ordering = ('pk', )
+    unique_together = ('image', 'family', )
+    indexes = [
+      models.Index(fields=["family", "image"]),
+    ]
+
+  def __str__(self):
+    return f"{ self.image_id } in collection { self.family }"
@@ -0,0 +1,37 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from .image import Image
+
+''' Media Jobs
+    Queue of file processing for images that runs outside the web request.
+    One row per image and task; `manage.py process_media_jobs` claims queued
+    jobs and runs them in a local worker pool (archive/services/derivatives.py).
+    Queuing a task again for the same image resets its row.
+'''
+class MediaJob(models.Model):
+  QUEUED = 'queued'
+  RUNNING = 'running'
+  DONE = 'done'
+  FAILED = 'failed'
+  STATUS = [(QUEUED, _('queued')), (RUNNING, _('running')), (DONE, _('done')), (FAILED, _('failed'))]
+  TASKS = [('derivatives', _('derivatives')), ('metadata', _('metadata')), ('avatars', _('avatars')), ('tiles', _('tiles'))]
+
+  image               = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='media_jobs')
+  task                = models.CharField(max_length=32, choices=TASKS, default='derivatives')
+  status              = models.CharField(max_length=16, choices=STATUS, default=QUEUED)
+  attempts            = models.PositiveSmallIntegerField(default=0)
+  error               = models.TextField(blank=True)
+  date_created        = models.DateTimeField(auto_now_add=True)
+  date_started        = models.DateTimeField(blank=True, null=True)
+  date_finished       = models.DateTimeField(blank=True, null=True)
+
+  class Meta:
+    ordering = ('pk', )
+    unique_together = ('image', 'task', )
+    indexes = [
+      models.Index(fields=["status", "task", "id"]),  # Claiming the oldest queued jobs
+    ]
+
+  def __str__(self):
+    return f"{ self.task } of image { self.image_id }: { self.status }"
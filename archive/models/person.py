@@ -1,8 +1,8 @@
 import datetime
 from django.core.cache import cache
-from django.db import models
+from django.db import models, connections
 from django.db.models import F
-from django.db.models.functions import Coalesce
+from django.db.models.query import RawQuerySet
 from django.contrib.auth.models import User
 from django.template.defaultfilters import slugify
 from django.conf import settings
@@ -18,7 +18,8 @@ from django.db.models import (
 )
 from django.db.models import Q
 
-from .Event import Event
+from .Event import Event, get_date_key_range
+from archive.services.imaging import avatar_name
 
 from cmnsd.models import BaseModel
 from cmnsd.models.BaseMethods import ajax_function, searchable_function
@@ -56,24 +57,86 @@ class PersonQuerySet(models.QuerySet):
     )
 
   def with_annotations(self):
-    """Annotate birth/death year and image count — avoids per-row queries on list views."""
-    birth_qs = Event.objects.filter(people=OuterRef('pk'), type='birth').values('year')[:1]
-    death_qs = Event.objects.filter(people=OuterRef('pk'), type='death').values('year')[:1]
+    """Annotate image and note count — avoids per-row queries on list views.
+    Birth and death dates are stored on Person and need no annotation."""
     return self.annotate(
-      annotated_birth_year=Subquery(birth_qs, output_field=IntegerField()),
-      annotated_death_year=Subquery(death_qs, output_field=IntegerField()),
       image_count=Count('images', distinct=True),
       note_count=Count('notes', distinct=True),
     )
 
   def optimized(self):
-    """Full optimization — prefetch all commonly accessed relations."""
-    return self.with_events().with_relations()
+    """Full optimization — prefetch all commonly accessed relations.
+    Family relations are served by the family graph and need no prefetch."""
+    return self.with_events()
 
   def optimized_list(self):
     """Optimisation for list views — annotations instead of per-row event queries."""
     return self.with_annotations()
 
+  ''' Recursive family queries
+      Walk parent relations over any number of generations in a single
+      WITH RECURSIVE query (SQLite and PostgreSQL). Each returned person
+      carries a `generation` attribute: 1 for parents/children, 2 for
+      grandparents/grandchildren, and so on. People reachable through more
+      than one line get the nearest generation.
+      Filters already applied to the queryset are honoured; the result is a
+      RawQuerySet, so apply further filtering before calling these methods.
+      max_generations=None means all generations (up to MAX_GENERATIONS);
+      0 gives an empty queryset.
+  '''
+  MAX_GENERATIONS = 100  # Guards against cycles in (erroneous) relation data
+
+  def ancestors(self, person, max_generations=None):
+    """Return all ancestors of person, annotated with `generation`."""
+    return self._relatives(person, 'up', max_generations)
+
+  def descendants(self, person, max_generations=None):
+    """Return all descendants of person, annotated with `generation`."""
+    return self._relatives(person, 'down', max_generations)
+
+  def _relatives(self, person, direction, max_generations=None):
+    connection = connections[self.db]
+    qn = connection.ops.quote_name
+    person_table = qn(self.model._meta.db_table)
+    relation_table = qn(FamilyRelations._meta.db_table)
+    # Walking up follows child → parent, walking down follows parent → child
+    source, target = ('down_id', 'up_id') if direction == 'up' else ('up_id', 'down_id')
+    limit = self.MAX_GENERATIONS if max_generations is None else min(max_generations, self.MAX_GENERATIONS)
+    if limit < 1:
+      return self.none()
+    person_id = person.pk if hasattr(person, 'pk') else int(person)
+
+    params = [person_id, limit]
+    restrict = ''
+    if self.query.where:
+      # Apply filters of this queryset to the result
+      subquery, subparams = self.order_by().values('pk').query.get_compiler(using=self.db).as_sql()
+      restrict = f"WHERE p.{ qn('id') } IN ({ subquery })"
+      params.extend(subparams)
+
+    sql = f"""
+      WITH RECURSIVE relatives(person_id, generation) AS (
+        SELECT { qn(target) }, 1
+          FROM { relation_table }
+          WHERE { qn(source) } = %s AND { qn('type') } = 'parent'
+        UNION
+        SELECT r.{ qn(target) }, relatives.generation + 1
+          FROM { relation_table } r
+          INNER JOIN relatives ON r.{ qn(source) } = relatives.person_id
+          WHERE r.{ qn('type') } = 'parent' AND relatives.generation < %s
+      )
+      SELECT p.*, g.generation
+        FROM { person_table } p
+        INNER JOIN (
+          SELECT person_id, MIN(generation) AS generation
+            FROM relatives
+            GROUP BY person_id
+        ) g ON g.person_id = p.{ qn('id') }
+        { restrict }
+        ORDER BY g.generation, p.{ qn('last_name') }, p.{ qn('first_names') }
+    """
+    return RawQuerySet(sql, model=self.model, params=params, using=self.db)
+
 
 
 class PersonManager(models.Manager):
@@ -96,6 +159,12 @@ class PersonManager(models.Manager):
   def optimized_list(self):
     return self.get_queryset().optimized_list()
 
+  def ancestors(self, person, max_generations=None):
+    return self.get_queryset().ancestors(person, max_generations)
+
+  def descendants(self, person, max_generations=None):
+    return self.get_queryset().descendants(person, max_generations)
+
 
 
 def annotate_relation(qs, label):
@@ -104,6 +173,23 @@ def annotate_relation(qs, label):
   )
 
 
+''' decades_alive
+    Decades in which a person born in birth_year and died in death_year was
+    alive. Without a year of death only the decade of birth is known; spans
+    are capped at MAX_DECADES to limit the effect of wrong dates.
+'''
+MAX_DECADES = 10
+
+def decades_alive(birth_year, death_year=None):
+  if not birth_year:
+    return []
+  start = floor(birth_year / 10) * 10
+  end = start
+  if death_year and death_year > birth_year:
+    end = min(floor(death_year / 10) * 10, start + (MAX_DECADES - 1) * 10)
+  return list(range(start, end + 10, 10))
+
+
 class Person(BaseModel):
   ''' Model: Person
       People are:
@@ -126,6 +212,14 @@ class Person(BaseModel):
   # Information
   # Dating
   MONTHS = [(1, 'januari'), (2, 'februari'), (3, 'maart'), (4, 'april'), (5, 'mei'), (6, 'juni'), (7, 'juli'), (8, 'augustus'), (9, 'september'), (10, 'oktober'), (11, 'november'), (12, 'december')]
+  # Birth and death dates, copied from the birth and death Events by
+  # archive/services/lifespan.py so they can be filtered and sorted on
+  birth_year          = models.PositiveIntegerField(null=True, blank=True, editable=False)
+  birth_month         = models.PositiveIntegerField(null=True, blank=True, editable=False)
+  birth_day           = models.PositiveIntegerField(null=True, blank=True, editable=False)
+  death_year          = models.PositiveIntegerField(null=True, blank=True, editable=False)
+  death_month         = models.PositiveIntegerField(null=True, blank=True, editable=False)
+  death_day           = models.PositiveIntegerField(null=True, blank=True, editable=False)
   
   moment_of_death_unconfirmed = models.BooleanField(default=False, help_text='Set True if moment of death is unknown but person has deceased.')
 
@@ -143,6 +237,7 @@ class Person(BaseModel):
   portrait_y = models.IntegerField(null=True, blank=True)
   portrait_w = models.IntegerField(null=True, blank=True)
   portrait_h = models.IntegerField(null=True, blank=True)
+  avatar_key = models.CharField(max_length=16, blank=True, editable=False, help_text='Version of the rendered avatars, empty without avatar')
 
   
   class Meta:
@@ -151,6 +246,8 @@ class Person(BaseModel):
     verbose_name_plural = 'people'
     indexes = [
       models.Index(fields=["last_name", "first_names"]),
+      models.Index(fields=["birth_year", "birth_month", "birth_day"]),
+      models.Index(fields=["death_year"]),
     ]
 
   objects = PersonManager()  # Provides access to optimised querysets
@@ -192,39 +289,24 @@ class Person(BaseModel):
       'moment_of_death_unconfirmed': self.moment_of_death_unconfirmed,
     }
   
-  ''' SEARCHABLE FUNCTIONS '''
-  ''' Decade and Century shorthand available for searching people
-      alive in a certain period
+  ''' Decade and Century shorthand for display, e.g. the century headers
+      of the people list. Not searchable: the year, decade and century
+      filters join the indexed PersonDecade table (filter_period()) instead
+      of calling these per row.
   '''
-  @searchable_function
   def century(self):
     if not hasattr(self, '_century'):
       self._century = None
-      if self.birth() and self.birth().year:
-        self._century = floor(self.birth().year/100)*100
+      if self.birth_year:
+        self._century = floor(self.birth_year/100)*100
     return self._century
 
-  @searchable_function
   def decade(self):
     if not hasattr(self, '_decades'):
-      decades = []
-      if self.birth() and self.birth().year:
-        decade = floor(self.birth().year/10)*10
-        if decade not in decades:
-          decades.append(decade)
-        if self.death() and self.death().year:
-          max = 0
-          while decade <= floor(self.death().year/10)*10:
-            decade +=10
-            max +=1
-            if decade not in decades and decade <= floor(self.death().year/10)*10:
-              decades.append(decade)
-            if max > 8:
-              break
-      decades.sort()
-      self._decades = decades
+      self._decades = decades_alive(self.birth_year, self.death_year)
     return self._decades
   
+  ''' SEARCHABLE FUNCTIONS '''
   ''' NAME Displaying '''
   @searchable_function
   def last_names(self):
@@ -280,9 +362,8 @@ class Person(BaseModel):
   @ajax_function
   def get_date_of_birth(self):
     if not hasattr(self, '_date_of_birth'):
-      birth = self.birth()
-      if birth and birth.year:
-        self._date_of_birth = datetime.date(year=birth.year, month=birth.month or 1, day=birth.day or 1)
+      if self.birth_year:
+        self._date_of_birth = datetime.date(year=self.birth_year, month=self.birth_month or 1, day=self.birth_day or 1)
       else:
         self._date_of_birth = None
     return self._date_of_birth
@@ -290,9 +371,8 @@ class Person(BaseModel):
   @ajax_function
   def get_date_of_death(self):
     if not hasattr(self, '_date_of_death'):
-      death = self.death()
-      if death and death.year:
-        self._date_of_death = datetime.date(year=death.year, month=death.month or 1, day=death.day or 1)
+      if self.death_year:
+        self._date_of_death = datetime.date(year=self.death_year, month=self.death_month or 1, day=self.death_day or 1)
       else:
         self._date_of_death = None
     return self._date_of_death
@@ -328,35 +408,22 @@ class Person(BaseModel):
       ).distinct()
       # Crop events between birth and death
       if self.birth():
-        events = events.filter(
-          models.Q(year__gt=self.birth().year) |
-          models.Q(year=self.birth().year, month__gte=Coalesce(self.birth().month, 1)) |
-          models.Q(year=self.birth().year, month=Coalesce(self.birth().month, 1), day__gte=Coalesce(self.birth().day, 1))
-        )
+        start = get_date_key_range(self.birth().year, self.birth().month, self.birth().day)[0]
+        if start:
+          events = events.filter(date_key__gte=start)
       if self.death():
-        events = events.filter(
-          models.Q(year__lt=self.death().year) |
-          models.Q(year=self.death().year, month__lte=Coalesce(self.death().month, 12)) |
-          models.Q(year=self.death().year, month=Coalesce(self.death().month, 12), day__lte=Coalesce(self.death().day, 31))
-        )
-      self._timeline = events.order_by('year', 'month', 'day').distinct()
+        end = get_date_key_range(self.death().year, self.death().month, self.death().day)[1]
+        if end:
+          events = events.filter(date_key__lte=end)
+      self._timeline = events.order_by('date_key', 'title').distinct()
     return self._timeline
 
   def get_lifespan_data(self):
-    data = {
-      'birth_year': None,
-      'death_year': None,
+    return {
+      'birth_year': self.birth_year,
+      'death_year': self.death_year,
       'moment_of_death_unconfirmed': self.moment_of_death_unconfirmed,
     }
-    if hasattr(self, 'annotated_birth_year'):
-      data['birth_year'] = self.annotated_birth_year
-    elif self.birth() and self.birth().year:
-      data['birth_year'] = self.birth().year
-    if hasattr(self, 'annotated_death_year'):
-      data['death_year'] = self.annotated_death_year
-    elif self.death() and self.death().year:
-      data['death_year'] = self.death().year
-    return data
 
   def get_lifespan(self):
     lifespan = ''
@@ -505,6 +572,15 @@ class Person(BaseModel):
   '''
   def get_absolute_url(self):
     return reverse_lazy('archive:person', kwargs={'pk':self.id, 'name': self.slug})
+
+  ''' Avatars
+      Square crops of the portrait, rendered by the media job worker
+      (archive/services/avatars.py); URLs change with every render.
+  '''
+  def avatar_url(self, size, format='jpeg'):
+    if not self.avatar_key:
+      return None
+    return f"{ settings.MEDIA_URL }{ avatar_name(self.pk, self.avatar_key, size, format) }"
   
 
   ''' Processing at save
@@ -568,3 +644,22 @@ class FamilyRelations(models.Model):
   def types(self):
     return dict(self.RELATION_CHOICES)
 
+
+''' Person Decades
+    One row for each decade a person was alive in, derived from the stored
+    birth and death years (see decades_alive). Allows period filters and
+    facets on people lists to use an indexed join instead of computing
+    Person.decade() for every row. Kept in sync by archive.services.lifespan.
+'''
+class PersonDecade(models.Model):
+  person              = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='decades')
+  decade              = models.PositiveIntegerField()
+
+  class Meta:
+    unique_together = ('person', 'decade', )
+    indexes = [
+      models.Index(fields=["decade", "person"]),
+    ]
+
+  def __str__(self):
+    return f"{ self.person_id } alive in { self.decade }s"
@@ -1,9 +1,8 @@
 from math import floor
 from django.conf import settings
-from django.db.models import Q
-from django.db.models import OuterRef, Subquery, IntegerField
+from django.db.models import Q, Count
 
-from archive.models import Person, Event
+from archive.models import Person, PersonDecade, Event
 
 ''' get_person_filters
     Returns active filters for a person view
@@ -55,51 +54,42 @@ def get_person_filters(request):
       filters[filter] = default_value
   return filters
 
-def annotate_qs(queryset):
-  birth_qs = (
-    Event.objects
-    .filter(people=OuterRef("pk"), type="birth")
-    .order_by("-year", "-month", "-day")
-  )
-
-  death_qs = (
-    Event.objects
-    .filter(people=OuterRef("pk"), type="death")
-    .order_by("-year", "-month", "-day")
-  )
-
-  queryset = queryset.annotate(
-    birth_year=Subquery(birth_qs.values("year")[:1], IntegerField()),
-    death_year=Subquery(death_qs.values("year")[:1], IntegerField()),
-  )
-  return queryset
+''' Period facets
+    Decades and centuries in which the people in queryset were alive, read
+    from the PersonDecade table with a single GROUP BY query.
+'''
+def get_decade_counts(queryset):
+  people = queryset.order_by().values('pk')
+  rows = PersonDecade.objects.filter(person__in=people).values('decade').annotate(people=Count('person')).order_by('decade')
+  return {row['decade']: row['people'] for row in rows}
 
 ''' Get a list of centuries of all People '''
 def get_centuries(queryset):
-  centuries = set()
-  queryset = annotate_qs(queryset)
-  qs = queryset.exclude(birth_year__isnull=True)
-
-  for birth, death in qs.values_list("birth_year", "death_year"):
-    start = (birth // 100) * 100
-    end = ((death or birth) // 100) * 100
+  return centuries_of(get_decade_counts(queryset))
 
-    for decade in range(start, end + 1, 10):
-      centuries.add(decade)
-
-  return sorted(centuries)
+def centuries_of(decades):
+  return sorted(set(floor(decade / 100) * 100 for decade in decades))
   
-''' Get a list of all decades a Person has been born in '''
+''' Get a list of all decades a Person has been alive in '''
 def get_decades(queryset):
-  decades = set()
-  queryset = annotate_qs(queryset)
-  qs = queryset.exclude(birth_year__isnull=True)
-
-  for birth, death in qs.values_list("birth_year", "death_year"):
-    start = (birth // 10) * 10
-    end = ((death or birth) // 10) * 10
-
-    for decade in range(start, end + 1, 10):
-      decades.add(decade)
+  return list(get_decade_counts(queryset))
 
-  return sorted(decades)
\ No newline at end of file
+''' filter_period
+    Limit a person queryset to people alive in the year, decade or century
+    of the active filters, joining the indexed PersonDecade table.
+'''
+def filter_period(queryset, filters):
+  if filters.get('year'):
+    year = filters['year']
+    return queryset.filter(
+      decades__decade=floor(year / 10) * 10,
+      birth_year__lte=year,
+    ).filter(Q(death_year__gte=year) | Q(death_year__isnull=True))
+  if filters.get('decade'):
+    return queryset.filter(decades__decade=filters['decade'])
+  if filters.get('century'):
+    century = filters['century']
+    return queryset.filter(pk__in=PersonDecade.objects.filter(
+      decade__gte=century, decade__lt=century + 100,
+    ).values('person'))
+  return queryset
@@ -0,0 +1,114 @@
+"""
+Square portrait avatars of people.
+
+A person's portrait is the first image of Person.portraits; the crop chosen
+on the person page is stored in Person.portrait_x/y/w/h, in pixels of the
+upright original. The media job worker renders that crop, squared, at
+settings.AVATAR_SIZES in every format of settings.DERIVATIVE_FORMATS to
+MEDIA_ROOT/avatars/<person id>/<key>-<size>.<ext> (imaging.render_avatars()),
+so the people list, family panels and tree nodes never load a full image.
+
+The key is a hash of the portrait file, the crop, the sizes and formats.
+Person.avatar_key holds the key of the last render: sync() queues the
+avatars task (derivatives.AVATARS) for a portrait only when that key
+changed, so saving a person or image without touching the portrait renders
+nothing. As the key is part of the file name, every render has a new URL.
+"""
+
+import base64
+import hashlib
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from archive.models import Image, Person
+from archive.services import derivatives, imaging
+
+DEFAULT_SIZES = [32, 48, 64, 96]
+TREE_SIZE = 32
+
+
+def sizes():
+  return sorted(getattr(settings, 'AVATAR_SIZES', DEFAULT_SIZES))
+
+
+def get_size(size):
+  """ Smallest rendered size of at least size, or the largest """
+  return min((available for available in sizes() if available >= size), default=max(sizes()))
+
+
+def get_crop(person):
+  """ (x, y, w, h) of the portrait crop, or None when no usable crop is stored """
+  box = (person.portrait_x, person.portrait_y, person.portrait_w, person.portrait_h)
+  if None in box or box[2] <= 0 or box[3] <= 0:
+    return None
+  return box
+
+
+def get_people(**filters):
+  """ People with their portraits prefetched in get_portrait() order """
+  return Person.objects.filter(**filters).only(
+    'avatar_key', 'portrait_x', 'portrait_y', 'portrait_w', 'portrait_h',
+  ).prefetch_related(Prefetch('portraits', queryset=Image.objects.order_by('pk').only('pk', 'source', 'sha256')))
+
+
+def get_portrait(person):
+  """ Image the avatar is cut from: the first portrait """
+  portraits = person.portraits.all()
+  if 'portraits' not in getattr(person, '_prefetched_objects_cache', {}):
+    portraits = portraits.order_by('pk')[:1]
+  return next(iter(portraits), None)
+
+
+def get_key(person, image):
+  """ Hash of everything an avatar is rendered from """
+  parts = [image.pk, image.sha256 or str(image.source), get_crop(person), sizes(), derivatives.formats()]
+  return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def outdated(person_ids=None):
+  """ Ids of the portraits whose avatars are missing or outdated; clears
+      the avatars of people who no longer have a portrait
+  """
+  people = get_people(pk__in=list(person_ids)) if person_ids is not None else get_people(portraits__isnull=False).distinct()
+  images = set()
+  for person in people:
+    image = get_portrait(person)
+    if image is None:
+      if person.avatar_key:
+        Person.objects.filter(pk=person.pk).update(avatar_key='')
+        delete_avatars(person.pk)
+    elif get_key(person, image) != person.avatar_key:
+      images.add(image.pk)
+  return images
+
+
+def sync(person_ids):
+  """ Queue the avatars task for the portraits of these people where needed; returns the number queued """
+  return derivatives.enqueue(outdated(person_ids), derivatives.AVATARS)
+
+
+def get_crops(image):
+  """ {person_id: (key, box)} of the people whose portrait is image """
+  return {
+    person.pk: (get_key(person, image), get_crop(person))
+    for person in get_people(portraits=image)
+    if get_portrait(person).pk == image.pk
+  }
+
+
+def data_uri(person, size=TREE_SIZE):
+  """ JPEG avatar as data URI, for SVG shown in <img> (which loads no other files); None without avatar """
+  if not person.avatar_key:
+    return None
+  path = Path(settings.MEDIA_ROOT).joinpath(imaging.avatar_name(person.pk, person.avatar_key, get_size(size), 'jpeg'))
+  try:
+    return 'data:image/jpeg;base64,' + base64.b64encode(path.read_bytes()).decode('ascii')
+  except OSError:
+    return None
+
+
+def delete_avatars(person_id):
+  shutil.rmtree(Path(settings.MEDIA_ROOT).joinpath('avatars', str(person_id)), ignore_errors=True)
@@ -0,0 +1,53 @@
+"""
+Named version counters, stored in the database (CacheVersion).
+
+Cached results and in-process indexes that depend on many rows put a
+version number in their keys instead of being deleted one by one; bumping
+the version orphans all of them at once, in every process. The counters
+are kept in the database rather than the cache: without a shared cache
+backend every web and media worker has its own LocMemCache and would never
+see a bump made by another.
+
+A process reads a counter at most once per request (clear() runs on
+request_started, archive/signals.py) and at most every CHECK_INTERVAL
+seconds outside requests, so lookups in loops cost no queries.
+"""
+
+import time
+
+from django.db.models import F
+
+CHECK_INTERVAL = 5
+
+_versions = {}
+
+
+def clear():
+  """ Forget the counters read so far; the next get_version() reads them again """
+  _versions.clear()
+
+
+def _remember(name, version):
+  _versions[name] = (version, time.monotonic())
+  return version
+
+
+def _read(name):
+  from archive.models import CacheVersion
+  return CacheVersion.objects.filter(name=name).values_list('version', flat=True).first() or 1
+
+
+def get_version(name):
+  known = _versions.get(name)
+  if known is not None and time.monotonic() - known[1] < CHECK_INTERVAL:
+    return known[0]
+  return _remember(name, _read(name))
+
+
+def bump_version(name):
+  from archive.models import CacheVersion
+  if not CacheVersion.objects.filter(name=name).update(version=F('version') + 1):
+    counter, created = CacheVersion.objects.get_or_create(name=name, defaults={'version': 2})
+    if not created:
+      CacheVersion.objects.filter(name=name).update(version=F('version') + 1)
+  return _remember(name, _read(name))
@@ -0,0 +1,96 @@
+"""
+Content-addressed storage of uploaded originals.
+
+Uploads are streamed to a temporary file while their SHA-256 is computed,
+then moved to MEDIA_ROOT/originals/<2 hex>/<2 hex>/<sha256><suffix>. The
+same content therefore always ends up at the same path and is stored once;
+Image.sha256 holds the digest so the upload view can find images that were
+uploaded before. .heic uploads are converted to jpeg first and stored (and
+hashed) as jpeg.
+
+Uploads Django already spooled to a temporary file are moved instead of
+copied.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from PIL import Image as PIL
+
+from archive.services.imaging import MAX_IMAGE_PIXELS
+
+STORE_DIRECTORY = 'originals'
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_store_path():
+  return Path(settings.MEDIA_ROOT).joinpath(STORE_DIRECTORY)
+
+
+def content_path(digest, suffix):
+  """ Path of stored content, relative to MEDIA_ROOT """
+  return Path(STORE_DIRECTORY).joinpath(digest[:2], digest[2:4], f"{ digest }{ suffix.lower() }")
+
+
+def file_digest(path):
+  """ SHA-256 of a file, read in chunks """
+  digest = hashlib.sha256()
+  with open(path, 'rb') as file:
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def temporary_file():
+  get_store_path().mkdir(parents=True, exist_ok=True)
+  handle, path = tempfile.mkstemp(dir=get_store_path(), prefix='.upload-')
+  return handle, path
+
+
+def receive(uploaded_file, convert_heic=False):
+  """ Store an upload in a temporary file; returns (temporary path, sha256).
+      Pass the result to keep() or discard().
+  """
+  handle, temporary = temporary_file()
+  if convert_heic:
+    os.close(handle)
+    PIL.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with PIL.open(uploaded_file) as image:
+      ''' Keep the EXIF (date taken, camera, position); pillow-heif resets its orientation to upright '''
+      image.save(temporary, format='JPEG', exif=image.info.get('exif', b''))
+    return temporary, file_digest(temporary)
+  digest = hashlib.sha256()
+  if hasattr(uploaded_file, 'temporary_file_path'):
+    os.close(handle)
+    for chunk in uploaded_file.chunks(CHUNK_SIZE):
+      digest.update(chunk)
+    file_move_safe(uploaded_file.temporary_file_path(), temporary, allow_overwrite=True)
+  else:
+    with os.fdopen(handle, 'wb') as destination:
+      for chunk in uploaded_file.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+        destination.write(chunk)
+  return temporary, digest.hexdigest()
+
+
+def keep(temporary, digest, suffix):
+  """ Move a received upload to its content path, unless that content is stored already """
+  path = content_path(digest, suffix)
+  target = Path(settings.MEDIA_ROOT).joinpath(path)
+  if target.exists():
+    discard(temporary)
+  else:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temporary, target)
+  return path
+
+
+def discard(temporary):
+  try:
+    os.unlink(temporary)
+  except FileNotFoundError:
+    pass
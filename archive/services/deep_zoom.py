@@ -0,0 +1,48 @@
+"""
+Deep zoom tile pyramids of large scans.
+
+Images of at least settings.DEEP_ZOOM_PIXELS pixels get a tile pyramid in
+the Deep Zoom (DZI) layout, rendered by the media job worker once their
+derivatives are ready (imaging.render_tiles()): MEDIA_ROOT/tiles/<image
+id>/<key>.dzi and <key>_files/<level>/<column>_<row>.jpg. The detail page
+shows them in a tiled viewer (archive/static/js/deep_zoom.js), which only
+loads the tiles on screen instead of the original.
+
+The key is a hash of the file and the tile settings, stored in
+Image.tiles_key once the pyramid is complete; as it is part of every URL,
+tiles never change and can be cached for good.
+"""
+
+import hashlib
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+
+from archive.services import derivatives, imaging
+
+DEFAULT_PIXELS = 16_000_000
+
+
+def min_pixels():
+  """ Images of at least this many pixels get a tile pyramid """
+  return getattr(settings, 'DEEP_ZOOM_PIXELS', DEFAULT_PIXELS)
+
+
+def get_key(image):
+  """ Hash of everything a pyramid is rendered from """
+  parts = [image.sha256 or str(image.source), imaging.TILE_SIZE, imaging.TILE_OVERLAP, derivatives.quality()]
+  return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def needs_tiles(image):
+  return image.width * image.height >= min_pixels()
+
+
+def outdated(image):
+  """ Whether image needs a pyramid it does not have yet """
+  return needs_tiles(image) and get_key(image) != image.tiles_key
+
+
+def delete_tiles(image_id):
+  shutil.rmtree(Path(settings.MEDIA_ROOT).joinpath('tiles', str(image_id)), ignore_errors=True)
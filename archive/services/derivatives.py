@@ -0,0 +1,198 @@
+"""
+Background rendering of responsive image derivatives.
+
+Uploading an image only stores the original; enqueue() then adds a
+MediaJob. `manage.py process_media_jobs` claims queued jobs and renders them
+in a local process pool with archive/services/imaging.py: the widths in
+settings.DERIVATIVE_WIDTHS in every format of settings.DERIVATIVE_FORMATS
+(WebP and JPEG), written to MEDIA_ROOT/derivatives/<image id>/, plus the
+300 pixel thumbnail in MEDIA_ROOT/thumbnails. Image.derivative_status and
+derivative_widths are set when a job finishes, so templates use the srcset
+only once every file exists; Image.dhash (archive/services/near_duplicates.py),
+placeholder and color at the same time.
+
+The same queue runs the metadata task: dimensions, size and EXIF details
+read from the file header (archive/services/image_metadata.py), and the
+avatars task: square crops of a portrait for the people it is the portrait
+of (archive/services/avatars.py). Large scans get a deep zoom tile
+pyramid from the tiles task, queued when their derivatives are ready
+(archive/services/deep_zoom.py).
+`manage.py media_rebuild` queues any of the tasks for a selection of images.
+
+Claiming is a conditional UPDATE from queued to running, so several worker
+commands can share the queue on any database. Jobs left running by a worker
+that died are queued again after STALE_AFTER.
+"""
+
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from archive.models import Image, MediaJob, Person
+from archive.services import image_metadata, imaging, near_duplicates
+
+TASK = 'derivatives'
+METADATA = 'metadata'
+AVATARS = 'avatars'
+TILES = 'tiles'
+TASKS = [TASK, METADATA, AVATARS, TILES]
+DEFAULT_WIDTHS = [320, 640, 1280, 1920]
+DEFAULT_FORMATS = ['webp', 'jpeg']
+DEFAULT_QUALITY = 82
+MAX_ATTEMPTS = 3
+STALE_AFTER = timedelta(minutes=30)
+
+
+def widths():
+  return getattr(settings, 'DERIVATIVE_WIDTHS', DEFAULT_WIDTHS)
+
+
+def formats():
+  return getattr(settings, 'DERIVATIVE_FORMATS', DEFAULT_FORMATS)
+
+
+def quality():
+  return getattr(settings, 'DERIVATIVE_QUALITY', DEFAULT_QUALITY)
+
+
+def enqueue(image_ids, task=TASK, batch_size=500):
+  """ Queue the task for these images, resetting earlier jobs; returns the number queued """
+  image_ids = list(set(id for id in image_ids if id is not None))
+  for start in range(0, len(image_ids), batch_size):
+    batch = image_ids[start:start + batch_size]
+    existing = set(MediaJob.objects.filter(image__in=batch, task=task).values_list('image', flat=True))
+    MediaJob.objects.filter(image__in=existing, task=task).update(
+      status=MediaJob.QUEUED, attempts=0, error='', date_started=None, date_finished=None,
+    )
+    MediaJob.objects.bulk_create([MediaJob(image_id=id, task=task) for id in batch if id not in existing])
+    if task == TASK:
+      Image.objects.filter(pk__in=batch).update(derivative_status='pending')
+  return len(image_ids)
+
+
+def request(image_id, task=METADATA):
+  """ Queue the task for an image that never had it; safe to call while
+      rendering a page, as it leaves queued, running and failed jobs alone.
+      True when queued.
+  """
+  return MediaJob.objects.get_or_create(image_id=image_id, task=task)[1]
+
+
+def enqueue_missing(task=TASK, retry_failed=False):
+  """ Queue every image whose derivatives are not ready and not queued yet """
+  waiting = MediaJob.objects.filter(task=task, status__in=[MediaJob.QUEUED, MediaJob.RUNNING]).values('image')
+  images = Image.objects.exclude(derivative_status='ready').exclude(pk__in=waiting)
+  if not retry_failed:
+    images = images.exclude(derivative_status='failed')
+  return enqueue(list(images.values_list('pk', flat=True)), task)
+
+
+def requeue_stale(tasks=TASKS):
+  """ Queue jobs again whose worker stopped before finishing them """
+  return MediaJob.objects.filter(
+    task__in=tasks, status=MediaJob.RUNNING, date_started__lt=timezone.now() - STALE_AFTER,
+  ).update(status=MediaJob.QUEUED)
+
+
+def claim(limit, tasks=TASKS):
+  """ Mark up to limit of the oldest queued jobs of tasks as running and return them """
+  claimed = []
+  for pk in MediaJob.objects.filter(task__in=tasks, status=MediaJob.QUEUED).values_list('pk', flat=True)[:limit]:
+    if MediaJob.objects.filter(pk=pk, status=MediaJob.QUEUED).update(
+      status=MediaJob.RUNNING, attempts=F('attempts') + 1, date_started=timezone.now(),
+    ):
+      claimed.append(pk)
+  return list(MediaJob.objects.filter(pk__in=claimed).select_related('image'))
+
+
+def release(jobs):
+  """ Queue claimed jobs again without counting the attempt, e.g. when a worker stops """
+  for job in jobs:
+    current(job).update(status=MediaJob.QUEUED, attempts=F('attempts') - 1, date_started=None)
+
+
+def get_work(job):
+  """ (function, arguments) that run a job; imaging functions, so they can run in a worker process """
+  image = job.image
+  source = str(Path(settings.MEDIA_ROOT).joinpath(str(image.source)))
+  if job.task == METADATA:
+    return imaging.read_metadata, (source, )
+  if job.task == AVATARS:
+    from archive.services import avatars
+    dimensions = (image.width, image.height) if image.width and image.height else None
+    return imaging.render_avatars, (
+      source, str(settings.MEDIA_ROOT), avatars.get_crops(image), dimensions, avatars.sizes(), formats(), quality(),
+    )
+  if job.task == TILES:
+    from archive.services import deep_zoom
+    return imaging.render_tiles, (source, str(settings.MEDIA_ROOT), image.pk, deep_zoom.get_key(image), quality())
+  thumbnail = Path('thumbnails').joinpath(Path(str(image.source)).name)
+  return imaging.render_derivatives, (
+    image.pk, source, str(settings.MEDIA_ROOT), widths(), formats(), quality(), str(thumbnail),
+  )
+
+
+def current(job):
+  """ The job row, unless it was queued again since this worker claimed it """
+  return MediaJob.objects.filter(pk=job.pk, status=MediaJob.RUNNING, date_started=job.date_started)
+
+
+def complete(job, result):
+  """ Store the result of a finished job; update() so no save signals run """
+  if not current(job).update(status=MediaJob.DONE, error='', date_finished=timezone.now()):
+    return
+  if job.task == METADATA:
+    Image.objects.filter(pk=job.image_id).update(**image_metadata.get_fields(result))
+    return
+  if job.task == AVATARS:
+    for person_id, key in result.items():
+      Person.objects.filter(pk=person_id).update(avatar_key=key)
+    return
+  if job.task == TILES:
+    Image.objects.filter(pk=job.image_id).update(tiles_key=result['key'])
+    return
+  Image.objects.filter(pk=job.image_id).update(
+    derivative_status='ready', derivative_widths=result['widths'], thumbnail=result['thumbnail'],
+    dhash=near_duplicates.to_signed(result['dhash']), placeholder=result['placeholder'] or '', color=result['color'],
+  )
+  near_duplicates.index.invalidate()
+  from archive.services import deep_zoom
+  # The image was loaded when the job was claimed; a metadata job or edit may have changed it since
+  job.image.refresh_from_db(fields=['source', 'sha256', 'width', 'height', 'tiles_key'])
+  if deep_zoom.outdated(job.image):
+    enqueue([job.image_id], TILES)
+  elif job.image.tiles_key and not deep_zoom.needs_tiles(job.image):
+    Image.objects.filter(pk=job.image_id).update(tiles_key='')
+    deep_zoom.delete_tiles(job.image_id)
+
+
+def fail(job, error):
+  """ Queue the job again, or mark it and its image failed after MAX_ATTEMPTS; True when failed for good """
+  if job.attempts < MAX_ATTEMPTS:
+    current(job).update(status=MediaJob.QUEUED, error=str(error))
+    return False
+  if current(job).update(status=MediaJob.FAILED, error=str(error), date_finished=timezone.now()):
+    if job.task == TASK:
+      Image.objects.filter(pk=job.image_id).update(derivative_status='failed')
+    return True
+  return False
+
+
+def run(job):
+  """ Render a job in this process """
+  function, arguments = get_work(job)
+  try:
+    result = function(*arguments)
+  except Exception as e:
+    fail(job, e)
+    return None
+  complete(job, result)
+  return result
+
+
+def delete_derivatives(image_id):
+  shutil.rmtree(Path(settings.MEDIA_ROOT).joinpath('derivatives', str(image_id)), ignore_errors=True)
@@ -0,0 +1,65 @@
+"""
+Stored family collection membership of images.
+
+An image is in the collection of a family from settings.FAMILIES when a
+tagged person has it as last or married name, or when the family is set in
+Image.family. Memberships are stored as ImageFamily rows so the image list
+can filter and count family collections in SQL instead of calling
+Image.family_collection() per row.
+
+The handlers in archive/signals.py resync an image when its people or
+family change and when a tagged person is renamed or deleted. After editing
+settings.FAMILIES, or bulk changes that bypass signals, run
+`manage.py sync_family_collections`.
+"""
+
+from django.conf import settings
+from django.db.models import Q
+
+from archive.models import Image, ImageFamily
+
+
+def compute_families(image_ids):
+  """ {image id: [(family, automated), ...]} in the order Image.family_collection() returns them """
+  families = getattr(settings, 'FAMILIES', [])
+  result = {id: [] for id in image_ids}
+  if not families:
+    return result
+  rows = Image.people.through.objects.filter(image__in=image_ids).filter(
+    Q(person__last_name__in=families) | Q(person__married_name__in=families)
+  ).order_by('image', 'person__first_names', 'person__last_name').values_list('image', 'person__last_name', 'person__married_name')
+  for image_id, last_name, married_name in rows:
+    family = last_name if last_name in families else married_name
+    if family not in [name for name, automated in result[image_id]]:
+      result[image_id].append((family, True))
+  for image_id, family in Image.objects.filter(pk__in=image_ids, family__in=families).values_list('pk', 'family'):
+    if family not in [name for name, automated in result[image_id]]:
+      result[image_id].append((family, False))
+  return result
+
+
+def stored_families(image_ids):
+  result = {id: [] for id in image_ids}
+  for image_id, family, automated in ImageFamily.objects.filter(image__in=image_ids).values_list('image', 'family', 'automated'):
+    result[image_id].append((family, automated))
+  return result
+
+
+def sync_families(image_ids, batch_size=500):
+  """ Replace the ImageFamily rows of these images; returns the number of images changed """
+  image_ids = list(set(id for id in image_ids if id is not None))
+  changed = 0
+  for start in range(0, len(image_ids), batch_size):
+    batch = image_ids[start:start + batch_size]
+    expected = compute_families(batch)
+    stored = stored_families(batch)
+    ids = [id for id in batch if expected[id] != stored[id]]
+    if not ids:
+      continue
+    ImageFamily.objects.filter(image__in=ids).delete()
+    ImageFamily.objects.bulk_create(
+      [ImageFamily(image_id=id, family=family, automated=automated) for id in ids for family, automated in expected[id]],
+      batch_size=batch_size,
+    )
+    changed += len(ids)
+  return changed
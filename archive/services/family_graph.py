@@ -0,0 +1,220 @@
+"""
+In-process family graph index.
+
+Holds every FamilyRelations edge as integer-keyed adjacency lists so that
+parents, children, siblings, partners and co-parents of a person cost a
+dictionary lookup instead of one or more queries.
+
+The graph is built lazily from a single FamilyRelations scan and kept up to
+date incrementally by the post_save / post_delete handlers in
+archive/signals.py. A version counter in the database
+(archive/services/cache_version.py) lets other worker processes notice that
+the graph changed elsewhere; a stale process simply rebuilds on its next
+lookup, at the latest on its next request.
+
+Bulk operations that bypass signals (queryset.update(), bulk_create(), raw
+SQL) must call invalidate() afterwards.
+"""
+
+import threading
+from array import array
+
+from archive.services.cache_version import get_version, bump_version
+
+VERSION_NAME = 'family_graph'
+
+
+class FamilyGraph:
+  """ Array-backed adjacency lists for parent → child and partner edges.
+
+      _parents[id]  → array of parent ids
+      _children[id] → array of child ids
+      _partners[id] → array of explicit partner ids (both directions)
+      _relations    → (up_id, down_id, type) → FamilyRelations pk
+      _edges        → FamilyRelations pk → (up_id, down_id, type)
+  """
+
+  def __init__(self):
+    self._lock = threading.RLock()
+    self._version = None
+    self._reset()
+
+  def _reset(self):
+    self._parents = {}
+    self._children = {}
+    self._partners = {}
+    self._relations = {}
+    self._edges = {}
+    self._loaded = False
+
+  ''' Building and versioning '''
+  def _remote_version(self):
+    return get_version(VERSION_NAME)
+
+  def _build(self):
+    """ Build into a fresh index and swap it in, so readers never see a half-built graph """
+    from archive.models.person import FamilyRelations
+    fresh = FamilyGraph.__new__(FamilyGraph)
+    fresh._reset()
+    rows = FamilyRelations.objects.values_list('id', 'up_id', 'down_id', 'type')
+    for pk, up_id, down_id, type in rows.iterator(chunk_size=5000):
+      fresh._add(pk, up_id, down_id, type)
+    self._parents = fresh._parents
+    self._children = fresh._children
+    self._partners = fresh._partners
+    self._relations = fresh._relations
+    self._edges = fresh._edges
+    self._loaded = True
+
+  def ensure_loaded(self):
+    """ Build the graph on first use and rebuild when another process changed it """
+    version = self._remote_version()
+    if self._loaded and self._version == version:
+      return
+    with self._lock:
+      if not self._loaded or self._version != version:
+        self._build()
+        self._version = version
+
+  def version(self):
+    """ Version of the loaded graph; changes whenever a relation changes """
+    self.ensure_loaded()
+    return self._version
+
+  def invalidate(self):
+    """ Drop the graph in every process; it is rebuilt on the next lookup """
+    with self._lock:
+      self._reset()
+    self._bump_version()
+
+  def _bump_version(self):
+    return bump_version(VERSION_NAME)
+
+  ''' Edge bookkeeping '''
+  @staticmethod
+  def _append(index, key, value):
+    values = index.get(key)
+    if values is None:
+      index[key] = array('q', (value,))
+    elif value not in values:
+      values.append(value)
+
+  @staticmethod
+  def _remove(index, key, value):
+    values = index.get(key)
+    if values is not None and value in values:
+      values.remove(value)
+      if not values:
+        del index[key]
+
+  def _add(self, pk, up_id, down_id, type):
+    self._relations[(up_id, down_id, type)] = pk
+    self._edges[pk] = (up_id, down_id, type)
+    if type == 'parent':
+      self._append(self._children, up_id, down_id)
+      self._append(self._parents, down_id, up_id)
+    elif type == 'partner':
+      self._append(self._partners, up_id, down_id)
+      self._append(self._partners, down_id, up_id)
+
+  def _discard(self, up_id, down_id, type):
+    pk = self._relations.pop((up_id, down_id, type), None)
+    self._edges.pop(pk, None)
+    if type == 'parent':
+      self._remove(self._children, up_id, down_id)
+      self._remove(self._parents, down_id, up_id)
+    elif type == 'partner':
+      # A partnership may be stored in both directions; keep the edge while
+      # the reverse row still exists.
+      if (down_id, up_id, 'partner') not in self._relations:
+        self._remove(self._partners, up_id, down_id)
+        self._remove(self._partners, down_id, up_id)
+
+  def _apply(self, change, *args):
+    """ Apply a local change and keep this process in sync with the version counter """
+    with self._lock:
+      loaded = self._loaded
+      if loaded:
+        change(*args)
+      version = self._bump_version()
+      if loaded and self._version is not None and version == self._version + 1:
+        self._version = version
+      else:
+        # Another process changed the graph in between; rebuild lazily.
+        self._reset()
+
+  def relation_saved(self, pk, up_id, down_id, type):
+    """ Called after a FamilyRelations row was created or changed """
+    def change():
+      # The row may have changed endpoints or type; drop its previous edge first.
+      previous = self._edges.get(pk)
+      if previous and previous != (up_id, down_id, type):
+        self._discard(*previous)
+      self._add(pk, up_id, down_id, type)
+    self._apply(change)
+
+  def relation_deleted(self, pk, up_id, down_id, type):
+    """ Called after a FamilyRelations row was deleted """
+    def change():
+      if self._relations.get((up_id, down_id, type)) == pk:
+        self._discard(up_id, down_id, type)
+    self._apply(change)
+
+  ''' Lookups
+      All lookups return lists of person ids.
+  '''
+  def parents(self, person_id):
+    self.ensure_loaded()
+    return list(self._parents.get(person_id, ()))
+
+  def children(self, person_id):
+    self.ensure_loaded()
+    return list(self._children.get(person_id, ()))
+
+  def explicit_partners(self, person_id):
+    self.ensure_loaded()
+    return list(self._partners.get(person_id, ()))
+
+  def co_parents(self, person_id, child_id):
+    """ Other parents of child_id, besides person_id """
+    self.ensure_loaded()
+    return [p for p in self._parents.get(child_id, ()) if p != person_id]
+
+  def partners(self, person_id):
+    """ Explicit partners plus implied partners (people who share a child) """
+    self.ensure_loaded()
+    result = list(self._partners.get(person_id, ()))
+    seen = set(result)
+    seen.add(person_id)
+    for child_id in self._children.get(person_id, ()):
+      for parent_id in self._parents.get(child_id, ()):
+        if parent_id not in seen:
+          seen.add(parent_id)
+          result.append(parent_id)
+    return result
+
+  def siblings(self, person_id):
+    """ People who share at least one parent with person_id """
+    self.ensure_loaded()
+    result = []
+    seen = {person_id}
+    for parent_id in self._parents.get(person_id, ()):
+      for child_id in self._children.get(parent_id, ()):
+        if child_id not in seen:
+          seen.add(child_id)
+          result.append(child_id)
+    return result
+
+  def relation_id(self, up_id, down_id, type):
+    """ Primary key of a stored relation, or None for implied relations """
+    self.ensure_loaded()
+    return self._relations.get((up_id, down_id, type))
+
+  def partner_relation_id(self, person_id, partner_id):
+    self.ensure_loaded()
+    return self._relations.get((person_id, partner_id, 'partner')) \
+      or self._relations.get((partner_id, person_id, 'partner'))
+
+
+''' Module level graph, shared by all requests in this process '''
+family_graph = FamilyGraph()
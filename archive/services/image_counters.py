@@ -0,0 +1,70 @@
+"""
+Stored related-object counters on Image and Category.
+
+Image.people_count, tag_count, group_count, comment_count (published
+comments) and attachment_count, and Category.image_count replace the
+Count(..., distinct=True) annotations of ImageQuerySet.with_counts(), whose
+joins multiplied with every tag and person on an image.
+
+Counters are recomputed rather than incremented: refresh_images() sets them
+from correlated COUNT subqueries in a single UPDATE, so a repeated or
+out-of-order signal can never make them drift. The handlers in
+archive/signals.py call it for every change; `manage.py reconcile_counters`
+repairs counters after changes that bypass signals.
+"""
+
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from archive.models import Image, Category, Comment
+
+''' Counter field → (model holding the rows, field pointing at the image, extra filter) '''
+IMAGE_COUNTERS = {
+  'people_count': (Image.people.through, 'image', {}),
+  'tag_count': (Image.tag.through, 'image', {}),
+  'group_count': (Image.in_group.through, 'image', {}),
+  'comment_count': (Comment, 'image', {'status': 'p'}),
+  'attachment_count': (Image.attachments.through, 'image', {}),
+}
+
+
+def _count_subquery(model, field, filters, outer='pk'):
+  rows = model.objects.filter(**{field: OuterRef(outer)}, **filters).order_by().values(field)
+  return Coalesce(
+    Subquery(rows.annotate(total=Count('*')).values('total')[:1], output_field=IntegerField()),
+    Value(0),
+  )
+
+
+def expected_image_counts():
+  """ Image queryset annotated with expected_<counter> for every counter """
+  return Image.objects.annotate(**{
+    f"expected_{ name }": _count_subquery(*spec) for name, spec in IMAGE_COUNTERS.items()
+  })
+
+
+def expected_category_counts():
+  """ Category queryset annotated with expected_image_count """
+  return Category.objects.annotate(expected_image_count=_count_subquery(Image, 'category', {}))
+
+
+def refresh_images(image_ids, counters=None):
+  """ Recompute the counters (all by default) of these images """
+  image_ids = [id for id in set(image_ids) if id is not None]
+  if not image_ids:
+    return 0
+  counters = counters or list(IMAGE_COUNTERS)
+  return Image.objects.filter(pk__in=image_ids).update(**{
+    name: _count_subquery(*IMAGE_COUNTERS[name]) for name in counters
+  })
+
+
+def refresh_categories(category_ids=None):
+  """ Recompute Category.image_count; all categories when no ids are given """
+  queryset = Category.objects.all()
+  if category_ids is not None:
+    category_ids = [id for id in set(category_ids) if id is not None]
+    if not category_ids:
+      return 0
+    queryset = queryset.filter(pk__in=category_ids)
+  return queryset.update(image_count=_count_subquery(Image, 'category', {}))
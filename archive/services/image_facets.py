@@ -0,0 +1,98 @@
+"""
+Faceted browsing of the image archive.
+
+For the images matching the current filters, counts per category, tag,
+decade, family collection and uploader, each computed by one grouped query.
+Results are cached per combination of filters; a version counter in every
+key, kept in the database (archive/services/cache_version.py), is bumped by
+the Image, Category, Tag and Person handlers in archive/signals.py, so a
+change anywhere recomputes facets on next use, in every worker process.
+
+Bulk operations that bypass signals should call invalidate() afterwards.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from archive.models import Image
+from archive.services.cache_version import get_version, bump_version
+
+VERSION_NAME = 'image_facets'
+CACHE_TIMEOUT = 60 * 60 * 24
+FACETS = ['category', 'tag', 'decade', 'family', 'user']
+
+
+def version():
+  return get_version(VERSION_NAME)
+
+
+def invalidate():
+  """ Orphan every cached facet; they are recomputed on the next request """
+  bump_version(VERSION_NAME)
+
+
+def get_cache_key(filters):
+  """ filters: anything JSON serialisable that determines the queryset """
+  digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+  return f"image_facets:{ version() }:{ digest }"
+
+
+''' Facet queries
+    Each takes the matching images (without joins or ordering) and returns
+    a list of {'value', 'label', 'count'}, most frequent first unless the
+    facet has a natural order.
+'''
+def category_facet(images):
+  rows = images.exclude(category=None).values('category__slug', 'category__name').annotate(count=Count('pk')).order_by('-count', 'category__name')
+  return [{'value': row['category__slug'], 'label': row['category__name'], 'count': row['count']} for row in rows]
+
+
+def tag_facet(images):
+  rows = images.filter(tag__isnull=False).values('tag__slug', 'tag__name').annotate(count=Count('pk')).order_by('-count', 'tag__name')
+  return [{'value': row['tag__slug'], 'label': row['tag__name'], 'count': row['count']} for row in rows]
+
+
+def decade_facet(images):
+  rows = images.filter(decade__isnull=False).values('decade').annotate(count=Count('pk')).order_by('decade')
+  return [{'value': row['decade'], 'label': f"{ row['decade'] }s", 'count': row['count']} for row in rows]
+
+
+def family_facet(images):
+  """ Images in the family collection of every family in settings.FAMILIES """
+  families = getattr(settings, 'FAMILIES', [])
+  rows = images.filter(family_collections__family__in=families).values('family_collections__family').annotate(count=Count('pk'))
+  counts = {row['family_collections__family']: row['count'] for row in rows}
+  return [{'value': name, 'label': name, 'count': counts.get(name, 0)} for name in families]
+
+
+def user_facet(images):
+  rows = images.values('user__username').annotate(count=Count('pk')).order_by('-count', 'user__username')
+  return [{'value': row['user__username'], 'label': row['user__username'], 'count': row['count']} for row in rows if row['user__username']]
+
+
+FACET_QUERIES = {
+  'category': category_facet,
+  'tag': tag_facet,
+  'decade': decade_facet,
+  'family': family_facet,
+  'user': user_facet,
+}
+
+
+def compute_facets(queryset, facets=None):
+  images = Image.objects.filter(pk__in=queryset.order_by().values('pk')).order_by()
+  return {name: FACET_QUERIES[name](images) for name in (facets or FACETS)}
+
+
+def get_facets(queryset, filters, facets=None):
+  """ Facets of queryset, cached under the filters that produced it """
+  key = get_cache_key({'filters': filters, 'facets': facets or FACETS})
+  result = cache.get(key)
+  if result is None:
+    result = compute_facets(queryset, facets)
+    cache.set(key, result, timeout=CACHE_TIMEOUT)
+  return result
@@ -0,0 +1,54 @@
+"""
+File metadata of images.
+
+imaging.read_metadata() reads the upright dimensions, byte size and EXIF
+details (date taken, orientation, camera, GPS position) from the file
+header without decoding the image; this module stores them on Image. The
+upload view reads them once when a file is stored; images stored before
+are filled by `manage.py read_image_metadata`. Image.metadata_read is set
+once they are read.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+
+from archive.services import imaging
+
+FIELDS = ['width', 'height', 'size', 'orientation', 'date_taken', 'camera', 'latitude', 'longitude', 'metadata_read']
+
+
+def get_fields(metadata):
+  """ Image field values of an imaging.read_metadata() result """
+  date_taken = metadata['date_taken']
+  if date_taken is not None and settings.USE_TZ:
+    ''' EXIF holds the local time of the camera, without time zone '''
+    date_taken = timezone.make_aware(date_taken)
+  fields = {field: metadata[field] for field in FIELDS if field in metadata}
+  fields.update({'date_taken': date_taken, 'metadata_read': timezone.now()})
+  return fields
+
+
+def read(image):
+  """ Read the metadata of the file of image into its fields, without saving; False when the file can not be read """
+  try:
+    metadata = imaging.read_metadata(image.source.path)
+  except Exception:
+    return False
+  for field, value in get_fields(metadata).items():
+    setattr(image, field, value)
+  return True
+
+
+def get_date(date_taken):
+  """ (year, month, day) of a date taken """
+  if timezone.is_aware(date_taken):
+    date_taken = timezone.localtime(date_taken)
+  return date_taken.year, date_taken.month, date_taken.day
+
+
+def fill_date(image):
+  """ Date image by its date taken when year, month and day are all empty; True when set """
+  if image.date_taken is None or image.year or image.month or image.day:
+    return False
+  image.year, image.month, image.day = get_date(image.date_taken)
+  return True
@@ -0,0 +1,649 @@
+"""
+Pillow rendering of image derivatives.
+
+Pure functions on file paths: nothing here imports Django models or reads
+settings, so they can run in worker processes of the media job pool
+(archive/services/derivatives.py) without setting up Django.
+"""
+
+import base64
+import io
+import math
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image as PIL
+from PIL.ExifTags import GPS, IFD, Base
+
+MAX_IMAGE_PIXELS = 933120000
+THUMBNAIL_SIZE = (300, 500)
+HASH_SIZE = 8
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+SAVE_OPTIONS = {
+  'webp': {'method': 4},
+  'jpeg': {'optimize': True, 'progressive': True},
+}
+
+
+def derivative_name(image_id, width, format):
+  """ Path of a derivative relative to MEDIA_ROOT """
+  return Path('derivatives').joinpath(str(image_id), f"{ width }.{ EXTENSIONS[format] }")
+
+
+def avatar_name(person_id, key, size, format):
+  """ Path of an avatar relative to MEDIA_ROOT; key is part of the name, so a new render gets a new URL """
+  return Path('avatars').joinpath(str(person_id), f"{ key }-{ size }.{ EXTENSIONS[format] }")
+
+
+def save_atomic(image, target, **options):
+  """ Save to a temporary file next to target and move it into place """
+  target = Path(target)
+  target.parent.mkdir(parents=True, exist_ok=True)
+  handle, temporary = tempfile.mkstemp(dir=target.parent, prefix='.', suffix=target.suffix)
+  try:
+    with os.fdopen(handle, 'wb') as file:
+      image.save(file, **options)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, target)
+  except BaseException:
+    os.unlink(temporary)
+    raise
+
+
+def flatten(image):
+  """ RGB copy of image, transparent areas on white, for formats without alpha """
+  if image.mode == 'RGB':
+    return image
+  if image.mode == 'RGBA':
+    background = PIL.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+  return image.convert('RGB')
+
+
+''' Decoding
+    A scan is decoded at no more than REDUCING_GAP times the largest output
+    width, then resampled once with LANCZOS:
+    - JPEG is decoded at 1/2, 1/4 or 1/8 scale by libjpeg (draft())
+    - non-interlaced PNG and uncompressed (strip) TIFF are decoded in strips
+      of STRIP_BYTES, each reduced before the next is read, so a 933
+      megapixel scan never needs to be in memory at full size
+    - anything else is decoded fully and reduced with reduce()
+    reduce() averages whole blocks of pixels, so reducing strip by strip
+    gives the same result as reducing the complete image.
+'''
+ORIENTATION = 0x0112
+TRANSPOSE = {
+  2: PIL.Transpose.FLIP_LEFT_RIGHT,
+  3: PIL.Transpose.ROTATE_180,
+  4: PIL.Transpose.FLIP_TOP_BOTTOM,
+  5: PIL.Transpose.TRANSPOSE,
+  6: PIL.Transpose.ROTATE_270,
+  7: PIL.Transpose.TRANSVERSE,
+  8: PIL.Transpose.ROTATE_90,
+}
+UPRIGHT_FORMATS = {'TIFF'}  # Pillow reports the upright size of these and transposes them in load()
+REDUCING_GAP = 2.0
+STRIP_BYTES = 16 * 1024 * 1024
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def reduction_factor(width, target):
+  """ Largest integer factor that keeps width at least REDUCING_GAP times target """
+  return max(1, int(width / (target * REDUCING_GAP))) if target else 1
+
+
+def reducible(image, palette=None, transparency=None):
+  """ image in a mode reduce() and resize() support: palette and bit images become RGB(A) or L.
+      palette is (data, rawmode) for strips decoded without one.
+  """
+  if image.mode == 'P':
+    if palette is not None:
+      image.putpalette(*palette)
+    if transparency is not None:
+      image.info['transparency'] = transparency
+    transparent = 'transparency' in image.info or (image.palette is not None and image.palette.mode == 'RGBA')
+    return image.convert('RGBA' if transparent else 'RGB')
+  if image.mode == '1':
+    return image.convert('L')
+  if image.mode.startswith('I;16'):
+    return image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+  return image
+
+
+def open_scaled(source, width=None):
+  """ Decoded image, rotated by its EXIF orientation, in RGB or RGBA.
+      With width, images wider than REDUCING_GAP * width are decoded at
+      reduced size (see Decoding above); the result is still at least that
+      wide, for a final resample to width.
+  """
+  PIL.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+  with PIL.open(source) as image:
+    orientation = get_orientation(image)
+    upright = image.format in UPRIGHT_FORMATS
+    rotated = orientation in (5, 6, 7, 8) and not upright
+    upright_width = image.height if rotated else image.width
+    factor = reduction_factor(upright_width, width)
+    if factor > 1 and image.format == 'JPEG':
+      image.draft(None, (image.width // factor, image.height // factor))
+      image = reducible(image)
+      factor = reduction_factor(image.height if rotated else image.width, width)
+    elif factor > 1 and (orientation == 1 or not upright) and strip_reader(image):
+      image = read_strips(image, factor)
+      factor = 1
+    else:
+      image = reducible(image)
+    if factor > 1:
+      image = image.reduce(factor)
+    image.load()
+  if orientation in TRANSPOSE and not upright:
+    image = image.transpose(TRANSPOSE[orientation])
+  if image.mode not in ('RGB', 'RGBA'):
+    transparent = 'A' in image.getbands() or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+  return image
+
+
+def get_exif(image):
+  """ EXIF of an image that is not loaded yet, without loading it """
+  if image.format == 'PNG' and 'exif' not in image.info:
+    ''' Pillow decodes a PNG to look for an eXIf chunk after the image data; skip over the data instead '''
+    for type, data in png_chunks(image.fp, skip=b'IDAT'):
+      if type == b'eXIf':
+        image.info['exif'] = b'Exif\x00\x00' + data
+        break
+    else:
+      return PIL.Exif()
+  return image.getexif()
+
+
+def get_orientation(image):
+  """ EXIF orientation of an image that is not loaded yet """
+  orientation = get_exif(image).get(ORIENTATION, 1)
+  return orientation if orientation in range(1, 9) else 1
+
+
+def packable(image, rawmode):
+  """ Whether decoded rows of image can be written back in rawmode """
+  try:
+    PIL.new(image.mode, (1, 1)).tobytes('raw', rawmode)
+  except (ValueError, OSError):
+    return False
+  return True
+
+
+def strip_reader(image):
+  """ Generator function reading image in strips, or None when its format can not be read that way """
+  tiles = image.tile
+  if image.format == 'PNG' and len(tiles) == 1 and tiles[0][0] == 'zip' and not image.info.get('interlace'):
+    rawmode = tiles[0][3] if isinstance(tiles[0][3], str) else tiles[0][3][0]
+    return png_strips if packable(image, rawmode) else None
+  for decoder, extents, offset, args in tiles:
+    args = (args, ) if isinstance(args, str) else tuple(args)
+    if decoder != 'raw' or extents[0] != 0 or extents[2] != image.width or (len(args) > 2 and args[2] != 1):
+      return None
+  return raw_strips if tiles and packable(image, raw_arguments(image)[0]) else None
+
+
+def decoded_strips(image, rows):
+  """ Yields (top, strip, skip) of image read by strip_reader(), in a mode reduce() and resize() support """
+  palette = (image.palette.palette, image.palette.rawmode or image.palette.mode) if image.mode == 'P' and image.palette else None
+  transparency = image.info.get('transparency')
+  for top, strip, skip in strip_reader(image)(image, rows):
+    yield top, reducible(strip, palette, transparency), skip
+
+
+def strip_rows(image, factor=1):
+  """ Rows per strip of about STRIP_BYTES, a multiple of factor """
+  return max(factor, STRIP_BYTES // max(1, image.width * len(image.getbands())) // factor * factor)
+
+
+def read_strips(image, factor):
+  """ image reduced by factor, decoded strip by strip """
+  result = None
+  for top, strip, skip in decoded_strips(image, strip_rows(image, factor)):
+    strip = strip.reduce(factor, box=(0, skip, strip.width, strip.height))
+    if result is None:
+      result = PIL.new(strip.mode, (-(-image.width // factor), -(-image.height // factor)))
+    result.paste(strip, (0, top // factor))
+  return result
+
+
+def raw_arguments(image):
+  """ rawmode and row stride of uncompressed image data """
+  args = image.tile[0][3]
+  args = (args, ) if isinstance(args, str) else tuple(args)
+  rawmode = args[0]
+  stride = args[1] if len(args) > 1 and args[1] else len(PIL.new(image.mode, (image.width, 1)).tobytes('raw', rawmode))
+  return rawmode, stride
+
+
+def raw_strips(image, rows):
+  """ Yields (top, strip, 0) of uncompressed images, reading rows straight from their file offsets """
+  rawmode, stride = raw_arguments(image)
+  tiles = sorted(image.tile, key=lambda tile: tile[1][1])
+  for top in range(0, image.height, rows):
+    bottom = min(top + rows, image.height)
+    data = bytearray()
+    for decoder, (x0, y0, x1, y1), offset, args in tiles:
+      first, last = max(top, y0), min(bottom, y1)
+      if first < last:
+        image.fp.seek(offset + (first - y0) * stride)
+        data += image.fp.read((last - first) * stride)
+    yield top, PIL.frombytes(image.mode, (image.width, bottom - top), data, 'raw', rawmode, stride, 1), 0
+
+
+def png_chunks(file, skip=None):
+  """ Yields (type, data) of the chunks of a PNG file; data is None for chunks of type skip """
+  file.seek(8)
+  while True:
+    header = file.read(8)
+    if len(header) < 8:
+      return
+    length, type = struct.unpack('>I4s', header)
+    if type == skip:
+      file.seek(length + 4, os.SEEK_CUR)
+      data = None
+    else:
+      data = file.read(length)
+      file.read(4)
+    yield type, data
+    if type == b'IEND':
+      return
+
+
+def png_strips(image, rows):
+  """ Yields (top, strip, skip) of a non-interlaced PNG.
+      The compressed image data is inflated incrementally. Each strip of
+      filtered rows is decoded by Pillow with the last decoded row of the
+      previous strip in front of it (filter type None), which is all the
+      PNG filters of its first row refer to; skip is 1 when that row is
+      there.
+  """
+  rawmode = image.tile[0][3] if isinstance(image.tile[0][3], str) else image.tile[0][3][0]
+  width = image.width
+  row_bytes = None
+  strip_bytes = 0
+  inflate = zlib.decompressobj()
+  buffer = bytearray()
+  previous = None
+  top = 0
+
+  def decode(count):
+    nonlocal previous, top
+    skip = 0 if previous is None else 1
+    deflate = zlib.compressobj(0)
+    data = deflate.compress(b'\0' + previous) if skip else b''
+    with memoryview(buffer) as rows:
+      data += deflate.compress(rows[:count * (row_bytes + 1)]) + deflate.flush()
+    del buffer[:count * (row_bytes + 1)]
+    strip = PIL.frombytes(image.mode, (width, count + skip), data, 'zip', rawmode)
+    del data
+    previous = strip.crop((0, strip.height - 1, width, strip.height)).tobytes('raw', rawmode)
+    result = top, strip, skip
+    top += count
+    return result
+
+  for type, data in png_chunks(image.fp):
+    if type == b'IHDR':
+      bit_depth, color_type = struct.unpack('>IIBB', data[:10])[2:]
+      row_bytes = (width * PNG_CHANNELS[color_type] * bit_depth + 7) // 8
+      strip_bytes = rows * (row_bytes + 1)
+    elif type == b'IDAT':
+      while data:
+        buffer += inflate.decompress(data, strip_bytes)
+        data = inflate.unconsumed_tail
+        while len(buffer) >= strip_bytes and top + rows <= image.height:
+          yield decode(rows)
+  buffer += inflate.flush()
+  if top < image.height:
+    yield decode(image.height - top)
+
+''' Metadata
+    Read from the file header only: PIL.open() does not decode pixels and
+    getexif() parses the EXIF block (for PNG get_exif() skips the image
+    data), so reading the metadata of a scan costs a few kilobytes of IO.
+'''
+def read_metadata(source):
+  """ Upright dimensions, byte size and EXIF details of an image file, without decoding it """
+  PIL.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+  with PIL.open(source) as image:
+    exif = get_exif(image)
+    width, height = image.size
+    upright = image.format in UPRIGHT_FORMATS
+    details = exif.get_ifd(IFD.Exif)
+    gps = exif.get_ifd(IFD.GPSInfo)
+  orientation = exif.get(ORIENTATION, 1)
+  if orientation not in range(1, 9):
+    orientation = 1
+  if orientation in (5, 6, 7, 8) and not upright:
+    width, height = height, width
+  return {
+    'width': width,
+    'height': height,
+    'size': os.path.getsize(source),
+    'orientation': orientation,
+    'date_taken': exif_datetime(details.get(Base.DateTimeOriginal) or exif.get(Base.DateTime)),
+    'camera': camera(exif.get(Base.Make), exif.get(Base.Model)),
+    'latitude': gps_coordinate(gps.get(GPS.GPSLatitude), gps.get(GPS.GPSLatitudeRef)),
+    'longitude': gps_coordinate(gps.get(GPS.GPSLongitude), gps.get(GPS.GPSLongitudeRef)),
+  }
+
+
+def exif_text(value):
+  if isinstance(value, bytes):
+    value = value.decode('utf-8', 'replace')
+  return str(value).strip('\x00 ') if value is not None else ''
+
+
+def exif_datetime(value):
+  """ datetime of an EXIF 'YYYY:MM:DD HH:MM:SS' value, or None """
+  try:
+    return datetime.strptime(exif_text(value)[:19], '%Y:%m:%d %H:%M:%S')
+  except ValueError:
+    return None
+
+
+def camera(make, model):
+  """ 'Make Model', without repeating the make when the model includes it """
+  make, model = exif_text(make), exif_text(model)
+  if make and model.lower().startswith(make.split(' ')[0].lower()):
+    return model[:255]
+  return f"{ make } { model }".strip()[:255]
+
+
+def gps_coordinate(value, reference):
+  """ Decimal degrees of an EXIF (degrees, minutes, seconds) coordinate, or None """
+  try:
+    degrees, minutes, seconds = (float(part) for part in value)
+  except (TypeError, ValueError, ZeroDivisionError):
+    return None
+  coordinate = degrees + minutes / 60 + seconds / 3600
+  if not math.isfinite(coordinate) or coordinate > 180:
+    return None
+  return -coordinate if exif_text(reference).upper() in ('S', 'W') else coordinate
+
+
+def render_derivatives(image_id, source, media_root, widths, formats, quality, thumbnail=None):
+  """ Write the derivatives of one image and return what was written.
+      Widths wider than the image are replaced by the image width. Each width
+      is resized from the next larger one, so the full image is resampled
+      only once; the thumbnail from the smallest derivative that is large
+      enough. thumbnail is the legacy thumbnail path (relative to
+      media_root), or None to skip it.
+      Returns {'widths': [...], 'thumbnail': path or None, 'dhash': int,
+      'placeholder': data URI or None, 'color': '#rrggbb'}.
+  """
+  media_root = Path(media_root)
+  image = open_scaled(source, max(widths))
+  targets = sorted({min(int(width), image.width) for width in widths}, reverse=True)
+  current = base = image
+  for width in targets:
+    height = max(1, round(current.height * width / current.width))
+    if width != current.width:
+      current = current.resize((width, height), PIL.Resampling.LANCZOS)
+    if current.width >= THUMBNAIL_SIZE[0]:
+      base = current
+    for format in formats:
+      output = flatten(current) if format == 'jpeg' else current
+      save_atomic(output, media_root.joinpath(derivative_name(image_id, width, format)),
+                  format=format.upper(), quality=quality, **SAVE_OPTIONS.get(format, {}))
+  if thumbnail:
+    save_thumbnail(base.copy(), media_root.joinpath(thumbnail))
+  remove_stale(media_root.joinpath('derivatives', str(image_id)), targets, formats)
+  return {
+    'widths': sorted(targets), 'thumbnail': str(thumbnail) if thumbnail else None,
+    'dhash': dhash(base), 'placeholder': placeholder(base), 'color': dominant_color(base),
+  }
+
+
+def save_thumbnail(image, target):
+  """ Shrink image to fit THUMBNAIL_SIZE and save it in the format of the target suffix """
+  image.thumbnail(THUMBNAIL_SIZE, PIL.Resampling.LANCZOS)
+  format = PIL.registered_extensions().get(Path(target).suffix.lower(), 'JPEG')
+  save_atomic(flatten(image) if format == 'JPEG' else image, target, format=format)
+
+
+def render_thumbnail(source, target):
+  """ Write the thumbnail of source to target, decoding no more than it needs """
+  save_thumbnail(open_scaled(source, THUMBNAIL_SIZE[0]), target)
+
+
+def square_box(box, width, height, scale=1):
+  """ Largest square centred in box (x, y, w, h in pixels of the upright
+      original), scaled by scale and moved inside an image of width and
+      height; the centre square of the image without box.
+  """
+  if box is None:
+    side = min(width, height)
+    return ((width - side) // 2, (height - side) // 2, (width - side) // 2 + side, (height - side) // 2 + side)
+  x, y, w, h = (value * scale for value in box)
+  side = max(1, min(round(min(w, h)), width, height))
+  left = min(max(0, round(x + (w - side) / 2)), width - side)
+  top = min(max(0, round(y + (h - side) / 2)), height - side)
+  return (left, top, left + side, top + side)
+
+
+def render_avatars(source, media_root, crops, dimensions, sizes, formats, quality):
+  """ Write square avatars of everyone with this image as portrait.
+      crops is {person_id: (key, box)}, box the crop (x, y, w, h) in pixels
+      of the upright original or None for the centre of the image;
+      dimensions the stored upright (width, height) of the original, or
+      None. The image is decoded at the reduced size that still covers the
+      smallest crop at the largest size. Earlier renders are removed.
+      Returns {person_id: key}.
+  """
+  media_root = Path(media_root)
+  width = None
+  if dimensions and all(dimensions):
+    sides = [min(box[2], box[3]) if box else min(dimensions) for key, box in crops.values()]
+    width = math.ceil(dimensions[0] * max(sizes) / max(1, min(sides)))
+  image = open_scaled(source, width)
+  scale = image.width / dimensions[0] if dimensions and all(dimensions) else 1
+  for person_id, (key, box) in crops.items():
+    current = image.crop(square_box(box, image.width, image.height, scale))
+    names = set()
+    for size in sorted(sizes, reverse=True):
+      if current.width != size:
+        current = current.resize((size, size), PIL.Resampling.LANCZOS)
+      for format in formats:
+        name = avatar_name(person_id, key, size, format)
+        output = flatten(current) if format == 'jpeg' else current
+        save_atomic(output, media_root.joinpath(name), format=format.upper(), quality=quality, **SAVE_OPTIONS.get(format, {}))
+        names.add(name.name)
+    for path in media_root.joinpath('avatars', str(person_id)).glob('*'):
+      if path.name not in names and not path.name.startswith('.'):
+        path.unlink()
+  return {person_id: key for person_id, (key, box) in crops.items()}
+
+
+def placeholder(image):
+  """ Blurry stand-in shown while the image loads: a WebP of at most
+      PLACEHOLDER_SIZE pixels as data URI, about 200 bytes. None for images
+      with transparent areas, which the placeholder would show through.
+  """
+  if image.mode == 'RGBA' and image.getchannel('A').getextrema()[0] < 255:
+    return None
+  tiny = flatten(image).copy()
+  tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), PIL.Resampling.LANCZOS)
+  buffer = io.BytesIO()
+  tiny.save(buffer, format='WEBP', quality=PLACEHOLDER_QUALITY)
+  return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def dominant_color(image):
+  """ Most common of 8 colours (median cut) of a small version of image, as #rrggbb """
+  small = flatten(image).copy()
+  small.thumbnail((64, 64), PIL.Resampling.BOX)
+  palette = small.quantize(colors=8)
+  count, index = max(palette.getcolors())
+  red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+  return f"#{ red:02x}{ green:02x}{ blue:02x}"
+
+
+def dhash(image):
+  """ 64 bit difference hash: for each row of a 9x8 greyscale version of
+      image, one bit per pair of neighbouring pixels, set when the left one
+      is brighter. Rescans, recompressions and resizes of the same photo
+      differ in a few bits; compare with the Hamming distance.
+  """
+  pixels = list(flatten(image).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PIL.Resampling.LANCZOS).getdata())
+  value = 0
+  for row in range(HASH_SIZE):
+    for column in range(HASH_SIZE):
+      left = pixels[row * (HASH_SIZE + 1) + column]
+      value = value << 1 | (left > pixels[row * (HASH_SIZE + 1) + column + 1])
+  return value
+
+
+def file_dhash(source):
+  """ dhash() of an image file, decoded at thumbnail size """
+  return dhash(open_scaled(source, THUMBNAIL_SIZE[0]))
+
+
+def remove_stale(directory, widths, formats):
+  """ Remove derivatives of earlier renders that are not in widths/formats """
+  keep = {f"{ width }.{ EXTENSIONS[format] }" for width in widths for format in formats}
+  for path in Path(directory).glob('*'):
+    if path.name not in keep and not path.name.startswith('.'):
+      path.unlink()
+
+
+''' Deep zoom
+    Tile pyramid in the Deep Zoom (DZI) layout: level 0 is one pixel, every
+    next level twice as large, the last one the upright image at full size;
+    each level is cut in tiles of TILE_SIZE pixels plus TILE_OVERLAP pixels
+    of their neighbours. Rows of a level are pushed in from top to bottom
+    (PyramidLevel); a row of tiles is written as soon as it is complete and
+    its rows go on to the next smaller level at half size, so only a few
+    rows of tiles of each level are in memory at any time.
+'''
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+
+
+def tiles_name(image_id, key):
+  """ Path of a tile pyramid without suffix, relative to MEDIA_ROOT: <name>.dzi and <name>_files/ """
+  return Path('tiles').joinpath(str(image_id), key)
+
+
+def stack(top, bottom):
+  """ Image of the rows of top followed by those of bottom; top may be None """
+  if top is None or top.height == 0:
+    return bottom
+  result = PIL.new(bottom.mode, (bottom.width, top.height + bottom.height))
+  result.paste(top, (0, 0))
+  result.paste(bottom, (0, top.height))
+  return result
+
+
+class PyramidLevel:
+  """ One level of a tile pyramid, filled by push() from top to bottom """
+  def __init__(self, directory, level, width, height, quality):
+    self.directory = Path(directory).joinpath(str(level))
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self.width, self.height, self.quality = width, height, quality
+    self.buffer, self.top, self.received, self.row = None, 0, 0, 0
+    self.pending = None
+    self.next = PyramidLevel(directory, level - 1, -(-width // 2), -(-height // 2), quality) if level > 0 else None
+
+  def push(self, strip):
+    self.buffer = stack(self.buffer, strip)
+    self.received += strip.height
+    self.write_tiles()
+    if self.next is not None:
+      ''' Pass rows on in pairs; the last, odd row with the end of the image '''
+      rows = stack(self.pending, strip)
+      count = rows.height if self.received == self.height else rows.height // 2 * 2
+      if count:
+        self.next.push(rows.crop((0, 0, self.width, count)).reduce(2))
+      self.pending = rows.crop((0, count, self.width, rows.height)) if count < rows.height else None
+
+  def write_tiles(self):
+    while self.row * TILE_SIZE < self.height:
+      top = max(0, self.row * TILE_SIZE - TILE_OVERLAP)
+      bottom = min(self.height, (self.row + 1) * TILE_SIZE + TILE_OVERLAP)
+      if self.received < bottom:
+        break
+      band = self.buffer.crop((0, top - self.top, self.width, bottom - self.top))
+      for column in range(-(-self.width // TILE_SIZE)):
+        left = max(0, column * TILE_SIZE - TILE_OVERLAP)
+        right = min(self.width, (column + 1) * TILE_SIZE + TILE_OVERLAP)
+        flatten(band.crop((left, 0, right, band.height))).save(
+          self.directory.joinpath(f"{ column }_{ self.row }.jpg"), format='JPEG', quality=self.quality,
+        )
+      self.row += 1
+    ''' Keep the rows the next row of tiles still needs '''
+    keep = min(self.received, max(0, self.row * TILE_SIZE - TILE_OVERLAP))
+    if keep > self.top:
+      self.buffer = self.buffer.crop((0, keep - self.top, self.width, self.buffer.height))
+      self.top = keep
+
+
+def upright_strips(source):
+  """ Yields the upright image of source in strips of about STRIP_BYTES, as
+      (width, height, strip). Strip-readable images (see Decoding above) are
+      read strip by strip; others are decoded once.
+  """
+  PIL.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+  with PIL.open(source) as image:
+    if get_orientation(image) == 1 and strip_reader(image):
+      for top, strip, skip in decoded_strips(image, strip_rows(image)):
+        if strip.mode not in ('RGB', 'RGBA'):
+          strip = strip.convert('RGBA' if 'A' in strip.getbands() else 'RGB')
+        yield image.width, image.height, strip.crop((0, skip, strip.width, strip.height))
+      return
+  image = open_scaled(source)
+  rows = strip_rows(image)
+  for top in range(0, image.height, rows):
+    yield image.width, image.height, image.crop((0, top, image.width, min(image.height, top + rows)))
+
+
+def render_tiles(source, media_root, image_id, key, quality):
+  """ Write the tile pyramid of source to media_root/tiles_name(), with its
+      DZI descriptor, and remove earlier pyramids of the image. Tiles are
+      written to a temporary directory that is moved into place when
+      complete. Returns {'key': key, 'levels': number of levels}.
+  """
+  name = Path(media_root).joinpath(tiles_name(image_id, key))
+  name.parent.mkdir(parents=True, exist_ok=True)
+  temporary = Path(tempfile.mkdtemp(dir=name.parent, prefix='.'))
+  os.chmod(temporary, 0o755)
+  try:
+    top = None
+    for width, height, strip in upright_strips(source):
+      if top is None:
+        levels = math.ceil(math.log2(max(width, height, 1))) + 1
+        top = PyramidLevel(temporary, levels - 1, width, height, quality)
+      top.push(strip)
+    files = name.parent.joinpath(f"{ name.name }_files")
+    shutil.rmtree(files, ignore_errors=True)
+    os.replace(temporary, files)
+  except BaseException:
+    shutil.rmtree(temporary, ignore_errors=True)
+    raise
+  descriptor = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="{ TILE_OVERLAP }" TileSize="{ TILE_SIZE }">'
+    f'<Size Width="{ width }" Height="{ height }"/></Image>\n'
+  )
+  handle, path = tempfile.mkstemp(dir=name.parent, prefix='.', suffix='.dzi')
+  with os.fdopen(handle, 'w') as file:
+    file.write(descriptor)
+  os.chmod(path, 0o644)
+  os.replace(path, name.parent.joinpath(f"{ name.name }.dzi"))
+  for path in name.parent.iterdir():
+    if path.name in (f"{ name.name }.dzi", f"{ name.name }_files") or path.name.startswith('.'):
+      continue
+    if path.is_dir():
+      shutil.rmtree(path)
+    else:
+      path.unlink()
+  return {'key': key, 'levels': levels}
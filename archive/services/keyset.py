@@ -0,0 +1,130 @@
+"""
+Keyset (seek) pagination.
+
+Instead of OFFSET, a page continues from the sort key of the last row of the
+previous page: `WHERE (date_created, id) < (%s, %s) ORDER BY date_created
+DESC, id DESC LIMIT n`. With an index on the sort columns every page costs
+the same, however deep. Pages are addressed by opaque, signed cursor tokens
+rather than page numbers.
+
+Totals are not needed to paginate; cached_count() caches them per query
+for settings.PAGINATION_COUNT_TIMEOUT seconds, so they may briefly lag.
+"""
+
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q
+
+SALT = 'archive.keyset'
+
+
+class KeysetPage:
+  """ A page of results; stands in for Django's Page in templates """
+  keyset = True
+
+  def __init__(self, object_list, has_next, has_previous, next_cursor=None, previous_cursor=None):
+    self.object_list = object_list
+    self._has_next = has_next
+    self._has_previous = has_previous
+    self.next_cursor = next_cursor
+    self.previous_cursor = previous_cursor
+    self.count = None
+
+  def has_next(self):
+    return self._has_next
+
+  def has_previous(self):
+    return self._has_previous
+
+  def has_other_pages(self):
+    return self._has_next or self._has_previous
+
+  def __iter__(self):
+    return iter(self.object_list)
+
+  def __len__(self):
+    return len(self.object_list)
+
+  def __repr__(self):
+    return f"<KeysetPage of { len(self.object_list) } objects>"
+
+
+def encode_cursor(values, direction):
+  values = [value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value for value in values]
+  return signing.dumps({'v': values, 'd': direction}, salt=SALT, compress=True)
+
+
+def decode_cursor(token):
+  """ (values, direction) of a cursor token, or None when it is missing or invalid """
+  if not token:
+    return None
+  try:
+    data = signing.loads(token, salt=SALT)
+    return data['v'], data['d']
+  except (signing.BadSignature, KeyError, TypeError):
+    return None
+
+
+def reverse_ordering(ordering):
+  return [field[1:] if field.startswith('-') else f"-{ field }" for field in ordering]
+
+
+def seek_filter(ordering, values):
+  """ Q selecting the rows that sort after values in this ordering """
+  condition = Q()
+  for index, field in enumerate(ordering):
+    name = field.lstrip('-')
+    step = Q(**{f"{ name }__{ 'lt' if field.startswith('-') else 'gt' }": values[index]})
+    for previous, value in zip(ordering[:index], values):
+      step &= Q(**{previous.lstrip('-'): value})
+    condition |= step
+  return condition
+
+
+def row_values(obj, ordering):
+  return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+def paginate(queryset, ordering, per_page, cursor=None):
+  """ Return the KeysetPage of queryset at cursor (None for the first page) """
+  ordering = list(ordering)
+  position = decode_cursor(cursor)
+  backwards = position is not None and position[1] == 'previous'
+  order = reverse_ordering(ordering) if backwards else ordering
+  queryset = queryset.order_by(*order)
+  if position is not None:
+    queryset = queryset.filter(seek_filter(order, position[0]))
+  rows = list(queryset[:per_page + 1])
+  more = len(rows) > per_page
+  rows = rows[:per_page]
+  if backwards:
+    rows.reverse()
+    has_next, has_previous = True, more
+  else:
+    has_next, has_previous = more, position is not None
+  return KeysetPage(
+    rows,
+    has_next=has_next and bool(rows),
+    has_previous=has_previous and bool(rows),
+    next_cursor=encode_cursor(row_values(rows[-1], ordering), 'next') if has_next and rows else None,
+    previous_cursor=encode_cursor(row_values(rows[0], ordering), 'previous') if has_previous and rows else None,
+  )
+
+
+def cached_count(queryset, timeout=None):
+  """ COUNT(*) of queryset, cached per SQL statement """
+  try:
+    sql = str(queryset.order_by().query)
+  except EmptyResultSet:
+    return 0
+  key = f"keyset_count:{ hashlib.sha1(sql.encode()).hexdigest() }"
+  count = cache.get(key)
+  if count is None:
+    count = queryset.count()
+    cache.set(key, count, timeout=timeout if timeout is not None else getattr(settings, 'PAGINATION_COUNT_TIMEOUT', 300))
+  return count
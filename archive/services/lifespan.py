@@ -0,0 +1,89 @@
+"""
+Stored birth and death dates on Person.
+
+Person.birth_year/month/day and death_year/month/day are copies of the
+person's birth and death Events, so lists can filter and sort on indexed
+columns instead of running correlated subqueries per row. They are kept in
+sync by the Event and Event.people handlers in archive/signals.py; bulk
+changes that bypass signals can be repaired with `manage.py sync_lifespans`.
+
+When a person has more than one birth (or death) event, the earliest dated
+one is used; events without a year only count when there is no other.
+
+The decades a person was alive in are stored as PersonDecade rows, rebuilt
+here whenever the stored years of a person change.
+"""
+
+from archive.models import Person, PersonDecade, Event
+from archive.models.person import decades_alive
+
+FIELDS = ['birth_year', 'birth_month', 'birth_day', 'death_year', 'death_month', 'death_day']
+EMPTY = (None, None, None)
+
+
+def _date_key(date):
+  year, month, day = date
+  return (year is None, year or 0, month or 0, day or 0)
+
+
+def compute_lifespans(person_ids):
+  """ {person id: (birth_year, birth_month, birth_day, death_year, death_month, death_day)} """
+  dates = {id: {'birth': EMPTY, 'death': EMPTY} for id in person_ids}
+  seen = set()
+  rows = Event.objects.filter(people__in=person_ids, type__in=['birth', 'death']).order_by().values_list(
+    'people', 'type', 'year', 'month', 'day'
+  )
+  for person_id, type, year, month, day in rows:
+    date = (year, month, day)
+    if (person_id, type) not in seen or _date_key(date) < _date_key(dates[person_id][type]):
+      dates[person_id][type] = date
+      seen.add((person_id, type))
+  return {id: value['birth'] + value['death'] for id, value in dates.items()}
+
+
+def stored_lifespan(person):
+  return tuple(getattr(person, field) for field in FIELDS)
+
+
+def sync_lifespans(person_ids, batch_size=500):
+  """ Update the stored dates of these people where they differ from their events.
+      Returns the number of people updated.
+  """
+  person_ids = list(set(id for id in person_ids if id is not None))
+  updated = 0
+  for start in range(0, len(person_ids), batch_size):
+    batch = person_ids[start:start + batch_size]
+    expected = compute_lifespans(batch)
+    changed = []
+    for person in Person.objects.filter(pk__in=batch).only('pk', *FIELDS):
+      if stored_lifespan(person) != expected[person.pk]:
+        for field, value in zip(FIELDS, expected[person.pk]):
+          setattr(person, field, value)
+        changed.append(person)
+    if changed:
+      Person.objects.bulk_update(changed, FIELDS)
+      sync_decades(changed)
+      updated += len(changed)
+  return updated
+
+
+def expected_decades(people):
+  """ {person id: set of decades} from the stored birth and death years """
+  return {person.pk: set(decades_alive(person.birth_year, person.death_year)) for person in people}
+
+
+def stored_decades(person_ids):
+  decades = {id: set() for id in person_ids}
+  for person_id, decade in PersonDecade.objects.filter(person__in=person_ids).values_list('person', 'decade'):
+    decades[person_id].add(decade)
+  return decades
+
+
+def sync_decades(people):
+  """ Replace the PersonDecade rows of these people """
+  expected = expected_decades(people)
+  PersonDecade.objects.filter(person__in=list(expected)).delete()
+  PersonDecade.objects.bulk_create(
+    [PersonDecade(person_id=id, decade=decade) for id, decades in expected.items() for decade in sorted(decades)],
+    batch_size=500,
+  )
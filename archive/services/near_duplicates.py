@@ -0,0 +1,172 @@
+"""
+Near-duplicate index of images.
+
+Every image gets a 64 bit difference hash (imaging.dhash()) when its
+derivatives are rendered; rescans and re-uploads of the same photo have
+hashes that differ in a few bits. Image.dhash stores it as a signed
+BigIntegerField.
+
+Hashes are kept in a multi-index hash table (MultiIndex), so finding all
+hashes within a Hamming distance looks at a few buckets instead of every
+image. The table is built lazily in each process from one Image scan; a
+version counter in the database (archive/services/cache_version.py, as in
+family_graph.py) makes other processes rebuild after invalidate(). Hashes
+are written by the media job worker, so the web processes must see its
+bumps: a counter in a per-process cache would never reach them.
+"""
+
+import threading
+
+from django.conf import settings
+
+from archive.services.cache_version import get_version, bump_version
+
+VERSION_NAME = 'near_duplicates'
+MASK = (1 << 64) - 1
+DEFAULT_DISTANCE = 6
+
+
+def get_distance():
+  """ Largest Hamming distance between hashes of possible duplicates """
+  return getattr(settings, 'NEAR_DUPLICATE_DISTANCE', DEFAULT_DISTANCE)
+
+
+def to_signed(value):
+  """ Unsigned 64 bit hash as stored in a BigIntegerField """
+  return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def distance(a, b):
+  """ Hamming distance of two hashes, signed or unsigned """
+  return ((a ^ b) & MASK).bit_count()
+
+
+class MultiIndex:
+  """ Multi-index hash table for Hamming distance searches up to
+      max_distance. Each hash is split into max_distance + 1 bands and every
+      band is the key of its own table: two hashes within max_distance
+      differ in at most max_distance bands, so they share at least one band
+      exactly. A search only compares the hashes in the buckets of its own
+      bands. Images with the same hash share an entry in hashes.
+  """
+
+  def __init__(self, items=(), max_distance=DEFAULT_DISTANCE):
+    self.max_distance = max_distance
+    count = max_distance + 1
+    ''' 64 bits in count bands of (almost) equal width '''
+    self.bands = [(64 * band // count, 64 * (band + 1) // count) for band in range(count)]
+    self.tables = [{} for band in self.bands]
+    self.hashes = {}
+    for value, id in items:
+      self.add(value, id)
+
+  def keys(self, value):
+    value &= MASK
+    return [value >> start & ((1 << end - start) - 1) for start, end in self.bands]
+
+  def add(self, value, id):
+    value &= MASK
+    if value not in self.hashes:
+      self.hashes[value] = []
+      for table, key in zip(self.tables, self.keys(value)):
+        table.setdefault(key, []).append(value)
+    self.hashes[value].append(id)
+
+  def search(self, value):
+    """ Yield (distance, hash, ids) of every hash within max_distance of value """
+    seen = set()
+    for table, key in zip(self.tables, self.keys(value)):
+      for candidate in table.get(key, ()):
+        if candidate not in seen:
+          seen.add(candidate)
+          d = distance(value, candidate)
+          if d <= self.max_distance:
+            yield d, candidate, self.hashes[candidate]
+
+
+def load_hashes():
+  from archive.models import Image
+  return Image.objects.exclude(dhash=None).exclude(status='x').values_list('dhash', 'id').iterator(chunk_size=5000)
+
+
+class NearDuplicateIndex:
+  """ MultiIndex of all image hashes per search distance, rebuilt when the version changed """
+
+  def __init__(self):
+    self._lock = threading.RLock()
+    self._version = None
+    self._tables = {}
+
+  def _remote_version(self):
+    return get_version(VERSION_NAME)
+
+  def get_table(self, max_distance):
+    version = self._remote_version()
+    table = self._tables.get(max_distance)
+    if table is not None and self._version == version:
+      return table
+    with self._lock:
+      if self._version != version:
+        self._tables = {}
+        self._version = version
+      if max_distance not in self._tables:
+        self._tables[max_distance] = MultiIndex(load_hashes(), max_distance)
+      return self._tables[max_distance]
+
+  def invalidate(self):
+    """ Call after Image.dhash changed; all processes rebuild on their next search """
+    bump_version(VERSION_NAME)
+    self._tables = {}
+
+  def search(self, value, max_distance):
+    """ {image id: distance} of images within max_distance of value """
+    return {id: d for d, _, ids in self.get_table(max_distance).search(value) for id in ids}
+
+
+index = NearDuplicateIndex()
+
+
+def similar_images(image, max_distance=None, limit=12):
+  """ Images that look like image, nearest first, each with a distance attribute """
+  from archive.models import Image
+  if image.dhash is None:
+    return []
+  matches = index.search(image.dhash, get_distance() if max_distance is None else max_distance)
+  matches.pop(image.pk, None)
+  nearest = sorted(matches, key=lambda id: (matches[id], id))[:limit]
+  images = {image.pk: image for image in Image.objects.filter(pk__in=nearest).exclude(status='x')}
+  result = []
+  for id in nearest:
+    if id in images:
+      images[id].distance = matches[id]
+      result.append(images[id])
+  return result
+
+
+def clusters(max_distance=None):
+  """ Groups of image ids whose hashes are linked by distances of at most
+      max_distance, largest group first. One search per distinct hash,
+      joined with a union-find.
+  """
+  table = MultiIndex(load_hashes(), get_distance() if max_distance is None else max_distance)
+  parent = {}
+
+  def find(id):
+    root = id
+    while parent.get(root, root) != root:
+      root = parent[root]
+    while id != root:
+      parent[id], id = root, parent.get(id, id)
+    return root
+
+  for value, ids in table.hashes.items():
+    for _, _, matches in table.search(value):
+      for id in ids + matches:
+        a, b = find(ids[0]), find(id)
+        if a != b:
+          parent[max(a, b)] = min(a, b)
+  groups = {}
+  for ids in table.hashes.values():
+    for id in ids:
+      groups.setdefault(find(id), set()).add(id)
+  return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group[0]))
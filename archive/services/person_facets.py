@@ -0,0 +1,74 @@
+"""
+Cached filter facets for the people list.
+
+The dropdowns on the people page (decades, centuries, families, people with
+a photo) and the number of people shown are computed together in two
+queries and cached per combination of filters. A version counter in the
+database (archive/services/cache_version.py) is part of every key; the
+Person, Event and Image handlers in archive/signals.py bump it, which
+orphans all cached facets at once, in every worker process.
+
+Bulk operations that bypass signals should call invalidate() afterwards.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Q
+
+from archive.models import Person, Image
+from archive.person_utils import get_decade_counts, centuries_of
+from archive.services.cache_version import get_version, bump_version
+
+VERSION_NAME = 'person_facets'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def version():
+  return get_version(VERSION_NAME)
+
+
+def invalidate():
+  """ Orphan every cached facet; they are recomputed on the next request """
+  bump_version(VERSION_NAME)
+
+
+def get_cache_key(filters):
+  """ filters: anything JSON serialisable that determines the queryset """
+  digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+  return f"person_facets:{ version() }:{ digest }"
+
+
+def compute_facets(queryset):
+  people = Person.objects.filter(pk__in=queryset.order_by().values('pk'))
+  families = getattr(settings, 'FAMILIES', [])
+  photos = Image.people.through.objects.filter(person=OuterRef('pk'))
+  totals = people.aggregate(
+    count=Count('pk'),
+    with_photo=Count('pk', filter=Q(Exists(photos))),
+    **{
+      f"family_{ index }": Count('pk', filter=Q(last_name__icontains=name) | Q(married_name__icontains=name))
+      for index, name in enumerate(families)
+    },
+  )
+  decades = get_decade_counts(queryset)
+  return {
+    'count': totals['count'],
+    'with_photo': totals['with_photo'],
+    'families': {name: totals[f"family_{ index }"] for index, name in enumerate(families)},
+    'decades': list(decades),
+    'decade_counts': decades,
+    'centuries': centuries_of(decades),
+  }
+
+
+def get_facets(queryset, filters):
+  """ Facets of queryset, cached under the filters that produced it """
+  key = get_cache_key(filters)
+  facets = cache.get(key)
+  if facets is None:
+    facets = compute_facets(queryset)
+    cache.set(key, facets, timeout=CACHE_TIMEOUT)
+  return facets
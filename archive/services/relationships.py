@@ -0,0 +1,242 @@
+"""
+Relationship calculator: how are two people related?
+
+Runs a bidirectional breadth-first search over the in-process family graph
+(archive/services/family_graph.py) and names the path it finds, for example
+"second cousin once removed" or "brother-in-law".
+
+Blood relations are searched first: both sides only walk up to their parents,
+so the search meets at the nearest common ancestor (or at one of the two, for
+lineal relatives). Only when no common ancestor exists is the search repeated
+over parent, child and partner edges, so an in-law path never hides a blood
+relation. The search is bounded by MAX_STEPS and MAX_VISITED.
+
+Paths are memoised in the Django cache per pair of people. The key contains
+the family graph version, so any FamilyRelations change invalidates all
+memoised paths at once.
+"""
+
+from django.core.cache import cache
+from django.utils.translation import gettext as _
+
+from archive.services.family_graph import family_graph
+
+CACHE_TIMEOUT = 60 * 60 * 24
+MAX_STEPS = 24
+MAX_VISITED = 100000
+
+UP = 'up'
+DOWN = 'down'
+PARTNER = 'partner'
+INVERSE = {UP: DOWN, DOWN: UP, PARTNER: PARTNER}
+
+
+def _ancestor_neighbours(id):
+  return [(parent, UP) for parent in family_graph.parents(id)]
+
+
+def _all_neighbours(id):
+  return _ancestor_neighbours(id) \
+    + [(child, DOWN) for child in family_graph.children(id)] \
+    + [(partner, PARTNER) for partner in family_graph.partners(id)]
+
+
+def find_path(a, b, neighbours=_all_neighbours, max_steps=MAX_STEPS, max_visited=MAX_VISITED):
+  """ Shortest path from a to b as (person ids, steps), or None.
+      steps[i] is the step from path[i] to path[i + 1]: 'up' to a parent,
+      'down' to a child or 'partner'.
+      Both sides are expanded a full level at a time, always the smaller
+      frontier first; the shortest path through the meeting points of a
+      level is kept.
+  """
+  if a == b:
+    return [a], []
+  ''' visited[side][id] = (previous id, step from previous to id, distance) '''
+  visited = ({a: (None, None, 0)}, {b: (None, None, 0)})
+  frontiers = ([a], [b])
+  steps = 0
+  while (frontiers[0] or frontiers[1]) and steps < max_steps:
+    ''' Smallest non-empty frontier; one side may run out of parents first '''
+    side = 0 if frontiers[0] and (not frontiers[1] or len(frontiers[0]) <= len(frontiers[1])) else 1
+    own, other = visited[side], visited[1 - side]
+    meetings = []
+    next_frontier = []
+    for id in frontiers[side]:
+      distance = own[id][2] + 1
+      for neighbour, step in neighbours(id):
+        if neighbour in own:
+          continue
+        own[neighbour] = (id, step, distance)
+        if neighbour in other:
+          meetings.append(neighbour)
+        next_frontier.append(neighbour)
+    if meetings:
+      meeting = min(meetings, key=lambda id: visited[0][id][2] + visited[1][id][2])
+      return _join(visited, meeting)
+    frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+    steps += 1
+    if len(visited[0]) + len(visited[1]) > max_visited:
+      break
+  return None
+
+
+def _join(visited, meeting):
+  """ Path from a to the meeting point, then from the meeting point to b """
+  forward, backward = visited
+  path = [meeting]
+  steps = []
+  id = meeting
+  while forward[id][0] is not None:
+    previous, step, distance = forward[id]
+    path.insert(0, previous)
+    steps.insert(0, step)
+    id = previous
+  id = meeting
+  while backward[id][0] is not None:
+    previous, step, distance = backward[id]
+    ''' Stored from b's side, so walking towards b reverses the step '''
+    path.append(previous)
+    steps.append(INVERSE[step])
+    id = previous
+  return path, steps
+
+
+def get_path(a_id, b_id):
+  """ Memoised path between two people: blood relations first, then through partners """
+  version = family_graph.version()
+  key = f"relationship:{ version }:{ a_id }:{ b_id }"
+  result = cache.get(key)
+  if result is None:
+    result = find_path(a_id, b_id, neighbours=_ancestor_neighbours) \
+      or find_path(a_id, b_id, neighbours=_all_neighbours) \
+      or False
+    cache.set(key, result, CACHE_TIMEOUT)
+  return result or None
+
+
+''' Naming
+    Terms per gender of the person being described: (male, female, other)
+'''
+def _gendered(gender, male, female, other):
+  return {'m': male, 'f': female}.get(gender, other)
+
+
+def _ordinal(number):
+  ordinals = [_('first'), _('second'), _('third'), _('fourth'), _('fifth'),
+              _('sixth'), _('seventh'), _('eighth'), _('ninth'), _('tenth')]
+  return ordinals[number - 1] if number <= len(ordinals) else f"{ number }th"
+
+
+def _times(number):
+  return {1: _('once'), 2: _('twice'), 3: _('thrice')}.get(number, _('%(count)s times') % {'count': number})
+
+
+def _greats(generations):
+  """ Prefix for lineal relatives: 1 → '', 2 → 'grand', 3 → 'great-grand', ... """
+  if generations <= 1:
+    return ''
+  if generations == 2:
+    return _('grand')
+  if generations <= 4:
+    return _('great-') * (generations - 2) + _('grand')
+  return f"{ generations - 2 }× " + _('great-') + _('grand')
+
+
+def _blood_name(ups, downs, gender, half=False):
+  """ Name for a path of `ups` steps to a common ancestor and `downs` steps back down """
+  if ups == 0 and downs == 0:
+    return _('same person')
+  if downs == 0:
+    return _greats(ups) + _gendered(gender, _('father'), _('mother'), _('parent'))
+  if ups == 0:
+    return _greats(downs) + _gendered(gender, _('son'), _('daughter'), _('child'))
+  if ups == 1 and downs == 1:
+    if half:
+      return _gendered(gender, _('half-brother'), _('half-sister'), _('half-sibling'))
+    return _gendered(gender, _('brother'), _('sister'), _('sibling'))
+  if ups == 1:
+    return _greats(downs - 1) + _gendered(gender, _('nephew'), _('niece'), _('nephew or niece'))
+  if downs == 1:
+    return _greats(ups - 1) + _gendered(gender, _('uncle'), _('aunt'), _('uncle or aunt'))
+  degree = min(ups, downs) - 1
+  removed = abs(ups - downs)
+  name = _('%(ordinal)s cousin') % {'ordinal': _ordinal(degree)}
+  if removed:
+    name = _('%(cousin)s %(times)s removed') % {'cousin': name, 'times': _times(removed)}
+  return name
+
+
+def _segment(steps):
+  """ (ups, downs) of a blood segment, or None when it zigzags """
+  ups = 0
+  while ups < len(steps) and steps[ups] == UP:
+    ups += 1
+  if any(step != DOWN for step in steps[ups:]):
+    return None
+  return ups, len(steps) - ups
+
+
+def _is_half_sibling(a_id, b_id):
+  a_parents = set(family_graph.parents(a_id))
+  b_parents = set(family_graph.parents(b_id))
+  return len(a_parents) > 1 and len(b_parents) > 1 and len(a_parents & b_parents) == 1
+
+
+def name_relationship(path, steps, gender=None):
+  """ Name of the relationship of the last person in path to the first.
+      gender is the gender of the last person and selects the term.
+  """
+  segment = _segment(steps)
+  if segment is not None:
+    half = segment == (1, 1) and _is_half_sibling(path[0], path[-1])
+    return _blood_name(*segment, gender, half=half)
+  if steps.count(PARTNER) == 1:
+    index = steps.index(PARTNER)
+    before, after = _segment(steps[:index]), _segment(steps[index + 1:])
+    in_law = {
+      ((0, 0), (0, 0)): (_('partner'), _('partner'), _('partner')),
+      ((1, 0), (0, 0)): (_('stepfather'), _('stepmother'), _('step-parent')),
+      ((0, 0), (0, 1)): (_('stepson'), _('stepdaughter'), _('stepchild')),
+      ((0, 0), (1, 0)): (_('father-in-law'), _('mother-in-law'), _('parent-in-law')),
+      ((0, 1), (0, 0)): (_('son-in-law'), _('daughter-in-law'), _('child-in-law')),
+      ((1, 1), (0, 0)): (_('brother-in-law'), _('sister-in-law'), _('sibling-in-law')),
+      ((0, 0), (1, 1)): (_('brother-in-law'), _('sister-in-law'), _('sibling-in-law')),
+      ((2, 1), (0, 0)): (_('uncle'), _('aunt'), _('uncle or aunt')),
+    }.get((before, after))
+    if in_law:
+      return _gendered(gender, *in_law)
+  ''' Anything else is described as a chain, e.g. "sibling's partner's first cousin" '''
+  parts = []
+  segment_start = 0
+  for index, step in enumerate(steps + [None]):
+    if step == PARTNER or step is None:
+      blood = steps[segment_start:index]
+      if blood:
+        ups_downs = _segment(blood)
+        if ups_downs is not None:
+          parts.append(_blood_name(*ups_downs, gender if step is None else None))
+        else:
+          parts.append(_('relative'))
+      if step == PARTNER:
+        parts.append(_('partner'))
+      segment_start = index + 1
+  return "'s ".join(parts)
+
+
+def get_relationship(person, other):
+  """ How `other` is related to `person`.
+      Returns a dict with the path (person ids from person to other), the
+      steps between them, the distance and the relationship name, or None
+      when they are not related.
+  """
+  result = get_path(person.id, other.id)
+  if result is None:
+    return None
+  path, steps = result
+  return {
+    'path': path,
+    'steps': steps,
+    'distance': len(steps),
+    'blood': PARTNER not in steps,
+    'name': name_relationship(path, steps, other.gender),
+  }
@@ -0,0 +1,111 @@
+"""
+Content-addressed cache for rendered family tree SVGs.
+
+A rendered tree is stored as MEDIA_ROOT/forest/<sha256 of the DOT source>.svg.
+When a request produces DOT source that was rendered before, the stored SVG is
+served as is and no layout is computed. The DOT source describes the complete
+tree, so it is also the cache key for the built-in layout backend; the backend
+name is part of the hash so both renders can coexist. New renders are written to a
+temporary file and moved into place atomically, so concurrent requests (or
+gunicorn workers) rendering the same tree never see a half written file.
+
+Renders are evicted least-recently-used first once the cache exceeds
+settings.TREE_CACHE_MAX_SIZE bytes. Serving a cached render refreshes its
+modification time, which is what eviction orders on.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+CACHE_DIRECTORY = 'forest'
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+RENDER_FORMAT = 'svg'
+_CACHE_FILE = re.compile(r'^[0-9a-f]{64}\.svg$')
+
+
+def get_cache_path():
+  return Path(settings.MEDIA_ROOT).joinpath(CACHE_DIRECTORY)
+
+
+def source_hash(source, backend='graphviz'):
+  """ Hash of the DOT source, output format and backend; the cache key of a render """
+  prefix = RENDER_FORMAT if backend == 'graphviz' else f"{ RENDER_FORMAT }:{ backend }"
+  return hashlib.sha256(f"{ prefix }\n{ source }".encode('utf-8')).hexdigest()
+
+
+def render_graphviz(source):
+  import graphviz
+  return graphviz.Source(source, format=RENDER_FORMAT).pipe()
+
+
+def get_rendered_tree(source, render=None, backend='graphviz'):
+  """ Returns the path of the rendered SVG, relative to MEDIA_ROOT.
+      Renders only when no render of this exact source exists; render is a
+      callable returning SVG bytes, by default graphviz on the DOT source.
+  """
+  name = f"{ source_hash(source, backend) }.{ RENDER_FORMAT }"
+  target = get_cache_path().joinpath(name)
+  if target.exists():
+    _touch(target)
+  else:
+    svg = render() if render is not None else render_graphviz(source)
+    write_atomic(target, svg)
+    evict(keep=target)
+  return Path(CACHE_DIRECTORY).joinpath(name)
+
+
+def write_atomic(target, content):
+  """ Write bytes to a temporary file next to target, then move it into place """
+  target.parent.mkdir(parents=True, exist_ok=True)
+  handle, temporary = tempfile.mkstemp(dir=target.parent, prefix='.tmp-', suffix=target.suffix)
+  try:
+    with os.fdopen(handle, 'wb') as file:
+      file.write(content)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, target)
+  except BaseException:
+    Path(temporary).unlink(missing_ok=True)
+    raise
+
+
+def _touch(path):
+  try:
+    os.utime(path)
+  except OSError:
+    pass
+
+
+def evict(keep=None, max_size=None):
+  """ Remove least recently used renders until the cache fits the disk quota """
+  if max_size is None:
+    max_size = getattr(settings, 'TREE_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+  renders = []
+  total = 0
+  try:
+    entries = list(os.scandir(get_cache_path()))
+  except FileNotFoundError:
+    return 0
+  for entry in entries:
+    if not _CACHE_FILE.match(entry.name):
+      continue
+    try:
+      stat = entry.stat()
+    except FileNotFoundError:
+      continue
+    renders.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+    total += stat.st_size
+  removed = 0
+  for mtime, size, path in sorted(renders):
+    if total <= max_size:
+      break
+    if keep is not None and path == keep:
+      continue
+    path.unlink(missing_ok=True)
+    total -= size
+    removed += 1
+  return removed
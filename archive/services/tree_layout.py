@@ -0,0 +1,423 @@
+"""
+Layered layout for family trees.
+
+A small Sugiyama-style layout engine for the shape Tree produces: people
+with their partners side by side, a mountpoint between partners who share
+children, and child edges from that mountpoint down to the next generation.
+It works directly on the Tree data structures and produces SVG or a
+node/edge coordinate list, so no graphviz subprocess is needed. People with
+an avatar get it at the left of their node.
+
+Steps:
+  1. Layering — the ancestor is layer 0, partners share a layer, children go
+     one layer down. People reachable through several lines keep the first
+     layer they were given.
+  2. Blocks — a person and the partners placed with them form one block, so
+     partners always stay next to each other.
+  3. Ordering — blocks are ordered per layer by depth-first order, then
+     improved with barycenter sweeps, keeping the order with fewest crossings.
+  4. Coordinates — blocks form a tree (who was placed through whom);
+     subtrees are packed side by side as tightly as their contours allow
+     and every block is centred above its children (Reingold-Tilford).
+  5. Edges — partner edges are horizontal, child edges are routed
+     orthogonally from the parents' mountpoint via a bus line.
+"""
+
+from html import unescape
+from xml.sax.saxutils import escape, quoteattr
+
+NODE_HEIGHT = 40
+NODE_MIN_WIDTH = 100
+NODE_PADDING = 16
+CHAR_WIDTH = 6.2
+PARTNER_GAP = 24
+BLOCK_GAP = 32
+LAYER_GAP = 56
+BUS_STEP = 8
+MARGIN = 20
+AVATAR_SIZE = 32
+SWEEPS = 4
+GENDER_COLOURS = {'m': 'lightblue', 'f': 'pink'}
+DEFAULT_COLOUR = '#e9ecef'
+
+
+def count_crossings(edges):
+  """ Number of crossing pairs among edges given as (upper, lower) positions """
+  sequence = [lower for upper, lower in sorted(edges)]
+
+  def sort_count(values):
+    if len(values) < 2:
+      return values, 0
+    middle = len(values) // 2
+    left, left_count = sort_count(values[:middle])
+    right, right_count = sort_count(values[middle:])
+    merged = []
+    count = left_count + right_count
+    i = j = 0
+    while i < len(left) and j < len(right):
+      if right[j] < left[i]:
+        merged.append(right[j])
+        count += len(left) - i
+        j += 1
+      else:
+        merged.append(left[i])
+        i += 1
+    merged.extend(left[i:])
+    merged.extend(right[j:])
+    return merged, count
+
+  return sort_count(sequence)[1]
+
+
+class TreeLayout:
+  """ Computes coordinates for all people in a Tree.
+
+      Reads from the tree:
+        ancestor_id  - id of the person the tree starts from
+        people       - ids of everyone in the tree (populate order)
+        persons      - id → Person, for full_name(), get_lifespan(), gender and avatar_key
+        collapsed    - ids whose children are not in the tree (optional)
+        get_avatar   - id → avatar as data URI, for SVG (optional)
+        get_avatar_url - id → avatar URL, for as_dict() (optional)
+        partner_ids, children_ids, parent_ids - id → list of ids
+  """
+
+  def __init__(self, tree):
+    self.root = tree.ancestor_id
+    self.ids = [id for id in tree.people if id in tree.persons]
+    members = set(self.ids)
+    self.persons = tree.persons
+    self.collapsed = getattr(tree, 'collapsed', set())
+    self.get_avatar = getattr(tree, 'get_avatar', lambda id: None)
+    self.get_avatar_url = getattr(tree, 'get_avatar_url', lambda id: None)
+    self.partner_ids = {id: [p for p in tree.partner_ids.get(id, ()) if p in members] for id in self.ids}
+    self.children_ids = {id: [c for c in tree.children_ids.get(id, ()) if c in members] for id in self.ids}
+    self.parent_ids = {id: [p for p in tree.parent_ids.get(id, ()) if p in members] for id in self.ids}
+    ''' Labels and sizes '''
+    self.labels = {}
+    self.width = {}
+    self.avatar_width = {}
+    for id in self.ids:
+      person = self.persons[id]
+      name = person.full_name()
+      lifespan = unescape(person.get_lifespan())
+      self.labels[id] = (name, lifespan)
+      self.avatar_width[id] = AVATAR_SIZE + (NODE_HEIGHT - AVATAR_SIZE) // 2 if person.avatar_key else 0
+      self.width[id] = max(NODE_MIN_WIDTH, round(max(len(name), len(lifespan)) * CHAR_WIDTH) + NODE_PADDING) + self.avatar_width[id]
+    ''' Layout '''
+    self.build_blocks()
+    self.order_blocks()
+    self.assign_coordinates()
+    self.route_edges()
+
+  ''' 1 + 2: Layers and blocks '''
+  def build_blocks(self):
+    self.layer = {}
+    self.blocks = []
+    self.block_of = {}
+    self.layers = {}
+    self.block_parent = {}
+    stack = [(self.root, 0, None)] if self.root in self.partner_ids else []
+    remaining = list(reversed(self.ids))
+    while stack or remaining:
+      if not stack:
+        ''' Person not reachable from the ancestor; place below their parents '''
+        id = remaining.pop()
+        if id in self.block_of:
+          continue
+        parent_layers = [self.layer[p] for p in self.parent_ids[id] if p in self.layer]
+        stack.append((id, max(parent_layers) + 1 if parent_layers else 0, None))
+      id, layer, parent_block = stack.pop()
+      if id in self.block_of:
+        continue
+      block = [id]
+      right = True
+      for partner in self.partner_ids[id]:
+        if partner in self.block_of or partner in block:
+          continue
+        if right:
+          block.append(partner)
+        else:
+          block.insert(0, partner)
+        right = not right
+      index = len(self.blocks)
+      self.blocks.append(block)
+      self.block_parent[index] = parent_block
+      self.layers.setdefault(layer, []).append(index)
+      for member in block:
+        self.block_of[member] = index
+        self.layer[member] = layer
+      ''' Children grouped by parent, left to right through the block '''
+      children = []
+      seen = set()
+      for member in block:
+        for child in self.children_ids[member]:
+          if child not in seen:
+            seen.add(child)
+            children.append(child)
+      for child in reversed(children):
+        if child not in self.block_of:
+          stack.append((child, layer + 1, index))
+    self.depth = max(self.layers) if self.layers else 0
+
+  ''' 3: Ordering '''
+  def positions(self, order):
+    """ Fractional position of every person, from the block order per layer """
+    position = {}
+    for blocks in order.values():
+      for index, block in enumerate(blocks):
+        members = self.blocks[block]
+        for offset, member in enumerate(members):
+          position[member] = index + (offset + 1) / (len(members) + 1)
+    return position
+
+  def crossings(self, order):
+    position = self.positions(order)
+    edges = {}
+    for child in self.ids:
+      parents = self.parent_ids[child]
+      if not parents:
+        continue
+      upper = sum(position[p] for p in parents) / len(parents)
+      key = (max(self.layer[p] for p in parents), self.layer[child])
+      edges.setdefault(key, []).append((upper, position[child]))
+    return sum(count_crossings(layer_edges) for layer_edges in edges.values())
+
+  def sweep(self, order, layer, related):
+    """ Reorder one layer by the barycenter of related people in the given direction """
+    position = self.positions(order)
+    barycenters = []
+    previous = None
+    for index, block in enumerate(order[layer]):
+      values = [position[r] for member in self.blocks[block] for r in related(member) if r in position]
+      if values:
+        previous = sum(values) / len(values)
+      elif previous is None:
+        previous = index
+      barycenters.append((previous, index, block))
+    order[layer] = [block for barycenter, index, block in sorted(barycenters)]
+
+  def order_blocks(self):
+    order = {layer: list(blocks) for layer, blocks in self.layers.items()}
+    best = {layer: list(blocks) for layer, blocks in order.items()}
+    best_crossings = self.crossings(order)
+    parents = lambda id: self.parent_ids[id]
+    children = lambda id: self.children_ids[id]
+    for iteration in range(SWEEPS):
+      if best_crossings == 0:
+        break
+      if iteration % 2 == 0:
+        for layer in range(1, self.depth + 1):
+          if layer in order:
+            self.sweep(order, layer, parents)
+      else:
+        for layer in range(self.depth - 1, -1, -1):
+          if layer in order:
+            self.sweep(order, layer, children)
+      crossings = self.crossings(order)
+      if crossings < best_crossings:
+        best_crossings = crossings
+        best = {layer: list(blocks) for layer, blocks in order.items()}
+    self.order = best
+    self.crossing_count = best_crossings
+
+  ''' 4: Coordinates '''
+  def block_width(self, block):
+    members = self.blocks[block]
+    return sum(self.width[m] for m in members) + PARTNER_GAP * (len(members) - 1)
+
+  def center(self, id):
+    return self.x[id] + self.width[id] / 2
+
+  def place_subtrees(self, subtrees):
+    """ Pack subtrees left to right as close as their contours allow.
+        A subtree is (block, contour); a contour maps layer → (left, right)
+        relative to the block centre. Returns the offsets and merged contour.
+    """
+    offsets = []
+    merged = {}
+    for block, contour in subtrees:
+      shift = 0
+      if merged:
+        shift = max(
+          (merged[layer][1] - left + BLOCK_GAP for layer, (left, right) in contour.items() if layer in merged),
+          default=0,
+        )
+        if not any(layer in merged for layer in contour):
+          shift = max(right for left, right in merged.values()) - min(left for left, right in contour.values()) + BLOCK_GAP
+      offsets.append(shift)
+      for layer, (left, right) in contour.items():
+        if layer in merged:
+          merged[layer] = (merged[layer][0], right + shift)
+        else:
+          merged[layer] = (left + shift, right + shift)
+    return offsets, merged
+
+  def assign_coordinates(self):
+    ''' Blocks in the block tree (who was placed through whom), ordered as in the layers '''
+    position = {block: index for blocks in self.order.values() for index, block in enumerate(blocks)}
+    children = {block: [] for block in range(len(self.blocks))}
+    roots = []
+    for block, parent in self.block_parent.items():
+      (children[parent] if parent is not None else roots).append(block)
+    for blocks in children.values():
+      blocks.sort(key=position.get)
+    roots.sort(key=lambda block: (self.layer[self.blocks[block][0]], position[block]))
+    ''' Post-order: contour of every subtree, children centred under their block '''
+    offset = {}
+    contours = {}
+    stack = [(block, False) for block in reversed(roots)]
+    while stack:
+      block, expanded = stack.pop()
+      if not expanded:
+        stack.append((block, True))
+        stack.extend((child, False) for child in reversed(children[block]))
+        continue
+      half = self.block_width(block) / 2
+      layer = self.layer[self.blocks[block][0]]
+      contour = {layer: (-half, half)}
+      if children[block]:
+        offsets, merged = self.place_subtrees([(child, contours.pop(child)) for child in children[block]])
+        middle = (offsets[0] + offsets[-1]) / 2
+        for child, child_offset in zip(children[block], offsets):
+          offset[child] = child_offset - middle
+        for child_layer, (left, right) in merged.items():
+          contour[child_layer] = (left - middle, right - middle)
+      contours[block] = contour
+    ''' Pre-order: absolute block centres, roots packed side by side '''
+    offsets, merged = self.place_subtrees([(root, contours[root]) for root in roots])
+    centers = dict(zip(roots, offsets))
+    stack = list(roots)
+    self.x = {}
+    while stack:
+      block = stack.pop()
+      left = centers[block] - self.block_width(block) / 2
+      for member in self.blocks[block]:
+        self.x[member] = left
+        left += self.width[member] + PARTNER_GAP
+      for child in children[block]:
+        centers[child] = centers[block] + offset[child]
+        stack.append(child)
+    ''' Normalise to the margin '''
+    shift = MARGIN - min(self.x.values(), default=0)
+    for id in self.x:
+      self.x[id] += shift
+    self.y = {id: MARGIN + self.layer[id] * (NODE_HEIGHT + LAYER_GAP) for id in self.x}
+    self.total_width = max((self.x[id] + self.width[id] for id in self.x), default=0) + MARGIN
+    self.total_height = MARGIN * 2 + (self.depth + 1) * NODE_HEIGHT + self.depth * LAYER_GAP
+
+  ''' 5: Edges '''
+  def route_edges(self):
+    self.mountpoints = {}
+    self.edges = []
+    ''' Partner edges '''
+    for id in self.ids:
+      for partner in self.partner_ids[id]:
+        if id > partner:
+          continue
+        a, b = sorted((id, partner), key=self.center)
+        if self.layer[a] == self.layer[b]:
+          y = self.y[a] + NODE_HEIGHT / 2
+          points = [(self.x[a] + self.width[a], y), (self.x[b], y)]
+        else:
+          points = [(self.center(a), self.y[a] + NODE_HEIGHT / 2), (self.center(b), self.y[b] + NODE_HEIGHT / 2)]
+        self.edges.append({'type': 'partner', 'source': f"P{ a }", 'target': f"P{ b }", 'points': points})
+    ''' Child edges, from the mountpoint of the parents. Sibling groups of
+        one block get their own bus height, so they stay distinguishable.
+    '''
+    buses = {}
+    block_buses = {}
+    for child in self.ids:
+      parents = sorted(self.parent_ids[child])
+      if not parents:
+        continue
+      key = 'P' + 'x'.join(str(p) for p in parents)
+      if key not in self.mountpoints:
+        self.mountpoints[key] = self.mountpoint(parents)
+        block = self.block_of[parents[0]]
+        buses[key] = block_buses.get(block, 0)
+        block_buses[block] = buses[key] + 1
+      mx, my = self.mountpoints[key]
+      cx, cy = self.center(child), self.y[child]
+      bus = cy - LAYER_GAP / 2 - min(buses[key], 2) * BUS_STEP
+      if my <= bus:
+        points = [(mx, my), (mx, bus), (cx, bus), (cx, cy)]
+      else:
+        points = [(mx, my), (cx, cy)]
+      self.edges.append({'type': 'child', 'source': key, 'target': f"P{ child }", 'points': points})
+
+  def mountpoint(self, parents):
+    """ Point the child edges of these parents start from: below a single
+        parent, between two partners side by side, or below the middle of
+        more parents (e.g. adoptive and biological) or parents on different layers
+    """
+    if len(parents) == 1:
+      parent = parents[0]
+      return (self.center(parent), self.y[parent] + NODE_HEIGHT)
+    ordered = sorted(parents, key=self.center)
+    if len(parents) == 2 and self.layer[ordered[0]] == self.layer[ordered[1]]:
+      a, b = ordered
+      return ((self.x[a] + self.width[a] + self.x[b]) / 2, self.y[a] + NODE_HEIGHT / 2)
+    return (sum(self.center(p) for p in parents) / len(parents), max(self.y[p] for p in parents) + NODE_HEIGHT)
+
+  ''' Output '''
+  def as_dict(self):
+    nodes = []
+    for id in self.ids:
+      name, lifespan = self.labels[id]
+      nodes.append({
+        'id': f"P{ id }",
+        'person': id,
+        'name': name,
+        'lifespan': lifespan,
+        'gender': self.persons[id].gender,
+        'layer': self.layer[id],
+        'x': self.x[id],
+        'y': self.y[id],
+        'width': self.width[id],
+        'height': NODE_HEIGHT,
+        'expandable': id in self.collapsed,
+        'avatar': self.get_avatar_url(id) if self.avatar_width[id] else None,
+      })
+    return {
+      'width': self.total_width,
+      'height': self.total_height,
+      'nodes': nodes,
+      'mountpoints': [{'id': key, 'x': x, 'y': y} for key, (x, y) in self.mountpoints.items()],
+      'edges': self.edges,
+    }
+
+  def as_svg(self):
+    lines = [
+      f'<svg xmlns="http://www.w3.org/2000/svg" width="{ self.total_width:.0f}" height="{ self.total_height:.0f}" '
+      f'viewBox="0 0 { self.total_width:.0f} { self.total_height:.0f}" font-family="sans-serif" font-size="11">',
+      '<g class="edges" stroke="black" fill="none">',
+    ]
+    for edge in self.edges:
+      points = ' '.join(f"{ x:.1f},{ y:.1f}" for x, y in edge['points'])
+      lines.append(f'<polyline class="{ edge["type"] }" points="{ points }"/>')
+    lines.append('</g>')
+    lines.append('<g class="people">')
+    for id in self.ids:
+      name, lifespan = self.labels[id]
+      x, y, width = self.x[id], self.y[id], self.width[id]
+      colour = GENDER_COLOURS.get(self.persons[id].gender, DEFAULT_COLOUR)
+      center = x + (width + self.avatar_width[id]) / 2
+      avatar = self.get_avatar(id) if self.avatar_width[id] else None
+      if avatar:
+        inset = (NODE_HEIGHT - AVATAR_SIZE) / 2
+        avatar = f'<image x="{ x + inset:.1f}" y="{ y + inset:.1f}" width="{ AVATAR_SIZE }" height="{ AVATAR_SIZE }" href={ quoteattr(avatar) }/>'
+      expandable = ''
+      if id in self.collapsed:
+        ''' Children not shown: double border, like peripheries=2 in graphviz '''
+        expandable = f'<rect x="{ x - 3:.1f}" y="{ y - 3:.1f}" width="{ width + 6 }" height="{ NODE_HEIGHT + 6 }" fill="none" stroke="black"/>'
+      lines.append(
+        f'<g class="person{ " expandable" if expandable else "" }" id="P{ id }">{ expandable }'
+        f'<rect x="{ x:.1f}" y="{ y:.1f}" width="{ width }" height="{ NODE_HEIGHT }" fill={ quoteattr(colour) } stroke="black"/>{ avatar or "" }'
+        f'<text x="{ center:.1f}" y="{ y + 17:.1f}" text-anchor="middle" font-weight="bold">{ escape(name) }</text>'
+        f'<text x="{ center:.1f}" y="{ y + 31:.1f}" text-anchor="middle">{ escape(lifespan) }</text>'
+        f'</g>'
+      )
+    lines.append('</g>')
+    lines.append('</svg>')
+    return '\n'.join(lines)
@@ -0,0 +1,324 @@
+""" Signal handlers that keep derived data in sync with the archive models.
+
+    Registered from ArchiveConfig.ready().
+"""
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from archive.models import FamilyRelations, Event, Person, Image, Comment, Tag, Group, Attachment, Category
+from archive.services.family_graph import family_graph
+from archive.services.lifespan import sync_lifespans
+from archive.services import person_facets
+from archive.services import image_counters
+from archive.services import image_facets
+from archive.services.family_collections import sync_families
+from archive.services.derivatives import delete_derivatives
+from archive.services import avatars, deep_zoom
+from archive.services import cache_version
+
+
+''' Cache versions
+    Read the version counters again on every request, so a process sees the
+    changes other processes made (archive/services/cache_version.py).
+'''
+@receiver(request_started)
+def cache_versions_expired(sender, **kwargs):
+  cache_version.clear()
+
+
+''' Family graph
+    Apply FamilyRelations changes to the in-process family graph once the
+    transaction commits, so rolled back changes never reach the graph.
+'''
+@receiver(post_save, sender=FamilyRelations)
+def family_relation_saved(sender, instance, **kwargs):
+  pk, up_id, down_id, type = instance.pk, instance.up_id, instance.down_id, instance.type
+  transaction.on_commit(lambda: family_graph.relation_saved(pk, up_id, down_id, type))
+
+
+@receiver(post_delete, sender=FamilyRelations)
+def family_relation_deleted(sender, instance, **kwargs):
+  pk, up_id, down_id, type = instance.pk, instance.up_id, instance.down_id, instance.type
+  transaction.on_commit(lambda: family_graph.relation_deleted(pk, up_id, down_id, type))
+
+
+''' Stored birth and death dates
+    Person.birth_* and death_* follow the person's birth and death Events.
+    Any event save re-syncs its people, since the type or date may have
+    changed from or to birth/death. Deleting an event removes its people
+    links first, so they are collected in pre_delete.
+'''
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, raw=False, **kwargs):
+  if raw:
+    return
+  sync_lifespans(instance.people.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Event)
+def event_deleting(sender, instance, **kwargs):
+  instance._lifespan_people = list(instance.people.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Event)
+def event_deleted(sender, instance, **kwargs):
+  sync_lifespans(getattr(instance, '_lifespan_people', []))
+
+
+@receiver(m2m_changed, sender=Event.people.through)
+def event_people_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action == 'pre_clear':
+    ''' pk_set is not provided for clear(); remember who is affected '''
+    if reverse:
+      instance._lifespan_people = [instance.pk]
+    else:
+      instance._lifespan_people = list(instance.people.values_list('pk', flat=True))
+    return
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  if reverse:
+    ''' person.events.add(...): instance is the Person '''
+    sync_lifespans([instance.pk])
+  elif action == 'post_clear':
+    sync_lifespans(getattr(instance, '_lifespan_people', []))
+  else:
+    sync_lifespans(pk_set or [])
+
+
+''' People list facets
+    Any change to people, their events or their photos may change the
+    cached facets of the people list; bump their version once committed.
+'''
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_delete, sender=Image)
+def person_facets_changed(sender, raw=False, **kwargs):
+  if raw:
+    return
+  transaction.on_commit(person_facets.invalidate)
+
+
+@receiver(m2m_changed, sender=Event.people.through)
+@receiver(m2m_changed, sender=Image.people.through)
+def person_facets_people_changed(sender, action, **kwargs):
+  if action in ('post_add', 'post_remove', 'post_clear'):
+    transaction.on_commit(person_facets.invalidate)
+
+
+''' Image counters
+    Recompute the stored counters of every image whose people, tags, groups,
+    attachments or published comments change, and the image count of
+    categories that gain or lose an image. Deleting a person, tag, group or
+    attachment removes its image links without m2m_changed, so the images
+    are collected in pre_delete.
+'''
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.tag.through)
+@receiver(m2m_changed, sender=Image.in_group.through)
+@receiver(m2m_changed, sender=Image.attachments.through)
+def image_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action == 'pre_clear' and reverse:
+    instance._counter_images = list(instance.images.values_list('pk', flat=True))
+    return
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  if not reverse:
+    image_counters.refresh_images([instance.pk])
+  elif action == 'post_clear':
+    image_counters.refresh_images(getattr(instance, '_counter_images', []))
+  else:
+    image_counters.refresh_images(pk_set or [])
+
+
+@receiver(pre_delete, sender=Person)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Group)
+@receiver(pre_delete, sender=Attachment)
+def image_link_deleting(sender, instance, **kwargs):
+  instance._counter_images = list(instance.images.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Attachment)
+def image_link_deleted(sender, instance, **kwargs):
+  image_counters.refresh_images(getattr(instance, '_counter_images', []))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, raw=False, **kwargs):
+  if raw:
+    return
+  image_counters.refresh_images([instance.image_id], ['comment_count'])
+
+
+@receiver(pre_save, sender=Image)
+def image_saving(sender, instance, raw=False, **kwargs):
+  ''' Remember the stored category, family and file, they may change '''
+  instance._previous_category, instance._previous_family, instance._previous_source = None, None, None
+  if raw or instance.pk is None:
+    return
+  instance._previous_category, instance._previous_family, instance._previous_source = Image.objects.filter(pk=instance.pk).values_list('category', 'family', 'source').first() or (None, None, None)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, created, raw=False, **kwargs):
+  if raw:
+    return
+  previous = getattr(instance, '_previous_category', None)
+  if created or previous != instance.category_id:
+    image_counters.refresh_categories([previous, instance.category_id])
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+  image_counters.refresh_categories([instance.category_id])
+
+
+''' Image list facets
+    Facet counts depend on images, their categories, tags and people, and
+    on the names of those; bump their version once committed.
+'''
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def image_facets_changed(sender, raw=False, **kwargs):
+  if raw:
+    return
+  transaction.on_commit(image_facets.invalidate)
+
+
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.tag.through)
+def image_facets_links_changed(sender, action, **kwargs):
+  if action in ('post_add', 'post_remove', 'post_clear'):
+    transaction.on_commit(image_facets.invalidate)
+
+
+''' Family collections
+    Resync the stored family collections of images whose people or family
+    change, and of the images of people whose last or married name changes.
+    The images of a deleted person are collected by image_link_deleting.
+'''
+@receiver(m2m_changed, sender=Image.people.through)
+def image_people_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  if not reverse:
+    sync_families([instance.pk])
+  elif action == 'post_clear':
+    sync_families(getattr(instance, '_counter_images', []))
+  else:
+    sync_families(pk_set or [])
+
+
+@receiver(post_save, sender=Image)
+def image_family_saved(sender, instance, created, raw=False, **kwargs):
+  if raw:
+    return
+  if created or getattr(instance, '_previous_family', None) != instance.family:
+    sync_families([instance.pk])
+
+
+@receiver(pre_save, sender=Person)
+def person_saving(sender, instance, raw=False, **kwargs):
+  instance._names_changed, instance._crop_changed = False, False
+  if raw or instance.pk is None:
+    return
+  stored = Person.objects.filter(pk=instance.pk).values_list('last_name', 'married_name', 'portrait_x', 'portrait_y', 'portrait_w', 'portrait_h').first()
+  if stored is None:
+    return
+  instance._names_changed = stored[:2] != (instance.last_name, instance.married_name)
+  instance._crop_changed = stored[2:] != (instance.portrait_x, instance.portrait_y, instance.portrait_w, instance.portrait_h)
+
+
+@receiver(post_save, sender=Person)
+def person_names_saved(sender, instance, raw=False, **kwargs):
+  if raw or not getattr(instance, '_names_changed', False):
+    return
+  sync_families(instance.images.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Person)
+def person_family_deleted(sender, instance, **kwargs):
+  sync_families(getattr(instance, '_counter_images', []))
+
+
+''' Image derivatives
+    Remove the rendered derivatives and tiles of a deleted image once the
+    deletion is committed. Rendering itself is queued by the upload view.
+'''
+@receiver(post_delete, sender=Image)
+def image_derivatives_deleted(sender, instance, **kwargs):
+  pk = instance.pk
+  transaction.on_commit(lambda: delete_derivatives(pk))
+  transaction.on_commit(lambda: deep_zoom.delete_tiles(pk))
+
+
+''' Avatars
+    Render the avatars of people again once their crop or portrait changes,
+    or the file of their portrait is replaced; avatars.sync() only queues
+    a job when the result would differ. Deleting an image removes its
+    portrait links without m2m_changed, so the people are collected in
+    pre_delete.
+'''
+def sync_avatars(person_ids):
+  person_ids = list(person_ids)
+  if person_ids:
+    transaction.on_commit(lambda: avatars.sync(person_ids))
+
+
+@receiver(post_save, sender=Person)
+def person_crop_saved(sender, instance, raw=False, **kwargs):
+  if raw or not getattr(instance, '_crop_changed', False):
+    return
+  sync_avatars([instance.pk])
+
+
+@receiver(m2m_changed, sender=Image.portrait_of.through)
+def image_portraits_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action == 'pre_clear' and not reverse:
+    instance._avatar_people = list(instance.portrait_of.values_list('pk', flat=True))
+    return
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  if reverse:
+    sync_avatars([instance.pk])
+  elif action == 'post_clear':
+    sync_avatars(getattr(instance, '_avatar_people', []))
+  else:
+    sync_avatars(pk_set or [])
+
+
+@receiver(post_save, sender=Image)
+def image_portrait_saved(sender, instance, created, raw=False, **kwargs):
+  if raw or created or getattr(instance, '_previous_source', None) == instance.source.name:
+    return
+  sync_avatars(instance.portrait_of.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Image)
+def image_portrait_deleting(sender, instance, **kwargs):
+  instance._avatar_people = list(instance.portrait_of.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Image)
+def image_portrait_deleted(sender, instance, **kwargs):
+  sync_avatars(getattr(instance, '_avatar_people', []))
+
+
+@receiver(post_delete, sender=Person)
+def person_avatars_deleted(sender, instance, **kwargs):
+  pk = instance.pk
+  transaction.on_commit(lambda: avatars.delete_avatars(pk))
@@ -0,0 +1,175 @@
+/* Deep zoom viewer
+   Shows the tile pyramid of a large scan (archive/services/deep_zoom.py) in
+   every element with data-deep-zoom. Only the tiles on screen are loaded,
+   from the level that matches the zoom; the image inside the element is
+   stretched underneath as preview while they load.
+   Drag to pan, scroll or double click to zoom; the buttons do the same for
+   keyboards and touch screens.
+   Attributes: data-tiles (URL of the <key>_files/ directory), data-width,
+   data-height, data-tile-size, data-overlap
+*/
+(function () {
+  function DeepZoom(element) {
+    const width = Number(element.dataset.width);
+    const height = Number(element.dataset.height);
+    const tileSize = Number(element.dataset.tileSize);
+    const overlap = Number(element.dataset.overlap);
+    const base = element.dataset.tiles;
+    const maxLevel = Math.ceil(Math.log2(Math.max(width, height)));
+    const preview = element.querySelector('img');
+    const layer = document.createElement('div');
+    const tiles = new Map();
+    // Zoom in screen pixels per image pixel; x, y the image pixel at the top left
+    let scale = 1, minScale = 1, x = 0, y = 0, frame = null, drag = null;
+
+    layer.className = 'deep-zoom-tiles';
+    element.appendChild(layer);
+    element.insertAdjacentHTML('beforeend',
+      '<div class="deep-zoom-controls">' +
+      '<button type="button" class="btn btn-light btn-sm" data-zoom="in" aria-label="zoom in">+</button>' +
+      '<button type="button" class="btn btn-light btn-sm" data-zoom="out" aria-label="zoom out">&minus;</button>' +
+      '<button type="button" class="btn btn-light btn-sm" data-zoom="fit" aria-label="fit">&#8634;</button>' +
+      '</div>');
+    element.classList.add('deep-zoom-active');
+
+    function ratio() {
+      return window.devicePixelRatio || 1;
+    }
+
+    function limit(value) {
+      // From the whole image to two screen pixels per image pixel
+      return Math.min(Math.max(value, minScale), Math.max(minScale, 2 * ratio()));
+    }
+
+    function fit() {
+      minScale = Math.min(element.clientWidth / width, element.clientHeight / height);
+      scale = minScale;
+      update();
+    }
+
+    function update() {
+      if (frame === null) {
+        frame = window.requestAnimationFrame(render);
+      }
+    }
+
+    function center(position, view, size) {
+      // Keep the image on screen; centre it when it is smaller than the view
+      return view >= size ? (size - view) / 2 : Math.min(Math.max(position, 0), size - view);
+    }
+
+    function place(node, left, top, right, bottom) {
+      const screenLeft = Math.round((left - x) * scale);
+      const screenTop = Math.round((top - y) * scale);
+      node.style.left = screenLeft + 'px';
+      node.style.top = screenTop + 'px';
+      node.style.width = (Math.round((right - x) * scale) - screenLeft) + 'px';
+      node.style.height = (Math.round((bottom - y) * scale) - screenTop) + 'px';
+    }
+
+    function render() {
+      frame = null;
+      const viewWidth = element.clientWidth / scale;
+      const viewHeight = element.clientHeight / scale;
+      x = center(x, viewWidth, width);
+      y = center(y, viewHeight, height);
+      if (preview) {
+        place(preview, 0, 0, width, height);
+      }
+      const level = Math.max(0, Math.min(maxLevel, maxLevel + Math.ceil(Math.log2(scale * ratio()))));
+      const factor = Math.pow(2, maxLevel - level);  // Image pixels per pixel of this level
+      const levelWidth = Math.ceil(width / factor);
+      const levelHeight = Math.ceil(height / factor);
+      const columns = [Math.max(0, Math.floor(x / factor / tileSize)), Math.min(Math.ceil(levelWidth / tileSize), Math.ceil((x + viewWidth) / factor / tileSize))];
+      const rows = [Math.max(0, Math.floor(y / factor / tileSize)), Math.min(Math.ceil(levelHeight / tileSize), Math.ceil((y + viewHeight) / factor / tileSize))];
+      const visible = new Set();
+      for (let column = columns[0]; column < columns[1]; column++) {
+        for (let row = rows[0]; row < rows[1]; row++) {
+          const key = level + '/' + column + '_' + row;
+          let tile = tiles.get(key);
+          if (!tile) {
+            tile = document.createElement('img');
+            tile.alt = '';
+            tile.draggable = false;
+            tile.src = base + key + '.jpg';
+            layer.appendChild(tile);
+            tiles.set(key, tile);
+          }
+          visible.add(key);
+          place(tile,
+            Math.max(0, column * tileSize - overlap) * factor,
+            Math.max(0, row * tileSize - overlap) * factor,
+            Math.min(levelWidth, (column + 1) * tileSize + overlap) * factor,
+            Math.min(levelHeight, (row + 1) * tileSize + overlap) * factor);
+        }
+      }
+      for (const [key, tile] of tiles) {
+        if (!visible.has(key)) {
+          tile.remove();
+          tiles.delete(key);
+        }
+      }
+    }
+
+    function zoom(factor, clientX, clientY) {
+      // Zoom around a point of the element, by default its centre
+      const rect = element.getBoundingClientRect();
+      const pointX = clientX === undefined ? rect.width / 2 : clientX - rect.left;
+      const pointY = clientY === undefined ? rect.height / 2 : clientY - rect.top;
+      const imageX = x + pointX / scale;
+      const imageY = y + pointY / scale;
+      scale = limit(scale * factor);
+      x = imageX - pointX / scale;
+      y = imageY - pointY / scale;
+      update();
+    }
+
+    element.addEventListener('wheel', function (event) {
+      event.preventDefault();
+      zoom(Math.pow(2, -event.deltaY / 300), event.clientX, event.clientY);
+    }, { passive: false });
+    element.addEventListener('dblclick', function (event) {
+      zoom(2, event.clientX, event.clientY);
+    });
+    element.addEventListener('pointerdown', function (event) {
+      if (event.target.closest('button')) {
+        return;
+      }
+      drag = { x: event.clientX, y: event.clientY };
+      element.setPointerCapture(event.pointerId);
+    });
+    element.addEventListener('pointermove', function (event) {
+      if (!drag) {
+        return;
+      }
+      x -= (event.clientX - drag.x) / scale;
+      y -= (event.clientY - drag.y) / scale;
+      drag = { x: event.clientX, y: event.clientY };
+      update();
+    });
+    element.addEventListener('pointerup', function () {
+      drag = null;
+    });
+    element.addEventListener('click', function (event) {
+      const button = event.target.closest('[data-zoom]');
+      if (!button) {
+        return;
+      }
+      if (button.dataset.zoom === 'fit') {
+        fit();
+      } else {
+        zoom(button.dataset.zoom === 'in' ? 2 : 0.5);
+      }
+    });
+    window.addEventListener('resize', function () {
+      minScale = Math.min(element.clientWidth / width, element.clientHeight / height);
+      scale = limit(scale);
+      update();
+    });
+    fit();
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('[data-deep-zoom]').forEach(DeepZoom);
+  });
+})();
@@ -16,7 +16,7 @@ urlpatterns = [
   # path('object/<str:slug>/love/', views.ToggleFavoriteImage.as_view(), name='love-image'),
   path('object/<int:pk>:<str:slug>/regeneratethumbnail/', views.RegenerateThumbnailView.as_view(), name='regenerate-thumbnail'),
   # Special Image views
-  path('objects/<int:decade>/', views.ImageListView.as_view(), {'columns': ('decade')}, name='images-by-decade'),
+  path('objects/<int:decade>/', views.ImageListView.as_view(), name='images-by-decade'),
   path('objects/by:<str:user>/', views.ImageListView.as_view(), {'columns': ('user')}, name='image-by-uploader'),
   path('objects/<str:tag>/', views.ImageListView.as_view(), {'columns': ('tag')}, name='image-with-tag'),
   path('objects/a/comments/', views.aListComments.as_view(), name='acomments'),
@@ -35,8 +35,10 @@ urlpatterns = [
   path('person/<int:subject>/<str:type>:<int:removed_person>/delete/', views.PersonRemoveRelationView.as_view(), {'columns': ('up', 'relation', 'down')}, name='remove-relationship'),
   path('person/add-relation/', views.PersonAddRelationView.as_view(), name='add-relationship'),
   path('person/<int:pk>/<str:slug>/suggest-family/', views.SuggestFamilyView.as_view(), name='suggest-family'),
+  path('person/<int:pk>/relationship/<int:other>/', views.RelationshipView.as_view(), name='relationship'),
   # Tree
   path('tree/<int:pk>/', views.TreeView.as_view(), name="tree"),
+  path('tree/<int:pk>/branch/', views.TreeBranchView.as_view(), name="tree-branch"),
   # Add Image
   path('person/<int:subject_id>:<str:subject_slug>/add-image/', views.AddImageView.as_view(), name='add-person-image'),
   
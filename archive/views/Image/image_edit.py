@@ -8,13 +8,12 @@ from django.contrib import messages
 from django.utils.translation import gettext as _
 
 from pathlib import Path
-from datetime import datetime
-from PIL import Image as PIL
 from pillow_heif import register_heif_opener
 from html import escape
 
 from archive.models import Image
 from archive.models import Group, Tag, Attachment, Person, Category
+from archive.services import content_store, derivatives, image_metadata, near_duplicates
 
 ''' EditImageMasterClass
     Holds functionality used both by add and edit image views:
@@ -54,6 +53,8 @@ class EditImageMaster:
       context['portrait'] = self.object.is_portrait_of
       ''' Store who this image can be a portrait of '''
       context['available_portraits'] = self.object.people.all().filter(portrait=None, private=False)
+      ''' Images that look like this one, see archive/services/near_duplicates.py '''
+      context['possible_duplicates'] = near_duplicates.similar_images(self.object)
     ''' Family Collections '''
     context['available_family_collections'] = self.get_available_family_collections()
     if self.kwargs.get('subject_id', None):
@@ -105,6 +106,7 @@ class EditImageMaster:
     form['slug'] = object.slug if object else None
     form['source'] = object.source if object else None
     form['thumbnail'] = object.thumbnail if object else None
+    form['sha256'] = object.sha256 if object else ''
     form['title'] = self.request.POST.get('title', None)
     form['description'] = self.request.POST.get('description', '')
     form['document_source'] = self.request.POST.get('document_source', '')
@@ -125,7 +127,13 @@ class EditImageMaster:
     ''' Handle Uploads '''
     if 'source'in self.request.FILES:
       ''' Only process the first file '''
-      form['source'] = self.store_image(self.request.FILES['source'], self.get_upload_filename(self.request.FILES['source']))
+      upload = self.get_upload_format(self.request.FILES['source'])
+      if not upload:
+        return redirect(self.get_failure_url())
+      form['source'], form['sha256'], duplicate = self.store_image(self.request.FILES['source'], upload, object)
+      if duplicate:
+        ''' This file was uploaded before; show that image instead of adding a copy '''
+        return redirect('archive:image', slug=duplicate.slug)
     elif object:
       ''' If this is edit view, check for special tasks '''
       ''' Store Source from image '''
@@ -154,9 +162,14 @@ class EditImageMaster:
       if i > 0:
         messages.add_message(self.request, messages.INFO, f"{ _('slug already exists, selecting a different slug') }.")
 
-    ''' Enforce Thumbnail '''
-    if 'thumbnail' not in form or not form['thumbnail'] or len(form['thumbnail']) == 0 or 'source'in self.request.FILES: 
-      form['thumbnail'] = self.store_thumbnail(Path(str(form['source'])))
+    ''' Enforce Thumbnail
+        Thumbnail and derivatives are rendered by the media job worker
+        (manage.py process_media_jobs); a new upload drops the thumbnail of
+        the previous file so templates show a placeholder until then.
+    '''
+    render_derivatives = not form['thumbnail'] or 'source' in self.request.FILES
+    if 'source' in self.request.FILES:
+      form['thumbnail'] = None
     ''' Enforce User '''
     if 'user' not in form or not form['user'] or len(form['user']) == 0:
       form['user'] = self.request.user
@@ -165,7 +178,8 @@ class EditImageMaster:
     '''
     defaults = {
       'source': str(form['source']),
-      'thumbnail': str(form['thumbnail']),
+      'thumbnail': str(form['thumbnail']) if form['thumbnail'] else None,
+      'sha256': form['sha256'],
       'title': form['title'],
       'description': form['description'],
       'document_source': form['document_source'],
@@ -189,90 +203,65 @@ class EditImageMaster:
     image.in_group.set(form['in_group'])
     image.attachments.set(form['attachments'])
     image.is_portrait_of__id = form['is_portrait_of']
-    image.height, image.width = image.get_image_dimensions()
-    image.storeSize()
+    ''' Read file metadata once: for a new file, or an image stored before metadata was read
+        Dates the image by its EXIF date taken when no date is given.
+    '''
+    if 'source' in self.request.FILES or not image.metadata_read:
+      if image_metadata.read(image) and image_metadata.fill_date(image):
+        messages.add_message(self.request, messages.INFO, f"{ _('dated image by the date the photo was taken') }: { image.day }-{ image.month }-{ image.year }.")
     image.save()
+    if render_derivatives:
+      derivatives.enqueue([image.pk])
     self.image = image
     messages.add_message(self.request, messages.SUCCESS, f"{ _('sucessfully ' + action + ' information of') } { form['title'] }.")
     ''' Processing succesful; Redirect to success page '''
     return redirect(self.get_success_url())
 
 
-  def get_upload_filename(self, uploaded_file):
-    message = []
-    ''' Get Uploaded File Info '''
-    uploaded_filename = Path(str(uploaded_file))
-    ''' Check extention of file if it can be processed and set the new filename '''
-    if uploaded_filename.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif', '.heic']:
-      ''' New filename format is YYYY-MM-DD-[original filename].[orignial suffix] '''
-      target_filename = Path(datetime.now().strftime(
-          "%Y-%m-%d-") + str(uploaded_filename))
-    else:
-      ''' If the file is of unsupported extention, stop processing '''
+  ''' Get Upload Format
+      Returns the suffix the upload is stored with and if it needs .heic
+      conversion, or None when the file type is not supported.
+  '''
+  def get_upload_format(self, uploaded_file):
+    suffix = Path(str(uploaded_file)).suffix.lower()
+    if suffix not in ['.jpg', '.jpeg', '.png', '.gif', '.heic']:
       messages.add_message(self.request, messages.INFO,
-                           f"{ _('unsupported file type') }: { uploaded_filename.suffix }")
-      return redirect('archive:add-image')
-    ''' Check if .heic-conversion should be done '''
-    heic = False
-    if uploaded_filename.suffix.lower() == '.heic':
-      ''' If a .heic is detected, load heif-opener and add format to target file '''
+                           f"{ _('unsupported file type') }: { escape(suffix) }")
+      return None
+    if suffix == '.heic':
+      ''' If a .heic is detected, load heif-opener and store as jpeg '''
       register_heif_opener()
-      heic = True
-      target_filename = target_filename.with_suffix('.jpg')
-      message.append(f"{ _('detected .heic-image, converting to jpeg') }.")
-    ''' Do Sanity Check
-        - Target Image should not exist
-        - if it does exist, add a number behind the image name
-    '''
-    if settings.MEDIA_ROOT.joinpath(target_filename).exists():
-      message.append(f"{ _('file already exists, selecting a different filename') }.")
-      i = 1
-      while settings.MEDIA_ROOT.joinpath(target_filename).with_name(f"{ target_filename.stem }-{ str(i) }").with_suffix(target_filename.suffix).exists():
-        i += 1
-      target_filename = target_filename.with_name(
-          f"{ target_filename.stem }-{ str(i) }").with_suffix(target_filename.suffix)
-      messages.add_message(self.request, messages.INFO, '<br>'.join(message))
-    return {'filename': target_filename, 'heic': heic}
-  
-  def store_image(self, uploaded_file, target):
-    target_filename = target['filename']
-    heic = target['heic']
-    ''' Store Image to Filesystem '''
-    PIL.MAX_IMAGE_PIXELS = 933120000
-    with PIL.open(uploaded_file) as image:
-      if heic:
-        image = image.save(settings.MEDIA_ROOT / target_filename,
-                           format="JPEG")
-      else:
-        image = image.save(settings.MEDIA_ROOT / target_filename)
+      messages.add_message(self.request, messages.INFO, f"{ _('detected .heic-image, converting to jpeg') }.")
+      return {'suffix': '.jpg', 'heic': True}
+    return {'suffix': suffix, 'heic': False}
+
+  ''' Store Image to Filesystem
+      Supported formats are written as uploaded, chunk by chunk, while their
+      SHA-256 is computed; only .heic is decoded, to convert it to jpeg. The
+      file is stored by content (archive/services/content_store.py), so the
+      same file is kept once. When a new upload matches an existing image,
+      nothing is stored and that image is returned as duplicate.
+      Derivatives are rendered later by the media job worker.
+      Returns (source, sha256, duplicate)
+  '''
+  def store_image(self, uploaded_file, upload, object=None):
+    temporary, sha256 = content_store.receive(uploaded_file, convert_heic=upload['heic'])
+    duplicate = Image.objects.filter(sha256=sha256).exclude(status='x')
+    if object:
+      duplicate = duplicate.exclude(pk=object.pk)
+    duplicate = duplicate.first()
+    if duplicate and not object:
+      content_store.discard(temporary)
+      messages.add_message(self.request, messages.INFO,
+                           f"{ _('this file has been uploaded before as') } { escape(duplicate.title) }.")
+      return None, sha256, duplicate
+    if duplicate:
+      messages.add_message(self.request, messages.WARNING,
+                           f"{ _('this file has also been uploaded as') } { escape(duplicate.title) }.")
+    source = content_store.keep(temporary, sha256, upload['suffix'])
     messages.add_message(self.request, messages.SUCCESS,
-                         f"{ _('sucesfully stored') } { target_filename }.")
-    return target_filename
-  
-  def store_thumbnail(self, stored_file):
-    PIL.MAX_IMAGE_PIXELS = 933120000
-    ''' Store Source Information '''
-    src_file = settings.MEDIA_ROOT.joinpath(stored_file)
-    ''' Store Target Information '''
-    # tgt_width = 300
-    max_width = 300
-    max_height = 500
-    tgt_path = settings.MEDIA_ROOT.joinpath('thumbnails/')
-    tgt_file = str(stored_file.name)
-    ''' Check if thumbnails_dir exists '''
-    if not tgt_path.exists():
-      tgt_path.mkdir(parents=True, exist_ok=True)
-    ''' Set destination '''
-    try:
-      with PIL.open(src_file) as img:
-        img.thumbnail((max_width, max_height), PIL.Resampling.LANCZOS)
-        img.save(settings.MEDIA_ROOT.joinpath(tgt_path).joinpath(tgt_file))
-        messages.add_message(self.request, messages.SUCCESS,
-                             f"{ _('stored thumbnail of image to') }: { str(Path('thumbnails').joinpath(tgt_file)) }")
-        return Path('thumbnails').joinpath(tgt_file)
-    except Exception as e:
-      messages.add_message(self.request, messages.ERROR, f"error when generating thumbnail: { e }")
-      return None
+                         f"{ _('sucesfully stored') } { escape(str(uploaded_file)) }.")
+    return source, sha256, None
 
 class EditImageView(EditImageMaster, UpdateView):
   action = 'edit'
@@ -292,8 +281,7 @@ class RegenerateThumbnailView(EditImageMaster, UpdateView):
   def get(self, *args, **kwargs):
     ''' Set Object'''
     self.object = self.get_object()
-    ''' Store Thumbnail '''
-    self.object.thumbnail = self.store_thumbnail(Path(str(self.object.source)))
-    self.object.save()
-    messages.add_message(self.request, messages.SUCCESS, f"{ _('sucessfully regenerated thumbnail of') } { self.object.title }.")
+    ''' Queue Thumbnail and Derivatives '''
+    derivatives.enqueue([self.object.pk])
+    messages.add_message(self.request, messages.SUCCESS, f"{ _('queued regeneration of thumbnail of') } { self.object.title }.")
     return redirect(self.get_success_url())
\ No newline at end of file
@@ -16,14 +16,18 @@ from archive.models import Group, Tag, Attachment, Person
 from cmnsd.mixins import FilterMixin
 from cmnsd.mixins import RequestMixin
 
+from archive.views.keyset import KeysetPaginationMixin
+from archive.services.image_facets import get_facets
+
 ''' Image List View 
     Show a list of images based on filters
 '''
-class ImageListView(FilterMixin, RequestMixin, ListView):
+class ImageListView(KeysetPaginationMixin, FilterMixin, RequestMixin, ListView):
   model = Image
   template_name = 'archive/images/list.html'
   context_object_name = 'images'
   paginate_by = settings.PAGINATE
+  keyset_ordering = ('-date_created', '-id')  # Also the offset pagination order
   ''' Allow for context to be added by get_queryset '''
   added_context = {}
   
@@ -46,10 +50,13 @@ class ImageListView(FilterMixin, RequestMixin, ListView):
     if self.request.GET.get('family', False):
       context['page_description'] += f" { _('with tagged family members of') } \"{ self.request.GET.get('family')[:1].upper() }{ self.request.GET.get('family')[1:].lower() }\""
       context['current_family'] = self.request.GET.get('family', '')
-    ''' Categories for filtering '''
-    context['categories'] = Image.objects.values_list('category__slug', flat=True).distinct()
+    ''' Facets for filtering, with counts for the current filters '''
+    context['facets'] = self.get_facets()
+    context['categories'] = [category['value'] for category in context['facets']['category']]
     if self.request.GET.get('category', False):
       context['current_category'] = self.request.GET.get('category', '')
+    context['current_tag'] = self.request.GET.get('tag', '')
+    context['current_user'] = self.request.GET.get('user', self.kwargs.get('user', ''))
     ''' Added context, can be placed by get_queryset() '''
     if len(self.added_context) > 0:
       for key in self.added_context:
@@ -64,18 +71,34 @@ class ImageListView(FilterMixin, RequestMixin, ListView):
       'tag': 'tag__slug',
       'user': 'user__username',
       'category': 'category__slug',
+      'family': 'family_collections__family',
+      'familycollection': 'family_collections__family',  # Older links to family collections
     }
     queryset = self.filter(queryset, mapping=mapping)
     ''' Process Custom Query '''
     queryset = self.filter_objects(queryset)
-    queryset = queryset.distinct().order_by('-date_created')
+    ''' Decade browsing uses the indexed decade and date_key columns, newest first '''
+    if 'decade' in self.kwargs:
+      queryset = queryset.filter(decade=floor(int(self.kwargs['decade']) / 10) * 10)
+      self.keyset_ordering = ('-date_key', '-id')
+    queryset = queryset.distinct().order_by(*self.keyset_ordering)
     ''' Store clean count before adding annotations (annotations break paginator COUNT) '''
-    self._clean_count = queryset.count()
+    self._clean_count = self.count(queryset)
     self.added_context['total_images'] = self._clean_count
     self._queryset = queryset.with_counts()
     queryset = queryset.with_counts()
     return queryset
 
+  ''' Facets of the filtered images, cached per set of filters '''
+  def get_facets(self):
+    filters = {
+      'query': sorted((key, values) for key, values in self.request.GET.lists() if key not in ['page', 'cursor']),
+      'kwargs': self.kwargs,
+      'hidden': self.show_hidden_files(),
+      'loved': self.request.user.pk if 'loved' in self.request.GET else None,
+    }
+    return get_facets(self.object_list, filters)
+
   def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
     paginator = super().get_paginator(queryset, per_page, orphans, allow_empty_first_page, **kwargs)
     paginator.count = self._clean_count
@@ -101,13 +124,14 @@ class ImageListView(FilterMixin, RequestMixin, ListView):
   ''' Process Search and Visibility Filter to Queryset '''
   def filter_objects(self, queryset):
     ''' Show or hide hidden images '''
+    hidden_count = self.count(queryset.filter(visibility_frontpage=False))
     if self.show_hidden_files():
       ''' Show how many images can be hidden'''
-      self.added_context['images_hidden'] = queryset.filter(visibility_frontpage=False).count() * -1
+      self.added_context['images_hidden'] = hidden_count * -1
     else:
-      if queryset.filter(visibility_frontpage=False).count() > 0:
+      if hidden_count > 0:
         ''' Show how many images are hidden '''
-        self.added_context['images_hidden'] = queryset.filter(visibility_frontpage=False).count()
+        self.added_context['images_hidden'] = hidden_count
         queryset = queryset.exclude(visibility_frontpage=False)
       else:
         ''' No images available to hide '''
@@ -8,6 +8,7 @@ from .person import *
 from .tag import *
 from .usermanagement import *
 from .tree import *
+from .relationship import *
 from .aComment import *
 from .People import *
 from .Locations import *
\ No newline at end of file
@@ -0,0 +1,31 @@
+from django.conf import settings
+
+from archive.services.keyset import paginate, cached_count
+
+''' KeysetPaginationMixin
+    Opt-in keyset pagination for ListViews ordered on keyset_ordering.
+    Active when the request carries a ?cursor= token, or when
+    settings.KEYSET_PAGINATION is enabled and no ?page= number is passed,
+    so old page links keep working.
+    In keyset mode page_obj is a KeysetPage (no paginator) and counts made
+    through self.count() are cached for a short while.
+'''
+class KeysetPaginationMixin:
+  keyset_ordering = ('-date_created', '-id')
+
+  def use_keyset(self) -> bool:
+    if 'cursor' in self.request.GET:
+      return True
+    return getattr(settings, 'KEYSET_PAGINATION', False) and 'page' not in self.request.GET
+
+  def count(self, queryset) -> int:
+    if self.use_keyset():
+      return cached_count(queryset)
+    return queryset.count()
+
+  def paginate_queryset(self, queryset, page_size):
+    if not self.use_keyset():
+      return super().paginate_queryset(queryset, page_size)
+    page = paginate(queryset, self.keyset_ordering, page_size, self.request.GET.get('cursor'))
+    page.count = getattr(self, '_clean_count', None)
+    return (None, page, page.object_list, page.has_other_pages())
@@ -23,7 +23,8 @@ from django.contrib.auth.mixins import PermissionRequiredMixin
 from datetime import date
 from math import floor
 
-from ..person_utils import get_person_filters, get_centuries, get_decades
+from ..person_utils import get_person_filters, filter_period
+from archive.services.person_facets import get_facets
 
 from archive.models import Person, FamilyRelations, Image, Event
 
@@ -32,6 +33,8 @@ from cmnsd.mixins import RequestMixin
 from cmnsd.mixins import ResponseMixin
 from cmnsd.mixins import MessageMixin
 
+from archive.views.keyset import KeysetPaginationMixin
+
 ''' Class Functions '''
 ''' get_fields()
     Returns a list of fields to use in formsets
@@ -47,10 +50,11 @@ def get_fields():
     as show/hide hidden and pagination.
     The Person is added via Context.
 '''
-class PersonView(ListView):
+class PersonView(KeysetPaginationMixin, ListView):
   model = Image
   template_name = 'archive/people/detail.html'
   paginate_by = settings.PAGINATE
+  keyset_ordering = ('date_created', 'id')
   added_context = {}
   
   def get_person(self):
@@ -100,16 +104,16 @@ class PersonView(ListView):
     ''' Always remove deleted images '''
     queryset = queryset.filter(status='p')
     ''' Show or hide hidden files '''
+    hidden_count = self.count(queryset.filter(visibility_person_page=False))
     if not self.show_hidden_files():
-      hidden_count = queryset.filter(visibility_person_page=False).count()
       if hidden_count > 0:
         self.added_context['images_hidden'] = hidden_count
         queryset = queryset.exclude(visibility_person_page=False)
       else:
         self.added_context['images_hidden'] = False
     else:
-      self.added_context['images_hidden'] = queryset.filter(visibility_person_page=False).count() * -1
-    self._clean_count = queryset.count()
+      self.added_context['images_hidden'] = hidden_count * -1
+    self._clean_count = self.count(queryset)
     self.added_context['count_images'] = self._clean_count
     ''' Order images, then annotate (annotations break paginator COUNT) '''
     queryset = queryset.order_by('date_created').with_counts()
@@ -133,6 +137,14 @@ class PersonListView(FilterMixin, RequestMixin, ListView):
   translate_orderby = {
     'last_name': 'achternaam',
     'first_names': 'voornaam',
+    'first_name': 'voornaam',
+    'year_of_birth': 'geboortejaar',
+  }
+  ''' Ordering per order_by option; year_of_birth uses the indexed birth date columns '''
+  orderings = {
+    'last_name': ('last_name', 'first_names'),
+    'first_name': ('first_names', 'last_name'),
+    'year_of_birth': ('birth_year', 'birth_month', 'birth_day', 'last_name', 'first_names'),
   }
 
   ''' Check if a current filters are different than default values '''
@@ -147,14 +159,17 @@ class PersonListView(FilterMixin, RequestMixin, ListView):
     context['active_page'] = 'people'
     context['filters'] = get_person_filters(self.request)
     context['deactivated_filters'] = []
-    context['available_centuries'] = get_centuries(self.get_queryset())
-    context['available_decades'] = get_decades(self.get_queryset())
+    facets = self.get_facets()
+    context['facets'] = facets
+    context['available_centuries'] = facets['centuries']
+    context['available_decades'] = facets['decades']
     context['available_families'] = settings.FAMILIES
+    context['family_options'] = [(family, facets['families'].get(family, 0)) for family in settings.FAMILIES]
     #context['all_people'] = Person.objects.all()
     ''' Page description
         is dynamically describing active filters
     '''
-    context['page_description'] = f'Overzicht van {str(self.get_queryset().count())} personen in de familie'
+    context['page_description'] = f'Overzicht van {str(facets["count"])} personen in de familie'
     if context['filters']['family']:
       context['page_description'] += f" {str(context['filters']['family'])[:1].upper()}{str(context['filters']['family'])[1:].lower()}"
     if context['filters']['has_photo']:
@@ -171,6 +186,14 @@ class PersonListView(FilterMixin, RequestMixin, ListView):
       context['page_description'] += f" gesorteerd op \"{ self.translate_orderby[context['filters']['order_by']]}\""
     return context
 
+  ''' Facets for the filter dropdowns, cached per set of filters '''
+  def get_facets(self):
+    filters = {
+      'query': sorted((key, values) for key, values in self.request.GET.lists() if key not in ['page', 'order_by']),
+      'staff': self.request.user.is_staff,
+    }
+    return get_facets(self.get_queryset(), filters)
+
   def get_queryset(self):
     # Return cached queryset if available
     if hasattr(self, 'queryset') and self.queryset is not None:
@@ -178,7 +201,11 @@ class PersonListView(FilterMixin, RequestMixin, ListView):
     # Build initial queryset
     self.queryset = Person.objects.optimized_list()
     self.queryset = self.filter(self.queryset, mapping={})
-    self.queryset = self.queryset.distinct().order_by('last_name', 'first_names')
+    filters = get_person_filters(self.request)
+    ''' Period filters join the indexed PersonDecade table '''
+    self.queryset = filter_period(self.queryset, filters)
+    order_by = filters['order_by']
+    self.queryset = self.queryset.distinct().order_by(*self.orderings.get(order_by, self.orderings['last_name']))
     return self.queryset
     
 
@@ -436,36 +463,6 @@ class SuggestFamilyView(RequestMixin, FilterMixin, ResponseMixin, MessageMixin,
     """
     PersonModel = self.__class__
 
-    # --------------------------------------------------
-    # Subject birth / death (single-row subqueries)
-    # --------------------------------------------------
-    subject_birth = (
-      Event.objects
-      .filter(people=self.get_object(), type="birth")
-      .values("year")[:1]
-    )
-
-    subject_death = (
-      Event.objects
-      .filter(people=self.get_object(), type="death")
-      .values("year")[:1]
-    )
-
-    # --------------------------------------------------
-    # Candidate birth / death (per-row subqueries)
-    # --------------------------------------------------
-    candidate_birth = (
-      Event.objects
-      .filter(people=OuterRef("pk"), type="birth")
-      .values("year")[:1]
-    )
-
-    candidate_death = (
-      Event.objects
-      .filter(people=OuterRef("pk"), type="death")
-      .values("year")[:1]
-    )
-
     # --------------------------------------------------
     # Shared family (indirect relationship)
     # --------------------------------------------------
@@ -496,31 +493,24 @@ class SuggestFamilyView(RequestMixin, FilterMixin, ResponseMixin, MessageMixin,
       )
     )
 
-    # Add birth/death year annotations
-    qs = qs.annotate(
-      candidate_birth_year=Subquery(candidate_birth, IntegerField()),
-      candidate_death_year=Subquery(candidate_death, IntegerField()),
-      subject_birth_year=Subquery(subject_birth, IntegerField()),
-      subject_death_year=Subquery(subject_death, IntegerField()),
-    )
-
     # +1 if alive during subject's lifespan
-    qs = qs.annotate(
-      candidate_death_year_norm=Coalesce("candidate_death_year", Value(9999)),
-      subject_death_year_norm=Coalesce("subject_death_year", Value(9999)),
-    )
-
-    qs = qs.annotate(
-      relevance=F("relevance") + Case(
-        When(
-          candidate_birth_year__lte=F("subject_death_year_norm"),
-          candidate_death_year_norm__gte=F("subject_birth_year"),
-          then=Value(1),
-        ),
-        default=Value(0),
-        output_field=IntegerField(),
+    # Birth and death years are stored on Person, so this compares columns
+    subject = self.get_object()
+    if subject.birth_year:
+      qs = qs.annotate(
+        candidate_death_year_norm=Coalesce("death_year", Value(9999)),
+      )
+      qs = qs.annotate(
+        relevance=F("relevance") + Case(
+          When(
+            birth_year__lte=subject.death_year or 9999,
+            candidate_death_year_norm__gte=subject.birth_year,
+            then=Value(1),
+          ),
+          default=Value(0),
+          output_field=IntegerField(),
+        )
       )
-    )
 
     # +1 if shared indirect family member
     qs = qs.annotate(
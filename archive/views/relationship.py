@@ -0,0 +1,68 @@
+from django.views.generic import DetailView
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.translation import gettext as _
+
+from archive.models import Person
+from archive.services.relationships import get_relationship
+
+
+''' RelationshipView
+    Shows how two people are related: the relationship name and the path
+    of people in between, found with one bounded search of the family graph.
+    With ?format=json the result is returned as JSON.
+'''
+class RelationshipView(DetailView):
+  model = Person
+  template_name = 'archive/people/relationship.html'
+  context_object_name = 'person'
+
+  def get_other(self):
+    if not hasattr(self, '_other'):
+      self._other = get_object_or_404(Person, pk=self.kwargs['other'])
+    return self._other
+
+  def get_relationship(self):
+    ''' Relationship with the people on the path, loaded in one query '''
+    relationship = get_relationship(self.get_object(), self.get_other())
+    if relationship:
+      people = Person.objects.in_bulk(relationship['path'])
+      relationship['people'] = [people[id] for id in relationship['path'] if id in people]
+      ''' Highest person on the path; their family tree contains both people '''
+      top = 0
+      while top < len(relationship['steps']) and relationship['steps'][top] == 'up':
+        top += 1
+      relationship['ancestor'] = people.get(relationship['path'][top])
+    return relationship
+
+  def get(self, request, *args, **kwargs):
+    if request.GET.get('format', None) == 'json':
+      if not request.user.has_perm('archive.view_person'):
+        return JsonResponse({'error': True, 'message': _('you do not have access to people').capitalize()})
+      relationship = self.get_relationship()
+      if not relationship:
+        return JsonResponse({'error': False, 'message': _('no relationship found').capitalize(), 'payload': None})
+      steps = [None] + relationship['steps']
+      return JsonResponse({
+        'error': False,
+        'message': '',
+        'payload': {
+          'name': relationship['name'],
+          'distance': relationship['distance'],
+          'blood': relationship['blood'],
+          'path': [{
+            'id': person.id,
+            'name': person.full_name(),
+            'url': str(person.get_absolute_url()),
+            'step': step,
+          } for person, step in zip(relationship['people'], steps)],
+        },
+      })
+    return super().get(request, *args, **kwargs)
+
+  def get_context_data(self, **kwargs):
+    context = super().get_context_data(**kwargs)
+    context['active_page'] = 'people'
+    context['other'] = self.get_other()
+    context['relationship'] = self.get_relationship()
+    return context
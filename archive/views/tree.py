@@ -1,115 +1,283 @@
 from django.views.generic import DetailView, ListView
 from django.utils.html import escape
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.translation import gettext as _
+
+from collections import deque
+from html import unescape
 
-import graphviz
 from math import floor
 
 from archive.models import Person
+from archive.services import avatars
+from archive.services.family_graph import family_graph
+from archive.services.family_relations import birth_sort_key
+from archive.services.tree_cache import get_rendered_tree
+from archive.services.tree_layout import TreeLayout
 
 
 ''' Tree
     Builds a family tree based off an ancestor.
+    The connected subgraph (the ancestor, their partners and children, and
+    recursively the partners and children of those) is collected from the
+    family graph without queries, then all people in it are loaded in one
+    query (birth and death dates are stored on Person). The DOT source is built
+    from the indexed dicts below, so the number of queries does not grow with
+    the size of the tree.
     Requires a Person-object with the following methods:
     ## Displaying
     - full_name - Returns the persons displayable full name
-    - get_lifespan - Returns a string with the persons 
+    - get_lifespan - Returns a string with the persons
       year of birth and -death, if known or applicable
-    ## Logic
-    - get_partners() - Returns a list of people-objects that have a
-      partner-like relationship, either partner, ex-partner or share
-      kids.
-    - get_children() - Returns a list of people-objects who are children of this person
-    - get_siblings() - Returns a list of people-objects that share at
-      least one parent
+    - avatar_key - Key of the rendered portrait avatar, '' without
+    ## Rendering
+    The SVG is rendered by the built-in layered layout (TreeLayout) unless
+    settings.TREE_LAYOUT_BACKEND is 'graphviz'. Graphviz is optional: when
+    the package or the dot executable is missing, the built-in layout is used.
 '''
 class Tree:
   ''' Initialize Graphviz Family Tree
   '''
-  def __init__(self, ancestor, direction='down') -> None:
+  def __init__(self, ancestor, direction='down', backend=None, depth=None, render=True) -> None:
     ''' Configurations '''
+    self.ancestor_id = ancestor.id
+    self.backend = backend or getattr(settings, 'TREE_LAYOUT_BACKEND', 'builtin')
+    self.depth = depth
     self.indent = 0
     self.spacer = 8
     self.gender_colours = {'m': 'lightblue', 'f': 'pink'}
     ''' Tree Components '''
     self.people = {}
     self.relations =[]
-    self.processed_relations = []
+    self.processed_relations = {}
+    self.processed_people = set()
     self.ranks = {}
     self.nodes = {}
     self.mountpoints = {}
+    self.collapsed = set()
+    ''' Load people and relations in bulk '''
+    self.load(ancestor)
+    if not render:
+      return
     ''' Initialize Tree '''
-    ''' Populate adds one person, the partner and the children 
+    ''' Populate adds one person, the partner and the children
         of this person to the list, then initiates the same process
         for each child.
     '''
-    self.populate(ancestor)
+    self.populate(ancestor.id)
     self.get_people()
-    self.set_relations(ancestor)
+    self.set_relations(ancestor.id)
     self.get_relations()
     self.close()
     self.get_tree_source(ancestor)
-    
 
-  def populate(self, person):
-    if person.id not in self.people:
+  ''' load()
+      Collect the connected subgraph from the family graph and fetch all
+      people in it at once. Partners and children are stored per person id,
+      ordered by date of birth like Person.get_partners() and get_children().
+      Generations are assigned breadth-first, a whole generation (with the
+      partners of its people) before the next, so everyone gets the
+      generation of their shortest line to the ancestor.
+      With a depth, only that many generations are collected; people in the
+      last generation whose children were left out are stored in
+      self.collapsed, so they can be expanded later.
+  '''
+  def load(self, ancestor):
+    generation = {ancestor.id: 0}
+    level = deque([ancestor.id])
+    boundary = []
+    while level:
+      ''' Partners are of the same generation: complete it first '''
+      members = []
+      while level:
+        id = level.popleft()
+        members.append(id)
+        for partner in family_graph.partners(id):
+          if partner not in generation:
+            generation[partner] = generation[id]
+            level.append(partner)
+      ''' Then their children form the next generation '''
+      for id in members:
+        if self.depth is not None and generation[id] + 1 >= self.depth:
+          boundary.append(id)
+          continue
+        for child in family_graph.children(id):
+          if child not in generation:
+            generation[child] = generation[id] + 1
+            level.append(child)
+    ids = set(generation)
+    self.collapsed = {id for id in boundary if not ids.issuperset(family_graph.children(id))}
+    self.persons = {person.id: person for person in Person.objects.filter(pk__in=ids)}
+    position = {id: index for index, id in enumerate(self.persons)}
+
+    def ordered(related_ids):
+      related = [self.persons[id] for id in related_ids if id in self.persons]
+      related.sort(key=lambda person: (birth_sort_key(person), position[person.id]))
+      return [person.id for person in related]
+
+    self.partner_ids = {}
+    self.children_ids = {}
+    self.parent_ids = {}
+    for id in self.persons:
+      self.partner_ids[id] = ordered(family_graph.partners(id))
+      self.children_ids[id] = ordered(family_graph.children(id))
+      self.parent_ids[id] = family_graph.parents(id)
+
+  ''' populate()
+      Depth-first: person, then partners, then children. Iterative so deep
+      trees do not hit the recursion limit.
+  '''
+  def populate(self, id):
+    stack = [id]
+    while stack:
+      id = stack.pop()
+      if id in self.people or id not in self.persons:
+        continue
       ''' Person has not been processed yet, so can be created '''
+      person = self.persons[id]
       ''' Store Person in People '''
-      self.people[person.id] = {
+      self.people[id] = {
         'label':     f"<<b>{ person.full_name() }</b><BR/> { person.get_lifespan() }>",
         'gender':    f"\"{ person.get_gender_display() }\"",
         'color':     f"\"{ self.gender_colours[person.gender] if person.gender in self.gender_colours else 'black' }\"",
       }
-      ''' Add Related People '''
-      for partner in person.get_partners():
-        self.populate(partner)
-      for child in person.get_children():
-        self.populate(child)
+      if id in self.collapsed:
+        ''' Children not shown in this tree: double border '''
+        self.people[id]['peripheries'] = '2'
+      if person.avatar_key:
+        ''' Part of the source, so the cached render is replaced when the avatar changes '''
+        self.people[id]['comment'] = f"\"avatar { person.avatar_key }\""
+      ''' Add Related People, in reverse so they are processed in order '''
+      stack.extend(reversed(self.partner_ids[id] + self.children_ids[id]))
 
-  def set_relations(self, person):
+  def set_relations(self, id):
+    ''' Each person is only laid out once, also when related through several lines '''
+    if id in self.processed_people:
+      return
+    self.processed_people.add(id)
     ''' Check if Person Partner Relations need to be set '''
-    self.relations.append(f"subgraph cluster_{ person.id } {{")
+    self.relations.append(f"subgraph cluster_{ id } {{")
     self.relations.append(f"style=\"invis\";")
-    if len(person.get_partners()) > 0:
+    if len(self.partner_ids[id]) > 0:
       ''' Person has relation(s): Build relationship '''
       reverse = False
-      for partner in person.get_partners():
-        relation_id = self.get_relation_id([person, partner])
-        relation = ['P' + str(person.id), 'P' + str(partner.id)]
+      for partner in self.partner_ids[id]:
+        relation_id = self.get_relation_id([id, partner])
+        relation = ['P' + str(id), 'P' + str(partner)]
         if relation_id not in self.processed_relations:
-          if self.share_children(person, partner):
+          if self.share_children(id, partner):
             mountpoint = 'P'+relation_id
-            self.set_mountpoint(mountpoint, [person, partner, relation_id])
+            self.set_mountpoint(mountpoint, [id, partner, relation_id])
             relation.insert(floor(len(relation)/2), mountpoint)
           self.ranks[relation_id] = relation
           if reverse:
             relation.reverse()
           self.relations.append(' -> '.join(relation))
           reverse = False if reverse else True
-          self.processed_relations.append(relation_id)
+          self.processed_relations[relation_id] = True
     else:
       ''' Person has no relation '''
-      self.set_mountpoint('P'+str(person.id), person)
+      self.set_mountpoint('P'+str(id), id)
     ''' Process Person's Children '''
-    for child in person.get_children():
-      mountpoint = 'P' + self.get_relation_id(child.get_parents())
-      self.relations.append(' -> '.join([mountpoint, 'P'+str(child.id)]))
+    for child in self.children_ids[id]:
+      mountpoint = 'P' + self.get_relation_id(self.parent_ids[child])
+      self.relations.append(' -> '.join([mountpoint, 'P'+str(child)]))
       ''' Add Child information to node as well '''
       self.set_relations(child)
     self.relations.append('}')
 
-      
-  
+
+
+  ''' get_tree_source()
+      Renders the tree to SVG through the content-addressed render cache;
+      the layout only runs when this exact tree was not rendered before.
+      The SVG path, relative to MEDIA_ROOT, is stored in self.svg.
+  '''
   def get_tree_source(self, ancestor):
     newline = '\n'
     graph = ''
     graph = newline.join(self.tree)
-    dot = graphviz.Source(graph)
-    dot.name = 'fmly-tree'
-    dot.format = 'svg'
-    dot.filename = str(ancestor.id)
-    dot.render(directory='public/documents/forest/')
+    if self.backend == 'graphviz':
+      try:
+        self.svg = get_rendered_tree(graph)
+      except (ImportError, RuntimeError):
+        ''' graphviz package or dot executable not available '''
+        self.backend = 'builtin'
+    if self.backend != 'graphviz':
+      self.svg = get_rendered_tree(graph, render=lambda: self.layout().as_svg().encode('utf-8'), backend='builtin')
     return f"<pre>{ newline }{ graph }{ newline }</pre>"
 
+  ''' layout()
+      Built-in layered layout of this tree, computed once
+  '''
+  def layout(self):
+    if not hasattr(self, '_layout'):
+      self._layout = TreeLayout(self)
+    return self._layout
+
+  ''' get_avatar(), get_avatar_url()
+      Avatar of a person for the built-in layout; in the SVG as data URI,
+      as it is shown in an <img>, which loads no other files
+  '''
+  def get_avatar(self, id):
+    return avatars.data_uri(self.persons[id])
+  def get_avatar_url(self, id):
+    return self.persons[id].avatar_url(avatars.get_size(avatars.TREE_SIZE))
+
+  ''' get_collapsed()
+      People whose children are beyond the shown generations, by birth
+  '''
+  def get_collapsed(self):
+    return sorted((self.persons[id] for id in self.collapsed), key=birth_sort_key)
+
+  ''' branch()
+      Nested subtree of the ancestor for lazy expansion: per person the
+      partners, the mountpoints (children grouped by their set of parents)
+      and the children, each with their own branch. People whose children
+      are beyond the loaded depth have expandable set; people reached
+      through more than one line are only expanded the first time.
+  '''
+  def branch(self, id=None):
+    def describe(person):
+      return {
+        'id': person.id,
+        'name': person.full_name(),
+        'lifespan': unescape(person.get_lifespan()),
+        'gender': person.gender,
+        'url': str(person.get_absolute_url()),
+        'tree': reverse('archive:tree', kwargs={'pk': person.id}),
+        'avatar': person.avatar_url(avatars.get_size(avatars.TREE_SIZE)),
+        'expandable': person.id in self.collapsed,
+      }
+
+    root = {}
+    seen = set()
+    stack = [(id or self.ancestor_id, root)]
+    while stack:
+      id, node = stack.pop()
+      node.update(describe(self.persons[id]))
+      if id in seen:
+        node['repeated'] = True
+        continue
+      seen.add(id)
+      node['partners'] = [describe(self.persons[partner]) for partner in self.partner_ids[id]]
+      node['mountpoints'] = []
+      node['children'] = []
+      mountpoints = {}
+      for child in self.children_ids[id]:
+        parents = sorted(self.parent_ids[child])
+        mountpoint = 'P' + self.get_relation_id(parents)
+        if mountpoint not in mountpoints:
+          mountpoints[mountpoint] = {'id': mountpoint, 'parents': parents, 'children': []}
+          node['mountpoints'].append(mountpoints[mountpoint])
+        mountpoints[mountpoint]['children'].append(child)
+        node['children'].append({})
+      for child, child_node in reversed(list(zip(self.children_ids[id], node['children']))):
+        stack.append((child, child_node))
+    return root
+
   ''' open()
       The starting lines to open the digraph
   '''
@@ -125,9 +293,9 @@ class Tree:
     self.add(attributes)
   def close(self):
     self.add('}')
-  
+
   ''' add()
-      Add a line to the data buffer. Accepts lists and dicts, ints and strings, 
+      Add a line to the data buffer. Accepts lists and dicts, ints and strings,
       but only stores content as a string.
   '''
   def add(self, data):
@@ -152,50 +320,40 @@ class Tree:
         self.indent += -2
 
 
+  ''' get_relation_id()
+      Accepts person ids or Person objects
+  '''
   def get_relation_id(self, people):
     relation = []
     for person in people:
-      relation.append(person.id)
+      relation.append(person if type(person) is int else person.id)
     relation.sort()
     return str('x'.join(str(id) for id in relation))
   ''' Get Shared Children '''
   def share_children(self, person, partner):
-    for child in person.get_children():
-      if child in partner.get_children():
-        return True
-    return False
+    return not set(self.children_ids.get(person, ())).isdisjoint(self.children_ids.get(partner, ()))
   def get_shared_children(self, person, partner=None):
-    children = []
     if type(person) == list:
       if len(person) > 1:
         partner = person[1]
       person = person[0]
-    for child in person.get_children():
-      if child not in children and partner in child.get_parents():
-        children.append(child)
-    if partner:
-      for child in partner.get_children():
-        if child not in children and person in child.get_parents():
-          children.append(child)
-    return children
+    shared = set(self.children_ids.get(partner, ())) if partner is not None else set()
+    return [child for child in self.children_ids.get(person, ()) if child in shared]
   ''' Mountpoints '''
   def get_mountpoint(self, person):
     if type(person) == list:
-      person = 'x'.join(str(id.id) for id in person)
+      person = 'x'.join(str(id) for id in person)
       self.add(f'# --> { person }')
-    if type(person) != str:
-      person = person.id
+    person = str(person)
     if person in self.mountpoints:
       return self.mountpoints[person]
-    return 'P' + str(person)
+    return 'P' + person
   def set_mountpoint(self, mountpoint, person):
     if type(person) == list:
       for p in person:
         self.set_mountpoint(mountpoint, p)
     else:
-      if type(person) != str:
-        person = str(person.id)
-      self.mountpoints[person] = mountpoint
+      self.mountpoints[str(person)] = mountpoint
 
 
   ''' Populate_people() '''
@@ -228,29 +386,85 @@ class Tree:
     self.add('# Processed Relations')
     for line in self.processed_relations:
       self.add('# ' + str(line))
-  
+
 ''' End of class Tree '''
 
 
 
-''' TreeView 
+''' TreeView
     Uses DetailView to select an ancestor, then initiates the
     tree building process from this ancestor.
+    With ?format=json the node and edge coordinates of the built-in layout
+    are returned instead of the page.
+    ?depth= limits the number of generations shown (default
+    settings.TREE_DEPTH), so the render cost is bounded by what is visible.
 '''
 class TreeView(DetailView):
   model = Person
   template_name = 'archive/people/tree.html'
   context_object_name = 'person'
 
+  def get(self, request, *args, **kwargs):
+    if request.GET.get('format', None) == 'json':
+      if not request.user.has_perm('archive.view_person'):
+        return JsonResponse({'error': True, 'message': _('you do not have access to people').capitalize()})
+      self.object = self.get_object()
+      tree = Tree(ancestor=self.object, backend='builtin', depth=get_depth(request, self.default_depth()))
+      return JsonResponse(tree.layout().as_dict())
+    return super().get(request, *args, **kwargs)
+
+  def default_depth(self):
+    return getattr(settings, 'TREE_DEPTH', None)
+
   def get_context_data(self, **kwargs):
     context = super().get_context_data(**kwargs)
     context['active_page'] = 'people'
     ''' Tree '''
-    tree =  Tree(ancestor=self.get_object())
+    depth = get_depth(self.request, self.default_depth())
+    tree =  Tree(ancestor=self.get_object(), depth=depth)
     context['tree'] = tree
+    context['depth'] = depth
+    context['depth_options'] = [2, 4, 6, 8]
     return context
 
 
+''' TreeBranchView
+    JSON subtree of one person for lazy expansion of the tree: partners,
+    co-parent mountpoints and children, nested ?depth= generations deep
+    (default 2: the person and their children). Only the generations asked
+    for are loaded.
+'''
+class TreeBranchView(DetailView):
+  model = Person
+
+  def get(self, request, *args, **kwargs):
+    if not request.user.has_perm('archive.view_person'):
+      return JsonResponse({'error': True, 'message': _('you do not have access to people').capitalize()})
+    self.object = self.get_object()
+    tree = Tree(ancestor=self.object, depth=get_depth(request, 2), render=False)
+    return JsonResponse({
+      'error': False,
+      'message': '',
+      'payload': tree.branch(),
+    })
+
+
+''' get_depth()
+    Number of generations to show from ?depth=; 'all' or 0 shows everything
+'''
+def get_depth(request, default=None):
+  depth = request.GET.get('depth', None)
+  if depth is None:
+    return default
+  if depth == 'all':
+    return None
+  try:
+    depth = int(depth)
+  except ValueError:
+    return default
+  return depth if depth > 0 else None
+
+
 
 
 
@@ -69,6 +69,10 @@ TEMPLATES = [
         'cmnsd.templatetags.humanize_date',
         'cmnsd.templatetags.cmnsd',
       ],
+      'libraries': {
+        'filename': 'templatetags.filename',  # {% load filename %}
+        'avatar': 'templatetags.avatar',  # {% load avatar %}
+      },
     },
   },
 ]
@@ -124,12 +128,24 @@ META_DESCRIPTION = env('META_DESCRIPTION', default='An archive with photos and d
 MASTER_CSS = env('MASTER_CSS', default='fmly.css')
 FAMILIES = env.list('FAMILIES', default=['Coomans', 'Bake'])
 PAGINATE = 24
+KEYSET_PAGINATION = env.bool('KEYSET_PAGINATION', default=False)  # Cursor pagination for image lists; ?cursor= always opts in
+PAGINATION_COUNT_TIMEOUT = env.int('PAGINATION_COUNT_TIMEOUT', default=300)  # Seconds totals are cached in keyset mode
 UNAUTHENTICATED_WELCOME = "Fmly.cmns.nl is een archief met foto's en documenten van de familie Coomans, Bake en voorouderen."
 OBJECT_FORM_FIELDS = ['tag', 'in_group', 'attachments', 'is_portrait_of']
 PEOPLE_ORDERBY_OPTIONS = ['last_name', 'first_name', 'year_of_birth']
 PEOPLE_ORDERBY_DEFAULT = 'last_name'
 NEW_USER_DEFAULT_GROUP = 'familie - kijken'
 MIN_COMMENT_LENGTH = 4
+TREE_CACHE_MAX_SIZE = env.int('TREE_CACHE_MAX_SIZE', default=100 * 1024 * 1024)  # Disk quota for rendered family trees, in bytes
+TREE_LAYOUT_BACKEND = env.str('TREE_LAYOUT_BACKEND', default='builtin')  # 'builtin' or 'graphviz'
+TREE_DEPTH = env.int('TREE_DEPTH', default=4) or None  # Generations shown in a family tree by default, 0 for all
+DERIVATIVE_WIDTHS = env.list('DERIVATIVE_WIDTHS', cast=int, default=[320, 640, 1280, 1920])  # Image widths rendered for srcset
+DERIVATIVE_FORMATS = ['webp', 'jpeg']
+DERIVATIVE_QUALITY = env.int('DERIVATIVE_QUALITY', default=82)
+MEDIA_WORKERS = env.int('MEDIA_WORKERS', default=0)  # Rendering processes of process_media_jobs, 0 for one per CPU
+NEAR_DUPLICATE_DISTANCE = env.int('NEAR_DUPLICATE_DISTANCE', default=6)  # Differing bits (of 64) between perceptual hashes of possible duplicates
+AVATAR_SIZES = [32, 48, 64, 96]  # Square portrait sizes, 1x and 2x of the 32 (tree, family) and 48 (people list) pixel avatars
+DEEP_ZOOM_PIXELS = env.int('DEEP_ZOOM_PIXELS', default=16_000_000)  # Images of at least this many pixels get a deep zoom tile pyramid
 
 # CMNSD
 SITE_NAME = 'Vakantieplanner DEVELOPMENT'
@@ -0,0 +1,24 @@
+from django import template
+
+
+register = template.Library()
+
+''' Avatar
+    Square portrait of a person at size CSS pixels, with the 2x render for
+    high density screens (archive/services/avatars.py). People without
+    avatar get an empty circle of the same size, so names stay aligned.
+    Usage: {% load avatar %}{% avatar person 48 %}
+'''
+@register.inclusion_tag('archive/snippets/avatar.html')
+def avatar(person, size=48, css_class=''):
+    from archive.services import avatars, derivatives
+    context = {'person': person, 'size': size, 'class': css_class}
+    if not person.avatar_key:
+        return context
+    renders = {scale: avatars.get_size(size * scale) for scale in (1, 2)}
+    context['src'] = person.avatar_url(renders[1])
+    context['srcset'] = {
+        format: ', '.join(f"{ person.avatar_url(render, format) } { scale }x" for scale, render in renders.items())
+        for format in derivatives.formats()
+    }
+    return context
@@ -5,31 +5,32 @@ from django import template
 
 register = template.Library()
 
+''' Image filters
+    Served from the dimensions stored on Image, never from the file: value
+    is an Image or one of its files (image.source). Images without stored
+    dimensions return None and get a metadata media job queued.
+'''
+def get_image(value):
+    from archive.models import Image
+    if isinstance(value, Image):
+        return value
+    return value.instance if isinstance(getattr(value, 'instance', None), Image) else None
+
 @register.filter
 def filename(value):
-    return os.path.basename(value.file.name)
+    return os.path.basename(value.name)
 
 @register.filter
 def imagedimensions(value):
-    from PIL import Image
-    try:
-        image = Image.open(value)
-        width, height = image.size
-        return str(width) + 'x' + str(height)
-    except:
-        return None
+    image = get_image(value)
+    return image.dimensions() if image else None
 
 @register.filter
 def imageorientation(value):
-    from PIL import Image
-    try:
-        image = Image.open(value)
-        width, height = image.size
-        if width == height:
-            return 'square'
-        elif width > height:
-            return landscape
-        else:
-            return 'portrait'
-    except:
-        return None
+    image = get_image(value)
+    return image.shape() if image else None
+
+@register.filter
+def imageaspectratio(value):
+    image = get_image(value)
+    return image.aspect_ratio() if image else None